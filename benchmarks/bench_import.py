@@ -0,0 +1,90 @@
+"""
+Measure the import time of the package in fresh interpreters and check which dependencies it loads.
+
+    python benchmarks/bench_import.py
+    python benchmarks/bench_import.py --runs 20 --json
+    python benchmarks/bench_import.py --max-ms 50
+
+Scenarios: Flask alone (the floor, any app imports it), the bare package, FlaskKeycloak and the dependencies the
+package defers (PyJWT, python-keycloak). For each one: median/min import time over ``--runs`` interpreters and the
+deferred modules found loaded afterwards. The exit status is 1 if the package or FlaskKeycloak import loads a deferred
+module, or if their median exceeds ``--max-ms`` (on top of Flask's).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules only imported once the package is built.
+DEFERRED = ("jwt.api_jwt", "keycloak.keycloak_openid", "requests.sessions", "dash.dash")
+
+SCENARIOS = {
+    "flask": ("import flask", False),
+    "package": ("import dash_flask_keycloak", True),
+    "FlaskKeycloak": ("from dash_flask_keycloak import FlaskKeycloak", True),
+    "jwt+keycloak": ("import jwt, keycloak", False),
+}
+
+_PROBE = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - started
+print(json.dumps(dict(seconds=seconds, loaded=[name for name in {deferred!r} if name in sys.modules])))
+"""
+
+
+def measure(statement):
+    probe = _PROBE.format(root=ROOT, statement=statement, deferred=DEFERRED)
+    output = subprocess.run([sys.executable, "-c", probe], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def run(statement, runs):
+    samples = [measure(statement) for _ in range(runs)]
+    times = [sample["seconds"] * 1000 for sample in samples]
+    return dict(median_ms=statistics.median(times), min_ms=min(times),
+                loaded=sorted({name for sample in samples for name in sample["loaded"]}))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="fresh interpreters per scenario")
+    parser.add_argument("--max-ms", type=float, default=None, help="max median ms of the package imports over Flask's")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args(argv)
+
+    results = {name: run(statement, args.runs) for name, (statement, _) in SCENARIOS.items()}
+    failures = []
+    for name, (_, checked) in SCENARIOS.items():
+        if not checked:
+            continue
+        if results[name]["loaded"]:
+            failures.append(f"{name} loads {', '.join(results[name]['loaded'])}")
+        overhead = results[name]["median_ms"] - results["flask"]["median_ms"]
+        if args.max_ms is not None and overhead > args.max_ms:
+            failures.append(f"{name} takes {overhead:.1f} ms more than flask (max {args.max_ms:.1f} ms)")
+    report = dict(runs=args.runs, scenarios=results, failures=failures)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"python {sys.version.split()[0]}, {args.runs} runs per scenario")
+        print(f"{'scenario':<16}{'median ms':>11}{'min ms':>10}  deferred modules loaded")
+        for name, result in results.items():
+            loaded = ", ".join(result["loaded"]) or "-"
+            print(f"{name:<16}{result['median_ms']:>11.1f}{result['min_ms']:>10.1f}  {loaded}")
+        for failure in failures:
+            print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    return report
+
+
+if __name__ == "__main__":
+    main()
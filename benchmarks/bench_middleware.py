@@ -0,0 +1,167 @@
+"""
+Measure the overhead of AuthMiddleWare against an in-process fake Keycloak.
+
+    python benchmarks/bench_middleware.py --requests 2000
+    python benchmarks/bench_middleware.py --session-store memory --latency 0.005 --json
+    python benchmarks/bench_middleware.py --compact-session --session-claims preferred_username email
+
+Scenarios: whitelisted paths, authenticated page loads, Dash callbacks, unauthenticated redirects and full callback
+logins. For each one: requests/sec, latency percentiles and the memory allocated per request (tracemalloc peak),
+plus the size of the session cookie.
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+from flask import Flask, jsonify
+from werkzeug.test import EnvironBuilder
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_keycloak import FakeKeycloak  # noqa: E402
+from dash_flask_keycloak import FlaskKeycloak, MemorySessionStore  # noqa: E402
+
+
+def create_app(fake_keycloak, session_store=None, **build_kwargs):
+    app = Flask(__name__)
+
+    @app.route("/")
+    def index():
+        return "<html><body>dashboard</body></html>"
+
+    @app.route("/_dash-component-suites/<path:name>")
+    def component_suites(name):
+        return "/* bundle */"
+
+    @app.route("/_dash-update-component", methods=["POST"])
+    def dash_update_component():
+        return jsonify(multi=True, response={"greeting": {"children": "hello"}})
+
+    FlaskKeycloak.build(app, config_data=fake_keycloak.config, redirect_uri="http://localhost",
+                        uri_whitelist=["^/_dash-component-suites/"], session_store=session_store,
+                        **build_kwargs)
+    return app
+
+
+def call(app, environ):
+    status = []
+
+    def start_response(status_line, headers, exc_info=None):
+        status.append((status_line, headers))
+
+    environ = dict(environ, **{"wsgi.input": io.BytesIO(environ["_body"])})
+    iterable = app(environ, start_response)
+    try:
+        for _ in iterable:
+            pass
+    finally:
+        if hasattr(iterable, "close"):
+            iterable.close()
+    return status[0]
+
+
+def make_environ(path, method="GET", cookie=None, body=b"", query_string=None):
+    headers = {"Cookie": cookie} if cookie else {}
+    environ = EnvironBuilder(path=path, method=method, headers=headers, data=body, query_string=query_string,
+                             content_type="application/json" if body else None).get_environ()
+    environ["_body"] = body
+    return environ
+
+
+def login(app):
+    """Run a callback login and return the session cookie (name=value) it sets."""
+    status_line, headers = call(app, make_environ("/keycloak/callback", query_string="code=bench-code"))
+    for name, value in headers:
+        if name.lower() == "set-cookie" and value.startswith("session="):
+            return value.split(";", 1)[0]
+    raise RuntimeError(f"Login did not set a session cookie ({status_line}).")
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(app, environ_factory, requests, allocation_samples):
+    for _ in range(min(50, requests)):
+        call(app, environ_factory())
+    durations = []
+    started = time.perf_counter()
+    for _ in range(requests):
+        environ = environ_factory()
+        request_started = time.perf_counter()
+        call(app, environ)
+        durations.append(time.perf_counter() - request_started)
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    peaks = []
+    for _ in range(allocation_samples):
+        environ = environ_factory()
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        call(app, environ)
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+    durations.sort()
+    return dict(rps=requests / elapsed,
+                mean_ms=statistics.mean(durations) * 1000,
+                p50_ms=percentile(durations, 0.50) * 1000,
+                p90_ms=percentile(durations, 0.90) * 1000,
+                p99_ms=percentile(durations, 0.99) * 1000,
+                alloc_peak_kib=statistics.mean(peaks) / 1024 if peaks else 0.0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000, help="requests per scenario")
+    parser.add_argument("--login-requests", type=int, default=200, help="requests of the full login scenario")
+    parser.add_argument("--allocation-samples", type=int, default=50, help="requests traced for allocations")
+    parser.add_argument("--session-store", choices=["cookie", "memory"], default="cookie")
+    parser.add_argument("--compact-session", action="store_true", help="serialize with CompactSessionSerializer")
+    parser.add_argument("--session-claims", nargs="*", default=None, help="claims kept in the session")
+    parser.add_argument("--latency", type=float, default=0.0, help="artificial fake Keycloak latency (seconds)")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args(argv)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    with FakeKeycloak(latency=args.latency) as fake_keycloak:
+        session_store = MemorySessionStore() if args.session_store == "memory" else None
+        app = create_app(fake_keycloak, session_store=session_store, compact_session=args.compact_session,
+                         session_claims=args.session_claims)
+        cookie = login(app)
+        update_body = json.dumps({"output": "greeting.children", "inputs": [], "changedPropIds": []}).encode()
+        scenarios = {
+            "whitelisted": (lambda: make_environ("/_dash-component-suites/dash/dash_renderer.js"), args.requests),
+            "authenticated_page": (lambda: make_environ("/", cookie=cookie), args.requests),
+            "dash_update_component": (lambda: make_environ("/_dash-update-component", method="POST", cookie=cookie,
+                                                           body=update_body), args.requests),
+            "unauthenticated_redirect": (lambda: make_environ("/"), args.requests),
+            "callback_login": (lambda: make_environ("/keycloak/callback", query_string="code=bench-code"),
+                               args.login_requests),
+        }
+        results = {name: run(app, environ_factory, requests, args.allocation_samples)
+                   for name, (environ_factory, requests) in scenarios.items()}
+        report = dict(session_store=args.session_store, compact_session=args.compact_session,
+                      session_claims=args.session_claims, latency=args.latency, cookie_bytes=len(cookie),
+                      keycloak_calls=dict(fake_keycloak.calls), scenarios=results)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return report
+    print(f"session store: {args.session_store}, compact session: {args.compact_session}, "
+          f"fake Keycloak latency: {args.latency * 1000:.1f} ms, session cookie: {len(cookie)} bytes")
+    print(f"{'scenario':<26}{'req/s':>10}{'mean ms':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'alloc KiB':>11}")
+    for name, result in results.items():
+        print(f"{name:<26}{result['rps']:>10.0f}{result['mean_ms']:>10.3f}{result['p50_ms']:>10.3f}"
+              f"{result['p90_ms']:>10.3f}{result['p99_ms']:>10.3f}{result['alloc_peak_kib']:>11.1f}")
+    print(f"keycloak calls: {dict(report['keycloak_calls'])}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""In-process stub OIDC provider serving discovery, JWKS, token and userinfo with locally generated RSA keys."""
+import json
+import threading
+import time
+from collections import Counter
+from uuid import uuid4
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+from werkzeug.serving import make_server
+from werkzeug.wrappers import Request, Response
+
+
+class FakeKeycloak:
+    def __init__(self, realm="bench", client_id="bench-client", client_secret="bench-secret", token_lifetime=300,
+                 latency=0.0, host="127.0.0.1", port=0, kid="bench-key"):
+        self.realm = realm
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token_lifetime = token_lifetime
+        # Artificial delay of every endpoint, to simulate the network round trip to a real Keycloak.
+        self.latency = latency
+        # Endpoint name -> error status it answers with instead, to simulate an outage or an ended SSO session.
+        self.failures = {}
+        self.kid = kid
+        self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        jwk = json.loads(RSAAlgorithm.to_jwk(self.private_key.public_key()))
+        jwk.update(kid=kid, use="sig", alg="RS256")
+        self.jwks = {"keys": [jwk]}
+        self.calls = Counter()
+        self._server = make_server(host, port, self.wsgi_app, threaded=True)
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://{self._server.host}:{self._server.port}"
+
+    @property
+    def issuer(self):
+        return f"{self.base_url}/realms/{self.realm}"
+
+    @property
+    def config(self):
+        """Keycloak parameters for ``FlaskKeycloak.build(config_data=...)``."""
+        return dict(server_url=self.base_url, realm_name=self.realm, client_id=self.client_id,
+                    client_secret_key=self.client_secret)
+
+    def well_known(self):
+        endpoint = f"{self.issuer}/protocol/openid-connect"
+        return dict(issuer=self.issuer,
+                    authorization_endpoint=f"{endpoint}/auth",
+                    token_endpoint=f"{endpoint}/token",
+                    userinfo_endpoint=f"{endpoint}/userinfo",
+                    end_session_endpoint=f"{endpoint}/logout",
+                    jwks_uri=f"{endpoint}/certs",
+                    id_token_signing_alg_values_supported=["RS256", "HS256"])
+
+    def sign(self, claims):
+        return jwt.encode(claims, self.private_key, algorithm="RS256", headers={"kid": self.kid})
+
+    def issue_tokens(self, subject="bench-user"):
+        now = int(time.time())
+        sid = uuid4().hex
+        common = dict(iss=self.issuer, sub=subject, iat=now, exp=now + self.token_lifetime, sid=sid,
+                      azp=self.client_id, preferred_username=subject, email=f"{subject}@example.com",
+                      name="Bench User", given_name="Bench", family_name="User", email_verified=True)
+        access_token = self.sign(dict(common, aud="account", typ="Bearer", scope="openid email profile",
+                                      realm_access=dict(roles=["default-roles", "offline_access", "user"]),
+                                      resource_access={self.client_id: dict(roles=["viewer"]),
+                                                       "account": dict(roles=["manage-account"])}))
+        id_token = self.sign(dict(common, aud=self.client_id, typ="ID", auth_time=now, at_hash=uuid4().hex[:22]))
+        refresh_token = self.sign(dict(iss=self.issuer, sub=subject, iat=now, exp=now + 1800, sid=sid,
+                                       aud=self.issuer, typ="Refresh", jti=uuid4().hex))
+        return dict(access_token=access_token, id_token=id_token, refresh_token=refresh_token,
+                    expires_in=self.token_lifetime, refresh_expires_in=1800, token_type="Bearer",
+                    scope="openid email profile", session_state=sid)
+
+    def userinfo(self, subject="bench-user"):
+        return dict(sub=subject, preferred_username=subject, email=f"{subject}@example.com", name="Bench User",
+                    given_name="Bench", family_name="User", email_verified=True)
+
+    def wsgi_app(self, environ, start_response):
+        request = Request(environ)
+        endpoint = request.path.rsplit("/", 1)[-1]
+        self.calls[endpoint] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if endpoint in self.failures:
+            error = dict(error="invalid_grant" if self.failures[endpoint] < 500 else "server_error")
+            return Response(json.dumps(error), self.failures[endpoint],
+                            content_type="application/json")(environ, start_response)
+        if request.path.endswith("/.well-known/openid-configuration"):
+            body = self.well_known()
+        elif endpoint == "certs":
+            body = self.jwks
+        elif endpoint == "token":
+            # Password grants log the given user in, so that logins of different users can be told apart.
+            body = self.issue_tokens(request.form.get("username") or "bench-user")
+        elif endpoint == "userinfo":
+            body = self.userinfo()
+        elif endpoint == "logout":
+            return Response(status=204)(environ, start_response)
+        else:
+            return Response("Not found", 404)(environ, start_response)
+        return Response(json.dumps(body), content_type="application/json")(environ, start_response)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-keycloak", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
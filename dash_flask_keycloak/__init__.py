@@ -1 +1,30 @@
-from .core import FlaskKeycloak
+import importlib
+from typing import TYPE_CHECKING
+
+# Public names -> submodule defining them, imported on first access (PEP 562) so that importing the package
+# doesn't load Flask, PyJWT or python-keycloak.
+_EXPORTS = {
+    "FlaskKeycloak": ".core",
+    "MemorySessionStore": ".sessions",
+    "SQLiteSessionStore": ".sessions",
+    "RedisSessionStore": ".sessions",
+}
+
+if TYPE_CHECKING:
+    from .core import FlaskKeycloak
+    from .sessions import MemorySessionStore, SQLiteSessionStore, RedisSessionStore
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = globals()[name] = getattr(importlib.import_module(module, __name__), name)
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
+
+
+__all__ = list(_EXPORTS)
@@ -0,0 +1,197 @@
+import asyncio
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from flask import Response
+
+QUEUE_FULL = "queue_full"
+TIMEOUT = "timeout"
+
+_RETRY_PAGE = """<!doctype html>
+<html><head><meta charset="utf-8"><meta http-equiv="refresh" content="{retry_after}"><title>Signing in</title></head>
+<body><p>Too many sign-ins at the moment, retrying in {retry_after} seconds...</p></body></html>
+"""
+
+
+class LoginRejected(Exception):
+    """Raised instead of exchanging an authorization code when the login queue is full or the wait timed out."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Login rejected ({reason}), retry in {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def retry_page(retry_after):
+    """503 page reloading the callback after ``retry_after`` seconds, the authorization code is still unused then."""
+    return Response(_RETRY_PAGE.format(retry_after=retry_after), 503,
+                    {"Retry-After": str(retry_after), "Cache-Control": "no-store"}, mimetype="text/html")
+
+
+class LoginAdmission:
+    """
+    Admission control of the code exchanges of logins.
+
+    Concurrent callbacks of the same authorization code from the same browser (retries, double submissions) share a
+    single exchange, Keycloak would reject the code the second time anyway. Calls without a key (password grants) are
+    never shared. With ``max_concurrent``, at most that many exchanges run at once, up to ``max_queue`` more logins wait
+    for a slot for at most ``wait_timeout`` seconds and the others are rejected at once (LoginRejected, answered with a
+    retry page), rather than every worker blocking on Keycloak during a login storm.
+    """
+
+    def __init__(self, max_concurrent=None, max_queue=64, wait_timeout=10, retry_after=2):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.wait_timeout = wait_timeout
+        self.retry_after = retry_after
+        self.active = 0
+        self.waiting = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self._slots = None if max_concurrent is None else threading.BoundedSemaphore(max_concurrent)
+        self._flights = {}
+        self._lock = threading.Lock()
+        # Event loop counterparts, created on first use within the loop.
+        self._async_slots = None
+        self._async_flights = {}
+
+    def reject(self, reason):
+        with self._lock:
+            self.rejected += 1
+        raise LoginRejected(reason, self.retry_after)
+
+    def _enter_queue(self):
+        with self._lock:
+            if self.waiting >= self.max_queue:
+                full = True
+            else:
+                full = False
+                self.waiting += 1
+        if full:
+            self.reject(QUEUE_FULL)
+
+    def _leave_queue(self, acquired):
+        with self._lock:
+            self.waiting -= 1
+            if acquired:
+                self.active += 1
+        if not acquired:
+            self.reject(TIMEOUT)
+
+    def _release_slot(self):
+        if self._slots is not None:
+            self._slots.release()
+            with self._lock:
+                self.active -= 1
+
+    def _release_async_slot(self):
+        if self._async_slots is not None:
+            self._async_slots.release()
+            with self._lock:
+                self.active -= 1
+
+    def _acquire(self):
+        if self._slots is None:
+            return
+        if not self._slots.acquire(blocking=False):
+            self._enter_queue()
+            acquired = False
+            try:
+                acquired = self._slots.acquire(timeout=self.wait_timeout)
+            finally:
+                self._leave_queue(acquired)
+        else:
+            with self._lock:
+                self.active += 1
+
+    def exchange(self, key, exchange):
+        """
+        Return ``exchange()``, shared by the concurrent calls of the same ``key`` (unless None) and run once a slot is
+        free.
+        """
+        if key is None:
+            self._acquire()
+            try:
+                return exchange()
+            finally:
+                self._release_slot()
+        with self._lock:
+            future = self._flights.get(key)
+            owner = future is None
+            if owner:
+                future = self._flights[key] = Future()
+            else:
+                self.coalesced += 1
+        if not owner:
+            try:
+                return future.result(self.wait_timeout)
+            except FutureTimeoutError:
+                self.reject(TIMEOUT)
+        try:
+            self._acquire()
+            try:
+                result = exchange()
+            finally:
+                self._release_slot()
+        except BaseException as e:
+            with self._lock:
+                self._flights.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._flights.pop(key, None)
+        future.set_result(result)
+        return result
+
+    async def _acquire_async(self):
+        if self.max_concurrent is None:
+            return
+        if self._async_slots is None:
+            self._async_slots = asyncio.BoundedSemaphore(self.max_concurrent)
+        if self._async_slots.locked():
+            self._enter_queue()
+            acquired = False
+            try:
+                await asyncio.wait_for(self._async_slots.acquire(), self.wait_timeout)
+                acquired = True
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._leave_queue(acquired)
+        else:
+            await self._async_slots.acquire()
+            with self._lock:
+                self.active += 1
+
+    async def exchange_async(self, key, exchange):
+        """Event loop version of ``exchange``, ``exchange`` being a coroutine function."""
+        if key is None:
+            await self._acquire_async()
+            try:
+                return await exchange()
+            finally:
+                self._release_async_slot()
+        future = self._async_flights.get(key)
+        if future is not None:
+            with self._lock:
+                self.coalesced += 1
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), self.wait_timeout)
+            except asyncio.TimeoutError:
+                self.reject(TIMEOUT)
+        future = self._async_flights[key] = asyncio.get_running_loop().create_future()
+        try:
+            await self._acquire_async()
+            try:
+                result = await exchange()
+            finally:
+                self._release_async_slot()
+        except BaseException as e:
+            self._async_flights.pop(key, None)
+            future.set_exception(e)
+            # Retrieved here, so that it isn't logged as never retrieved when no other callback shared the exchange.
+            future.exception()
+            raise
+        self._async_flights.pop(key, None)
+        future.set_result(result)
+        return result
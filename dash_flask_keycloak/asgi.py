@@ -0,0 +1,232 @@
+import asyncio
+import io
+from functools import partial
+
+import jwt
+from jwt.exceptions import PyJWKClientError
+from keycloak.exceptions import KeycloakAuthenticationError, KeycloakConnectionError, KeycloakError, \
+    KeycloakGetError, KeycloakPostError, raise_error_from_response
+from werkzeug.wrappers import Request
+
+from .refresh import stamp_token
+from .sessions import ServerSideSessionInterface
+
+
+def scope_to_environ(scope):
+    """Build the (body-less) WSGI environ of an ASGI http scope, enough for sessions, routing and redirects."""
+    root_path = scope.get("root_path", "")
+    path = scope["path"]
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root_path.encode("utf8").decode("latin1"),
+        "PATH_INFO": path.encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1] or 80),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(),
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin1")
+        if name == "content-type":
+            key = "CONTENT_TYPE"
+        elif name == "content-length":
+            key = "CONTENT_LENGTH"
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+        value = value.decode("latin1")
+        environ[key] = environ[key] + "," + value if key in environ else value
+    return environ
+
+
+async def send_response(response, environ, send):
+    body = response.get_data()
+    headers = [(name.lower().encode("latin1"), value.encode("latin1"))
+               for name, value in response.get_wsgi_headers(environ).to_wsgi_list()]
+    await send({"type": "http.response.start", "status": response.status_code, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+class AsyncAuthHandler:
+    """
+    Non-blocking counterpart of AuthHandler's Keycloak calls (token, userinfo and JWKS) on top of ``httpx``.
+
+    Sessions, state and caches are those of the wrapped AuthHandler, so both handlers can serve the same app.
+    """
+
+    def __init__(self, auth_handler, client=None, timeout=10):
+        try:
+            import httpx
+        except ImportError:
+            raise RuntimeError('Perhaps you did not install httpx package?')
+        self.auth_handler = auth_handler
+        self.keycloak_openid = auth_handler.keycloak_openid
+        if client is None:
+            verify = auth_handler.ssl_context or auth_handler.keycloak_openid.connection.verify
+            client = httpx.AsyncClient(verify=verify, timeout=timeout)
+        self.client = client
+        self._http_error = httpx.HTTPError
+        self._jwks_lock = None
+        # Session stores may wait on the network or the disk, cookie sessions are read and written in place.
+        self.offload = isinstance(auth_handler.session_interface, ServerSideSessionInterface)
+        # Calls of AuthMiddleWare.flow which have a non-blocking counterpart here.
+        self._async_calls = {auth_handler.is_token_valid: self.is_token_valid,
+                             auth_handler.decode_access_token: self.decode_access_token,
+                             auth_handler.login: self.login}
+
+    async def run_sync(self, func, *args, **kwargs):
+        """Call a blocking function, in the default executor if the sessions are kept in a store."""
+        if not self.offload:
+            return func(*args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(None, partial(func, *args, **kwargs))
+
+    async def call(self, func, *args, **kwargs):
+        """Make a call yielded by AuthMiddleWare.flow: Keycloak ones are awaited, the others run with run_sync."""
+        async_func = self._async_calls.get(func)
+        if async_func is not None:
+            return await async_func(*args, **kwargs)
+        return await self.run_sync(func, *args, **kwargs)
+
+    @property
+    def well_known_metadata(self):
+        return self.auth_handler.well_known_metadata
+
+    async def request(self, method, url, **kwargs):
+        """Call Keycloak through the circuit breaker of the handler's transport, if any."""
+        breaker = self.auth_handler.breaker
+        if breaker is not None and not breaker.allow():
+            raise KeycloakConnectionError(f"Keycloak circuit is open, retrying in {breaker.retry_after()}s")
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except self._http_error as e:
+            if breaker is not None:
+                breaker.record_failure()
+            raise KeycloakConnectionError("Can't connect to server (%s)" % e)
+        except BaseException:
+            # Cancelled (CancelledError) or failed before reaching Keycloak, the outcome is unknown.
+            if breaker is not None:
+                breaker.release()
+            raise
+        if breaker is not None:
+            breaker.record(response.status_code)
+        return response
+
+    async def get_signing_key_from_jwt(self, token):
+        kid = jwt.get_unverified_header(token).get("kid")
+        jwks_cache = self.auth_handler.jwks_cache
+        key = jwks_cache.lookup(kid)
+        if key is not None:
+            return key
+        generation = jwks_cache.generation
+        if jwks_cache.should_refetch():
+            if self._jwks_lock is None:
+                self._jwks_lock = asyncio.Lock()
+            # Concurrent misses wait for the first fetch instead of issuing their own.
+            async with self._jwks_lock:
+                if jwks_cache.generation == generation:
+                    try:
+                        with self.auth_handler.metrics.time("jwks_fetch"):
+                            response = await self.request("GET", jwks_cache.jwks_uri)
+                        jwks_cache.update(raise_error_from_response(response, KeycloakGetError))
+                    except KeycloakError:
+                        # Known keys stay in use while Keycloak can't be reached.
+                        if not jwks_cache.fetch_failed():
+                            raise
+        return jwks_cache.find(kid)
+
+    async def decode_id_token(self, id_token):
+        data = self.auth_handler.token_cache.get(id_token)
+        if data is not None:
+            return data
+        return self.auth_handler.verify_id_token(id_token, await self.get_signing_key_from_jwt(id_token))
+
+    async def decode_access_token(self, access_token):
+        claims = self.auth_handler.bearer_cache.get(access_token)
+        if claims is not None:
+            return claims
+        return self.auth_handler.verify_access_token(access_token, await self.get_signing_key_from_jwt(access_token))
+
+    async def is_token_valid(self, local_session):
+        token = local_session.get("token", None)
+        if token is not None:
+            try:
+                await self.decode_id_token(token["id_token"])
+            except (jwt.DecodeError, jwt.InvalidAlgorithmError, jwt.InvalidKeyError, PyJWKClientError):
+                return False
+            except jwt.ExpiredSignatureError:
+                pass
+        return True
+
+    async def token(self, **kwargs):
+        payload = dict(client_id=self.keycloak_openid.client_id, scope="openid", **kwargs)
+        if self.keycloak_openid.client_secret_key:
+            payload["client_secret"] = self.keycloak_openid.client_secret_key
+        with self.auth_handler.metrics.time("token_exchange"):
+            response = await self.request("POST", self.well_known_metadata["token_endpoint"], data=payload)
+        return stamp_token(raise_error_from_response(response, KeycloakPostError))
+
+    async def userinfo(self, access_token):
+        with self.auth_handler.metrics.time("userinfo"):
+            response = await self.request("GET", self.well_known_metadata["userinfo_endpoint"],
+                                          headers={"Authorization": "Bearer " + access_token})
+        return raise_error_from_response(response, KeycloakGetError)
+
+    async def exchange_code(self, **kwargs):
+        token = await self.token(**kwargs)
+        if self.auth_handler.lazy_userinfo:
+            return dict(token=token, data=await self.decode_id_token(token["id_token"]))
+        # The id_token verification and the userinfo call don't depend on each other.
+        data, user = await asyncio.gather(self.decode_id_token(token["id_token"]),
+                                          self.userinfo(token["access_token"]))
+        return dict(token=token, data=data, user=user)
+
+    async def login(self, local_session, response, login_binding=None, **kwargs):
+        try:
+            claims = await self.auth_handler.login_admission.exchange_async(
+                self.auth_handler.login_key(kwargs, login_binding), partial(self.exchange_code, **kwargs))
+            if isinstance(self.auth_handler.session_interface, ServerSideSessionInterface):
+                await self.run_sync(self.auth_handler.session_interface.regenerate, local_session)
+            response = await self.run_sync(self.auth_handler.set_session, local_session, response, **claims)
+        except KeycloakAuthenticationError as e:
+            return e
+        return response
+
+
+class AsgiAuthMiddleWare:
+    """
+    ASGI counterpart of AuthMiddleWare: runs the decision flow of the given (WSGI) ``auth_middleware``, so the
+    behaviour is the same, but awaits Keycloak and runs the session store calls in a thread instead of blocking the
+    event loop.
+    """
+
+    def __init__(self, app, auth_middleware, async_auth_handler):
+        self.app = app
+        self.auth_middleware = auth_middleware
+        self.auth_handler = auth_middleware.auth_handler
+        self.async_auth_handler = async_auth_handler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        environ = scope_to_environ(scope)
+        # The decisions are those of the WSGI middleware, only the calls it yields are awaited here.
+        flow = self.auth_middleware.flow(Request(environ), environ)
+        try:
+            func, args, kwargs = next(flow)
+            while True:
+                try:
+                    result = await self.async_auth_handler.call(func, *args, **kwargs)
+                except Exception as e:
+                    func, args, kwargs = flow.throw(e)
+                else:
+                    func, args, kwargs = flow.send(result)
+        except StopIteration as stop:
+            response = stop.value
+        if response is None:
+            # Request is authorized, just proceed.
+            return await self.app(scope, receive, send)
+        return await send_response(response, environ, send)
@@ -0,0 +1,174 @@
+import ast
+import json
+import re
+
+from .cache import LRUCache, token_digest
+from .lazy import lazy_import
+
+jwt = lazy_import("jwt")
+
+AFFIRMATIVE = "AFFIRMATIVE"
+UNANIMOUS = "UNANIMOUS"
+
+
+class RolePolicy:
+    """
+    Keycloak role policy: every ``required`` role must be present, plus at least one of the other roles if any.
+    Role names are realm roles (``admin``) or client roles (``client-id/admin``).
+    """
+
+    def __init__(self, roles=(), required=()):
+        self.roles = frozenset(roles)
+        self.required = frozenset(required)
+
+    def grants(self, user_roles):
+        if not self.required <= user_roles:
+            return False
+        return not self.roles or not self.roles.isdisjoint(user_roles)
+
+
+class RouteRule:
+    def __init__(self, pattern, policies, decision_strategy=UNANIMOUS):
+        self.pattern = re.compile(pattern)
+        self.policies = list(policies)
+        self.decision_strategy = decision_strategy
+
+    def grants(self, user_roles):
+        decisions = (policy.grants(user_roles) for policy in self.policies)
+        return any(decisions) if self.decision_strategy == AFFIRMATIVE else all(decisions)
+
+
+def uri_to_pattern(uri):
+    """Turn a Keycloak resource uri (``/admin/*``) into an anchored regex."""
+    return "^" + ".*".join(re.escape(part) for part in uri.split("*")) + "$"
+
+
+def user_roles(local_session):
+    """Realm and client roles (``client-id/role``) found in the claims stored in the session."""
+    claim_sets = [local_session.get("data"), local_session.get("introspect")]
+    token = local_session.get("token")
+    if isinstance(token, dict) and token.get("access_token"):
+        # The access token came straight from Keycloak's token endpoint and is kept in the session, its roles are
+        # not in the id_token unless a mapper puts them there.
+        claim_sets.append(jwt.decode(token["access_token"], options={"verify_signature": False}))
+    roles = set()
+    for claims in claim_sets:
+        if not isinstance(claims, dict):
+            continue
+        realm_roles = (claims.get("realm_access") or {}).get("roles") or []
+        roles.update([realm_roles] if isinstance(realm_roles, str) else realm_roles)
+        for client, access in (claims.get("resource_access") or {}).items():
+            roles.update(f"{client}/{role}" for role in access.get("roles", []))
+    return frozenset(roles)
+
+
+class RoutePolicyIndex:
+    """
+    Route -> required roles policy, compiled once at startup.
+
+    Paths are mapped to their rule (the first matching one) through an LRU, and decisions are cached per
+    (role set, rule), so repeated requests skip policy evaluation altogether. Paths matching no rule are allowed.
+    """
+
+    def __init__(self, rules=(), cache_size=1024):
+        self.rules = list(rules)
+        self._rule_cache = LRUCache(cache_size)
+        self._decision_cache = LRUCache(cache_size)
+        self._roles_cache = LRUCache(cache_size)
+
+    @classmethod
+    def from_route_roles(cls, route_roles, **kwargs):
+        """``{pattern: [roles]}``, a user needs any of the roles of the first pattern matching the path."""
+        rules = [RouteRule(pattern, [RolePolicy(roles=[roles] if isinstance(roles, str) else roles)])
+                 for pattern, roles in (route_roles or {}).items()]
+        return cls(rules, **kwargs)
+
+    @classmethod
+    def from_authorization_settings(cls, path, **kwargs):
+        """Compile the resource permissions and role policies of an exported Keycloak authorization settings file."""
+        with open(path, "r") as f:
+            settings = json.load(f)
+        return cls(cls.parse_authorization_settings(settings), **kwargs)
+
+    @staticmethod
+    def _config_list(value):
+        if isinstance(value, str):
+            try:
+                return json.loads(value)
+            except ValueError:
+                return ast.literal_eval(value)
+        return value or []
+
+    @classmethod
+    def parse_authorization_settings(cls, settings):
+        """
+        Route rules of the resource permissions. Only role policies can be enforced from the session, a permission
+        applying any other policy (group, user, client, time, aggregate...) raises ValueError rather than leaving its
+        resources unrestricted.
+        """
+        resources = {resource["name"]: resource.get("uris", []) for resource in settings.get("resources", [])}
+        policy_types = {policy["name"]: policy.get("type") for policy in settings.get("policies", [])}
+        role_policies = {}
+        for policy in settings.get("policies", []):
+            if policy.get("type") == "role" and policy.get("logic", "POSITIVE") == "POSITIVE":
+                roles = cls._config_list(policy.get("config", {}).get("roles", "[]"))
+                role_policies[policy["name"]] = RolePolicy(
+                    roles=[role["id"] for role in roles if not role.get("required")],
+                    required=[role["id"] for role in roles if role.get("required")])
+        rules = []
+        for permission in settings.get("policies", []):
+            if permission.get("type") != "resource":
+                continue
+            config = permission.get("config", {})
+            policies = []
+            for name in cls._config_list(config.get("applyPolicies", "[]")):
+                if name not in role_policies:
+                    policy_type = policy_types.get(name, "unknown")
+                    raise ValueError(f'Permission "{permission.get("name")}" applies the {policy_type} policy '
+                                     f'"{name}", only role policies of positive logic are supported')
+                policies.append(role_policies[name])
+            if not policies:
+                continue
+            for resource in cls._config_list(config.get("resources", "[]")):
+                for uri in resources.get(resource, []):
+                    rules.append(RouteRule(uri_to_pattern(uri), policies,
+                                           permission.get("decisionStrategy", UNANIMOUS)))
+        return rules
+
+    def __add__(self, other):
+        return RoutePolicyIndex(self.rules + other.rules)
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def rule_index(self, path):
+        index = self._rule_cache.get(path)
+        if index is None:
+            index = -1
+            for i, rule in enumerate(self.rules):
+                if rule.pattern.search(path):
+                    index = i
+                    break
+            self._rule_cache.put(path, index)
+        return index
+
+    def roles(self, local_session):
+        token = local_session.get("token")
+        key = token_digest(token["access_token"]) if isinstance(token, dict) and token.get("access_token") else None
+        roles = self._roles_cache.get(key) if key is not None else None
+        if roles is None:
+            roles = user_roles(local_session)
+            if key is not None:
+                self._roles_cache.put(key, roles)
+        return roles
+
+    def is_allowed(self, local_session, path):
+        index = self.rule_index(path)
+        if index < 0:
+            return True
+        roles = self.roles(local_session)
+        decision = self._decision_cache.get((roles, index))
+        if decision is None:
+            decision = self.rules[index].grants(roles)
+            self._decision_cache.put((roles, index), decision)
+        return decision
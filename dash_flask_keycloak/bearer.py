@@ -0,0 +1,26 @@
+import json
+
+from flask import Response
+
+# Key of the verified access token claims in the WSGI environ, read by FlaskKeycloak for ``flask.g.claims``.
+BEARER_CLAIMS_KEY = "dash_flask_keycloak.bearer_claims"
+
+
+def bearer_token(request):
+    """The access token of an ``Authorization: Bearer <token>`` header, or None."""
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    token = token.strip()
+    if scheme.lower() != "bearer" or not token:
+        return None
+    return token
+
+
+def bearer_challenge(error=None, description=None):
+    """401 response of a bearer request (RFC 6750), without an error code when no token was sent at all."""
+    challenge = "Bearer"
+    body = dict(error="invalid_request", error_description="Missing bearer token")
+    if error is not None:
+        challenge += f' error="{error}"'
+        body = dict(error=error, error_description=description)
+    return Response(json.dumps(body), 401, {"WWW-Authenticate": challenge, "Cache-Control": "no-store"},
+                    mimetype="application/json")
@@ -0,0 +1,101 @@
+import threading
+import time
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+
+
+class CircuitOpenError(ConnectionError):
+    """Raised instead of calling Keycloak while the circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Stop calling Keycloak after ``failure_threshold`` consecutive failures (connection errors, timeouts, 5xx).
+
+    While open, calls fail at once with CircuitOpenError instead of holding a worker until their timeout. After
+    ``reset_timeout`` seconds the circuit is half-open: ``half_open_probes`` calls are let through, the first success
+    closes it again and a failure opens it for another ``reset_timeout``. A probe which ends without an outcome (its
+    call cancelled) gives its slot back through ``release``, and probes still unanswered after ``reset_timeout`` are
+    given up on, so the circuit can't stay half-open with no probe running.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, half_open_probes=1):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self.state = CLOSED
+        self.rejected = 0
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probed_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    return False
+                self.state = HALF_OPEN
+                self._probes = 0
+            if self.state == HALF_OPEN:
+                now = time.monotonic()
+                if self._probes >= self.half_open_probes and now - self._probed_at < self.reset_timeout:
+                    self.rejected += 1
+                    return False
+                if self._probes >= self.half_open_probes:
+                    # The probes never reported back, let new ones through.
+                    self._probes = 0
+                self._probes += 1
+                self._probed_at = now
+            return True
+
+    def release(self):
+        """Give back the slot of a call allowed through which ended with neither a success nor a failure."""
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+
+    def record(self, status_code):
+        """Record the outcome of a call that got a response, a 5xx counts as a failure."""
+        if status_code >= 500:
+            self.record_failure()
+        else:
+            self.record_success()
+
+    def retry_after(self):
+        """Seconds until the next probe is let through, 0 unless the circuit is open."""
+        if self.state != OPEN:
+            return 0
+        return max(0, int(self.reset_timeout - (time.monotonic() - self._opened_at)) + 1)
+
+    def call(self, send, *args, **kwargs):
+        """Call ``send`` (returning a response with a ``status_code``) through the breaker."""
+        if not self.allow():
+            raise CircuitOpenError(f"Keycloak circuit is open, retrying in {self.retry_after()}s")
+        try:
+            response = send(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        except BaseException:
+            # Interrupted (KeyboardInterrupt, a cancelled greenlet...), Keycloak wasn't heard from.
+            self.release()
+            raise
+        self.record(response.status_code)
+        return response
@@ -0,0 +1,292 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from .lazy import lazy_import
+
+jwt = lazy_import("jwt")
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """Small thread-safe LRU mapping with a fixed number of entries."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def token_digest(token):
+    return hashlib.sha256(token.encode() if isinstance(token, str) else token).hexdigest()
+
+
+def check_expiry(claims):
+    """Return the claims of a token decoded without checking ``exp``, raising as PyJWT does if it has expired."""
+    if "exp" in claims:
+        try:
+            expires_at = int(claims["exp"])
+        except (TypeError, ValueError):
+            raise jwt.DecodeError("Expiration Time claim (exp) must be an integer.")
+        if expires_at <= time.time():
+            raise jwt.ExpiredSignatureError("Signature has expired")
+    return claims
+
+
+class TokenCache:
+    """
+    Bounded LRU of already verified tokens, keyed by the token digest.
+
+    A cached token is never trusted past its ``exp`` claim: from then on ``get`` raises ExpiredSignatureError, as the
+    verification would, without checking the signature again. Entries stay until the LRU evicts them.
+
+    :param shared: optional SharedCache, a token verified by one worker is then trusted by the other workers of the
+        host too. ``namespace`` keeps apart the handlers (issuer, client) sharing the same file.
+    """
+
+    def __init__(self, maxsize=1024, shared=None, namespace=""):
+        self._entries = LRUCache(maxsize)
+        self.shared = shared
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token):
+        digest = token_digest(token)
+        entry = self._entries.get(digest)
+        if entry is not None:
+            claims, expires_at = entry
+            self.hits += 1
+            if time.time() >= expires_at:
+                raise jwt.ExpiredSignatureError("Signature has expired")
+            return claims
+        if self.shared is not None:
+            claims = self._get_shared(digest)
+            if claims is not None:
+                self._entries.put(digest, (claims, claims["exp"]))
+                self.hits += 1
+                return claims
+        self.misses += 1
+        return None
+
+    def _get_shared(self, digest):
+        payload = self.shared.get(self.namespace + digest)
+        if payload is None:
+            return None
+        try:
+            claims = json.loads(payload)
+        except ValueError:
+            return None
+        if not isinstance(claims, dict) or not time.time() < claims.get("exp", 0):
+            return None
+        return claims
+
+    def put(self, token, claims):
+        """Cache the claims of a token whose signature is valid, whether it has expired or not."""
+        expires_at = claims.get("exp")
+        # Tokens without an expiry are never cached, they would otherwise stay trusted forever.
+        if isinstance(expires_at, (int, float)):
+            digest = token_digest(token)
+            self._entries.put(digest, (claims, expires_at))
+            if self.shared is not None and time.time() < expires_at:
+                self.shared.set(self.namespace + digest, json.dumps(claims).encode(), expires_at)
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, size=len(self._entries), maxsize=self._entries.maxsize)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class JWKSCache:
+    """
+    Thread-safe signing key cache for a single jwks_uri, keyed by ``kid``.
+
+    Keys live for ``ttl`` seconds. An unknown ``kid`` triggers at most one refetch (key rotation), and no more than
+    one per ``refetch_interval`` seconds. Concurrent misses share a single fetch.
+
+    With a ``shared`` SharedCache the fetched key set is published to the other workers of the host, which then pick
+    it up instead of fetching it themselves.
+
+    If a fetch fails (Keycloak down, circuit open), the keys already known stay in use for up to ``max_stale``
+    seconds past their ttl (stale-if-error) and the fetch is only retried every ``refetch_interval`` seconds.
+    """
+
+    def __init__(self, jwks_uri, ssl_context=None, ttl=300, refetch_interval=10, fetch=None, shared=None,
+                 max_stale=86400):
+        self.jwks_uri = jwks_uri
+        self.shared = shared
+        self.ttl = ttl
+        self.refetch_interval = refetch_interval
+        self.max_stale = max_stale
+        if fetch is None:
+            fetch = jwt.PyJWKClient(jwks_uri, cache_jwk_set=False, ssl_context=ssl_context).fetch_data
+        self._fetch = fetch
+        # The key dict is replaced as a whole on update, so readers never need the lock.
+        self._keys = {}
+        self._fetched_at = None
+        # Wall clock time of the key set in use, to tell whether the shared copy is newer.
+        self._fetched_at_wall = 0.0
+        self._generation = 0
+        self._fetch_lock = threading.Lock()
+        # Monotonic time before which a failed fetch isn't retried.
+        self._retry_at = 0.0
+
+    def is_fresh(self):
+        return self._fetched_at is not None and time.monotonic() - self._fetched_at < self.ttl
+
+    def lookup(self, kid):
+        """Return the cached key for ``kid`` without touching the network, or None."""
+        if not self.is_fresh():
+            return None
+        return self._keys.get(kid)
+
+    def update(self, jwk_set, fetched_at=None):
+        keys = {}
+        for jwk in jwt.PyJWKSet.from_dict(jwk_set).keys:
+            if jwk.public_key_use in ("sig", None) and jwk.key_id:
+                keys[jwk.key_id] = jwk
+        if not keys:
+            raise jwt.PyJWKClientError("The JWKS endpoint did not contain any signing keys")
+        self._keys = keys
+        now = time.time()
+        fetched_at = now if fetched_at is None else fetched_at
+        # Keys fetched by another worker only live for what is left of their ttl.
+        self._fetched_at = time.monotonic() - max(0.0, now - fetched_at)
+        self._fetched_at_wall = fetched_at
+        self._generation += 1
+
+    def refresh(self, generation=None):
+        """Fetch the key set, unless another thread has already done so since ``generation`` was observed."""
+        generation = self._generation if generation is None else generation
+        with self._fetch_lock:
+            if self._generation != generation:
+                return
+            if self.shared is not None and self._refresh_from_shared():
+                return
+            jwk_set = self._fetch()
+            self.update(jwk_set)
+            if self.shared is not None:
+                entry = dict(fetched_at=self._fetched_at_wall, jwks=jwk_set)
+                self.shared.set("jwks:" + self.jwks_uri, json.dumps(entry).encode(), self._fetched_at_wall + self.ttl)
+
+    def _refresh_from_shared(self):
+        """Use the key set another worker fetched after ours, if there is one."""
+        payload = self.shared.get("jwks:" + self.jwks_uri)
+        if payload is None:
+            return False
+        try:
+            entry = json.loads(payload)
+            if entry["fetched_at"] <= self._fetched_at_wall:
+                return False
+            self.update(entry["jwks"], entry["fetched_at"])
+        except (ValueError, KeyError, TypeError, jwt.PyJWKClientError):
+            return False
+        return True
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def should_refetch(self):
+        """Whether a missing ``kid`` justifies fetching the key set again."""
+        now = time.monotonic()
+        if now < self._retry_at:
+            return False
+        if not self.is_fresh():
+            return True
+        return now - self._fetched_at >= self.refetch_interval
+
+    def fetch_failed(self):
+        """Back off after a failed fetch, return whether there are known keys to use meanwhile."""
+        if not self._keys:
+            return False
+        self._retry_at = time.monotonic() + self.refetch_interval
+        logger.warning("Unable to fetch the JWKS of %s, using the known keys.", self.jwks_uri, exc_info=True)
+        return True
+
+    def find(self, kid):
+        """Return the key for ``kid``, stale keys up to ``max_stale`` seconds past the ttl, raising otherwise."""
+        key = self._keys.get(kid)
+        if key is None:
+            raise jwt.PyJWKClientError(f'Unable to find a signing key that matches: "{kid}"')
+        if time.monotonic() - self._fetched_at >= self.ttl + self.max_stale:
+            raise jwt.PyJWKClientError(f'The signing key "{kid}" is too old to be used')
+        return key
+
+    def get_signing_key(self, kid):
+        key = self.lookup(kid)
+        if key is not None:
+            return key
+        generation = self._generation
+        if self.should_refetch():
+            try:
+                self.refresh(generation)
+            except Exception:
+                # Whatever the fetch raised (connection error, 5xx, open circuit), without keys there is no answer.
+                if not self.fetch_failed():
+                    raise
+        return self.find(kid)
+
+    def get_signing_key_from_jwt(self, token):
+        header = jwt.get_unverified_header(token)
+        return self.get_signing_key(header.get("kid"))
+
+
+_jwks_caches = {}
+_jwks_caches_lock = threading.Lock()
+
+
+def get_jwks_cache(jwks_uri, ssl_context=None, ttl=300, fetch=None, shared=None, scope=None):
+    """
+    Return the process-wide JWKSCache of ``jwks_uri`` for these options, creating it on first use.
+
+    Handlers of the same ``scope`` (the transport and metrics their ``fetch`` goes through) share a cache, those of
+    another FlaskKeycloak in the process get their own, with their own ttl, ssl_context and fetch.
+    """
+    key = (jwks_uri, ssl_context, ttl, shared, scope)
+    cache = _jwks_caches.get(key)
+    if cache is None:
+        with _jwks_caches_lock:
+            cache = _jwks_caches.get(key)
+            if cache is None:
+                cache = _jwks_caches[key] = JWKSCache(jwks_uri, ssl_context=ssl_context, ttl=ttl, fetch=fetch,
+                                                      shared=shared)
+    return cache
+
+
+def drop_jwks_cache(cache):
+    """Forget a process-wide JWKSCache, e.g. once its realm is no longer served."""
+    with _jwks_caches_lock:
+        for key in [key for key, value in _jwks_caches.items() if value is cache]:
+            del _jwks_caches[key]
@@ -0,0 +1,72 @@
+# Claims the handler itself relies on (revocation, refresh, expiry), kept whatever the projection.
+REQUIRED_CLAIMS = frozenset(["sub", "sid", "iat", "exp"])
+# Token response fields used after login, the rest of the response (scope, token_type...) isn't stored when slimming.
+TOKEN_FIELDS = ("access_token", "id_token", "refresh_token", "expires_at", "refresh_expires_at")
+
+_SLOTS = ("sub", "sid", "iat", "exp", "preferred_username", "email", "email_verified", "name", "given_name",
+          "family_name", "realm_access", "resource_access")
+_MISSING = object()
+_RAISE = object()
+
+
+class ClaimProjection:
+    """Keep only the listed claims (plus REQUIRED_CLAIMS) of session["data"] and session["user"]."""
+
+    def __init__(self, claims):
+        self.claims = frozenset(claims) | REQUIRED_CLAIMS
+
+    def project(self, key, value):
+        if not isinstance(value, dict):
+            return value
+        if key == "token":
+            return {name: value[name] for name in TOKEN_FIELDS if name in value}
+        if key in ("data", "user"):
+            return {name: claim for name, claim in value.items() if name in self.claims}
+        return value
+
+
+class Claims:
+    """
+    Read-only view of the claims of a session (``data``, then ``user``), set as ``flask.g.claims``.
+
+    Nothing is read until a claim is accessed, the usual OIDC claims are then kept in slots, so repeated
+    ``g.claims.preferred_username`` are plain attribute reads (None if the claim is missing). Any claim is available
+    as ``g.claims["locale"]`` or ``g.claims.get("locale")``.
+    """
+
+    __slots__ = ("_session", "_sources") + _SLOTS
+
+    def __init__(self, session):
+        self._session = session
+        self._sources = None
+
+    def _lookup(self, name, default=_RAISE):
+        if self._sources is None:
+            self._sources = [source for source in (self._session.get("data"), self._session.get("user"))
+                             if isinstance(source, dict)]
+        for source in self._sources:
+            if name in source:
+                return source[name]
+        if default is _RAISE:
+            raise KeyError(name)
+        return default
+
+    def __getattr__(self, name):
+        # Only called while the slot is still empty.
+        if name not in _SLOTS:
+            raise AttributeError(name)
+        value = self._lookup(name, None)
+        object.__setattr__(self, name, value)
+        return value
+
+    def __getitem__(self, name):
+        return self._lookup(name)
+
+    def get(self, name, default=None):
+        return self._lookup(name, default)
+
+    def __contains__(self, name):
+        return self._lookup(name, _MISSING) is not _MISSING
+
+    def __bool__(self):
+        return self._lookup("sub", None) is not None
@@ -0,0 +1,171 @@
+import binascii
+import json
+import struct
+import threading
+import zlib
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSessionInterface
+from itsdangerous import URLSafeTimedSerializer
+
+from .cache import LRUCache
+
+_MAGIC = b"\xdf\x01"
+_JWT_FIELDS = ("access_token", "id_token", "refresh_token")
+_URLSAFE = bytes.maketrans(b"+/", b"-_")
+_STANDARD = bytes.maketrans(b"-_", b"+/")
+
+
+def _b64decode(segment):
+    return binascii.a2b_base64(segment.translate(_STANDARD) + b"=" * (-len(segment) % 4))
+
+
+def _b64encode(raw):
+    return binascii.b2a_base64(raw, newline=False).rstrip(b"=").translate(_URLSAFE)
+
+
+def split_jwt(token):
+    """Return the raw (base64url decoded) segments of a JWT, or None if they wouldn't encode back to ``token``."""
+    if not isinstance(token, str) or token.count(".") != 2:
+        return None
+    try:
+        encoded = token.encode("ascii")
+        segments = [_b64decode(segment) for segment in encoded.split(b".")]
+    except (ValueError, binascii.Error):
+        return None
+    if b".".join(_b64encode(segment) for segment in segments) != encoded:
+        return None
+    return segments
+
+
+class CompactSessionSerializer:
+    """
+    Session serializer storing the auth part of the session (``token``, ``data``, ``user``) in a compact form.
+
+    The JWTs of the token are kept as raw bytes instead of base64 text, ``data`` (the id_token claims) is stored as
+    a reference to the id_token payload and ``user`` only as its differences to ``data``. The whole frame is zlib
+    compressed. Sessions written by the default serializer are still read, so it can be enabled on a running app.
+
+    The size of every serialized session is recorded, see ``stats()``.
+    """
+
+    def __init__(self, level=1, cache_size=1024):
+        self.level = level
+        self.fallback = TaggedJSONSerializer()
+        # Raw segments -> JWT text, the same session is loaded on every request.
+        self._encoded = LRUCache(cache_size)
+        self.saves = 0
+        self.bytes_total = 0
+        self.bytes_last = 0
+        self._lock = threading.Lock()
+
+    def dumps(self, value):
+        value = dict(value)
+        token = value.get("token")
+        jwts = {}
+        if isinstance(token, dict):
+            token = dict(token)
+            for field in _JWT_FIELDS:
+                segments = split_jwt(token.get(field))
+                if segments is not None:
+                    jwts[field] = segments
+                    del token[field]
+            value["token"] = token
+        meta = dict(session=value, jwts=list(jwts))
+        payload = self._id_token_payload(jwts)
+        data = value.get("data")
+        if payload is not None and isinstance(data, dict) and \
+                all(name in payload and payload[name] == claim for name, claim in data.items()):
+            # The claims come from the id_token, only their names are stored.
+            meta["data"] = list(data)
+            del value["data"]
+        user = value.get("user")
+        if isinstance(user, dict) and isinstance(data, dict):
+            same = [name for name, claim in user.items() if name in data and data[name] == claim]
+            meta["user_same"] = same
+            value["user"] = {name: claim for name, claim in user.items() if name not in set(same)}
+        encoded_meta = self.fallback.dumps(meta).encode()
+        segments = [segment for field in jwts.values() for segment in field]
+        # Lengths of the meta and of every JWT segment, then their content.
+        header = struct.pack(f"<{1 + len(segments)}I", len(encoded_meta), *map(len, segments))
+        body = bytes([len(segments)]) + header + encoded_meta + b"".join(segments)
+        serialized = _MAGIC + zlib.compress(body, self.level)
+        if not value:
+            # Empty sessions are never stored (itsdangerous also probes the serializer with one).
+            return serialized
+        with self._lock:
+            self.saves += 1
+            self.bytes_total += len(serialized)
+            self.bytes_last = len(serialized)
+        return serialized
+
+    @staticmethod
+    def _id_token_payload(jwts):
+        if "id_token" not in jwts:
+            return None
+        try:
+            return json.loads(jwts["id_token"][1])
+        except ValueError:
+            return None
+
+    def loads(self, serialized):
+        if isinstance(serialized, str):
+            return self.fallback.loads(serialized)
+        if not serialized.startswith(_MAGIC):
+            return self.fallback.loads(serialized.decode())
+        body = zlib.decompress(serialized[len(_MAGIC):])
+        lengths = struct.unpack_from(f"<{1 + body[0]}I", body, 1)
+        offset = 1 + 4 * len(lengths)
+        parts = []
+        for length in lengths:
+            parts.append(body[offset:offset + length])
+            offset += length
+        meta = self.fallback.loads(parts[0].decode())
+        value = meta["session"]
+        jwts = {}
+        for i, field in enumerate(meta["jwts"]):
+            segments = jwts[field] = tuple(parts[1 + 3 * i:4 + 3 * i])
+            encoded = self._encoded.get(segments)
+            if encoded is None:
+                encoded = b".".join([_b64encode(segment) for segment in segments]).decode("ascii")
+                self._encoded.put(segments, encoded)
+            value["token"][field] = encoded
+        if "data" in meta:
+            payload = self._id_token_payload(jwts)
+            value["data"] = {name: payload[name] for name in meta["data"]}
+        if "user_same" in meta:
+            data = value.get("data") or {}
+            user = {name: data[name] for name in meta["user_same"]}
+            user.update(value["user"])
+            value["user"] = user
+        return value
+
+    def stats(self):
+        return dict(saves=self.saves, bytes_last=self.bytes_last,
+                    bytes_mean=self.bytes_total / self.saves if self.saves else 0.0)
+
+
+class _CookieSerializer(URLSafeTimedSerializer):
+    def dumps(self, obj, salt=None):
+        # The payload is binary, but once signed and base64 encoded the cookie value is plain ascii.
+        signed = super().dumps(obj, salt)
+        return signed.decode("ascii") if isinstance(signed, bytes) else signed
+
+
+class CompactCookieSessionInterface(SecureCookieSessionInterface):
+    """Flask's signed cookie session, serialized with CompactSessionSerializer."""
+
+    def __init__(self, serializer=None):
+        self.serializer = CompactSessionSerializer() if serializer is None else serializer
+        self._signing_serializers = {}
+
+    def get_signing_serializer(self, app):
+        if not app.secret_key:
+            return None
+        # Built once per secret key instead of on every open/save.
+        signing_serializer = self._signing_serializers.get(app.secret_key)
+        if signing_serializer is None:
+            signer_kwargs = dict(key_derivation=self.key_derivation, digest_method=self.digest_method)
+            signing_serializer = self._signing_serializers[app.secret_key] = _CookieSerializer(
+                app.secret_key, salt=self.salt, serializer=self.serializer, signer_kwargs=signer_kwargs)
+        return signing_serializer
@@ -1,41 +1,86 @@
 from __future__ import annotations
 from datetime import timedelta
 import json
+import hmac
 import os
-import re
 import ssl
 import urllib.parse
-from typing import Union, List, TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Union, List, TYPE_CHECKING
 from uuid import uuid4
 
-import jwt
-from flask import Flask, redirect, session, request, Response, g
-from jwt import PyJWKClient
-from keycloak.exceptions import KeycloakConnectionError, KeycloakAuthenticationError, KeycloakPostError, \
-    KeycloakGetError, KeycloakError
-from keycloak.keycloak_openid import KeycloakOpenID
+from flask import Flask, redirect, session, request, Response, g, current_app
+from itsdangerous import BadData, URLSafeTimedSerializer
 from werkzeug.wrappers import Request
 
+from .admission import LoginAdmission, LoginRejected, retry_page
+from .authorization import RoutePolicyIndex
+from .bearer import BEARER_CLAIMS_KEY, bearer_challenge, bearer_token
+from .breaker import CLOSED, HALF_OPEN, CircuitBreaker
+from .cache import TokenCache, check_expiry, get_jwks_cache
+from .claims import ClaimProjection, Claims
+from .codec import CompactCookieSessionInterface, CompactSessionSerializer
+from .discovery import DiscoveryCache
+from .lazy import lazy_import, load
+from .metrics import Metrics
+from .realms import AUTH_MIDDLEWARE_KEY, PATH, MultiRealmMiddleWare, RealmRegistry, RealmResolver, token_realm
+from .refresh import RefreshRejected, TokenRefresher, is_rejected, stamp_token
+from .revocation import RevocationIndex, validate_logout_token
+from .routing import ABORT, BEARER, CALLBACK, DASH_UPDATE, DASH_UPDATE_PATH, WHITELISTED, RouteClassifier
+from .sessions import ServerSideSessionInterface
+from .shared import SharedCache
+from .transport import KeycloakTransport, is_unavailable
+from .watchdog import SessionWatchdog
+
+# Cookie of the nonce binding signed states to the browser, and the key of a request's nonce in the WSGI environ.
+STATE_NONCE_COOKIE = "keycloak_state_nonce"
+STATE_NONCE_KEY = "dash_flask_keycloak.state_nonce"
+
+# Loaded on first use, so that importing the package stays cheap.
+jwt = lazy_import("jwt")
+keycloak = lazy_import("keycloak")
+
 if TYPE_CHECKING:
     from dash import Dash
 
 
+def io_call(func, *args, **kwargs):
+    """A call yielded by ``AuthMiddleWare.flow`` to be made by its caller."""
+    return func, args, kwargs
+
+
+def key_algorithm(signing_key):
+    """Name of the algorithm of a PyJWK, which PyJWT only exposes from 2.9 on."""
+    name = getattr(signing_key, "algorithm_name", None)
+    if name is None:
+        name = next(name for name, algorithm in signing_key._algorithms.items() if algorithm is signing_key.Algorithm)
+    return name
+
+
+def decode_signed(token, signing_key, **kwargs):
+    """
+    ``jwt.decode`` accepting the algorithm of the signing key only, the one of the token header isn't trusted (an
+    HS256 token naming an RSA key would be checked as an HMAC otherwise). A key which doesn't fit raises
+    InvalidKeyError.
+    """
+    try:
+        return jwt.decode(token, key=signing_key.key, algorithms=[key_algorithm(signing_key)], **kwargs)
+    except (TypeError, ValueError) as e:
+        raise jwt.InvalidKeyError(f"The signing key doesn't fit the token: {e}") from e
+
+
 class Objectify(object):
     def __init__(self, **kwargs):
         self.__dict__.update({key.lower(): kwargs[key] for key in kwargs})
 
 
-def check_match_in_list(patterns, to_check):
-    if patterns is None or to_check is None:
-        return False
-    for pattern in patterns:
-        if re.search(pattern, to_check):
-            return True
-    return False
-
-
 class AuthHandler:
-    def __init__(self, app, config, session_interface, keycloak_openid, ssl_context, state_control, session_lifetime):
+    def __init__(self, app, config, session_interface, keycloak_openid, ssl_context, state_control, session_lifetime,
+                 jwks_cache_ttl=300, token_cache_size=1024, refresh_margin=None, background_refresh=False,
+                 transport=None, lazy_userinfo=False, discovery_cache=None, metrics=None, shared_cache=None,
+                 revocation_index=None, signed_state=False, state_max_age=600, session_claims=None,
+                 bearer_audience=None, login_admission=None):
         self.app = app
         self.config = config
         self.session_interface = session_interface
@@ -44,23 +89,124 @@ class AuthHandler:
         self.config_object = Objectify(config=config, **config)
         self.ssl_context = ssl_context
         self.state_control = state_control
+        if state_control and signed_state and not config.get("SECRET_KEY"):
+            raise RuntimeError("signed_state requires the app SECRET_KEY (or a client secret key).")
+        self.state_max_age = state_max_age
         self.session_lifetime = session_lifetime
-        self.well_known_metadata = self.keycloak_openid.well_known()
+        # Only these claims (and the token fields the handler needs) are kept in the session, if given.
+        self.claim_projection = None if session_claims is None else ClaimProjection(session_claims)
+        self.metrics = Metrics() if metrics is None else metrics
+        self.transport = transport
+        self.breaker = None if transport is None else transport.breaker
+        if transport is not None:
+            transport.attach(keycloak_openid)
+        self.discovery_cache = discovery_cache
+        if discovery_cache is None:
+            self.well_known_metadata = self.keycloak_openid.well_known()
+            discovery = None
+        else:
+            # Boot from the on-disk copy, Keycloak is only waited on if there is none.
+            discovery = discovery_cache.get(keycloak_openid)
+            self.well_known_metadata = discovery["well_known"]
+        # Signed states carry their own proof, so redirects to the login page don't write the session. The issuer is
+        # part of the salt, a state of one realm is no good at the callback of another.
+        self.state_serializer = None
+        if state_control and signed_state:
+            self.state_serializer = URLSafeTimedSerializer(
+                config["SECRET_KEY"], salt=f"dash-flask-keycloak-state|{self.well_known_metadata['issuer']}")
+        jwks_uri = self.well_known_metadata["jwks_uri"]
+        # A custom ssl_context is only understood by PyJWKClient, otherwise keys come through the pooled transport.
+        if transport is not None and ssl_context is None:
+            jwks_fetch = partial(transport.get_json, jwks_uri)
+        else:
+            jwks_fetch = jwt.PyJWKClient(jwks_uri, cache_jwk_set=False, ssl_context=ssl_context).fetch_data
+        # Signing keys are shared by the handlers of the process that point at the same jwks_uri through the same
+        # transport and options.
+        self.jwks_cache = get_jwks_cache(jwks_uri, ssl_context, jwks_cache_ttl,
+                                         self.metrics.timed("jwks_fetch", jwks_fetch), shared_cache,
+                                         scope=(transport, self.metrics))
+        if discovery is not None:
+            if not self.jwks_cache.is_fresh():
+                self.jwks_cache.update(discovery["jwks"])
+            if not discovery_cache.is_fresh(discovery):
+                discovery_cache.revalidate(keycloak_openid, self.update_discovery)
+        self.lazy_userinfo = lazy_userinfo
+        self._login_executor = None if lazy_userinfo else ThreadPoolExecutor(thread_name_prefix="keycloak-login")
+        # Coalesces duplicate callbacks and bounds the concurrent code exchanges.
+        self.login_admission = LoginAdmission() if login_admission is None else login_admission
+        # Already verified id_tokens, so the signature is checked once per token instead of once per request.
+        self.token_cache = TokenCache(token_cache_size, shared_cache,
+                                      f"{self.well_known_metadata['issuer']}|{keycloak_openid.client_id}|")
+        # Verified bearer access tokens, apart from the id_tokens since they are checked against another audience.
+        self.bearer_audience = keycloak_openid.client_id if bearer_audience is None else bearer_audience
+        self.bearer_cache = TokenCache(token_cache_size, shared_cache,
+                                       f"bearer|{self.well_known_metadata['issuer']}|{self.bearer_audience}|")
+        self.metrics.gauges.update(token_cache_hits=lambda: self.token_cache.hits,
+                                   token_cache_misses=lambda: self.token_cache.misses,
+                                   token_cache_size=lambda: len(self.token_cache))
+        # Sessions ended by Keycloak (back-channel logout), checked on every request.
+        self.revocation_index = revocation_index
+        self.refresher = None
+        if refresh_margin is not None:
+            self.refresher = TokenRefresher(keycloak_openid, refresh_margin, background_refresh)
+
+    def update_discovery(self, discovery):
+        self.well_known_metadata = discovery["well_known"]
+        self.jwks_cache.update(discovery["jwks"])
+
+    def decode_id_token(self, id_token):
+        data = self.token_cache.get(id_token)
+        if data is not None:
+            return data
+        return self.verify_id_token(id_token, self.jwks_cache.get_signing_key_from_jwt(id_token))
+
+    def verify_id_token(self, id_token, signing_key):
+        with self.metrics.time("jwt_verify"):
+            data = decode_signed(
+                id_token,
+                signing_key,
+                audience=self.keycloak_openid.client_id,
+                options={"verify_exp": False},
+            )
+        # Cached expired or not, the signature of an expired token (the session outlives it) isn't checked again.
+        self.token_cache.put(id_token, data)
+        return check_expiry(data)
+
+    def decode_access_token(self, access_token):
+        claims = self.bearer_cache.get(access_token)
+        if claims is not None:
+            return claims
+        return self.verify_access_token(access_token, self.jwks_cache.get_signing_key_from_jwt(access_token))
+
+    def verify_access_token(self, access_token, signing_key):
+        """Verify the signature, expiry, audience (bearer_audience) and issuer of a bearer access token."""
+        with self.metrics.time("jwt_verify"):
+            claims = decode_signed(
+                access_token,
+                signing_key,
+                audience=self.bearer_audience,
+                issuer=self.well_known_metadata["issuer"],
+                options={"require": ["exp"], "verify_exp": False},
+            )
+        if str(claims.get("typ", "Bearer")).lower() != "bearer":
+            # An id_token (or refresh token) of the client is not an access token.
+            raise jwt.InvalidTokenError(f'Not an access token ("{claims["typ"]}" token)')
+        self.bearer_cache.put(access_token, claims)
+        return check_expiry(claims)
+
+    def open_session(self, request):
+        local_session = self.session_interface.open_session(self.config_object, request)
+        local_session.permanent = True if self.session_lifetime is not None else False
+        return local_session
 
     def is_token_valid(self, local_session):
         token = local_session.get("token", None)
         if token is not None:
             # JWT Decode
-            jwks_client = PyJWKClient(self.well_known_metadata["jwks_uri"], ssl_context=self.ssl_context)
-            signing_key = jwks_client.get_signing_key_from_jwt(token["id_token"])
             try:
-                data = jwt.decode(
-                    token["id_token"],
-                    key=signing_key.key,
-                    algorithms=self.well_known_metadata["id_token_signing_alg_values_supported"],
-                    audience=self.keycloak_openid.client_id,
-                )
-            except jwt.DecodeError:
+                data = self.decode_id_token(token["id_token"])
+            except (jwt.DecodeError, jwt.InvalidAlgorithmError, jwt.InvalidKeyError, jwt.PyJWKClientError):
+                # PyJWKClientError: signed with a key unknown to the realm, e.g. a session from another realm.
                 return False
             except jwt.ExpiredSignatureError:
                 pass
@@ -71,6 +217,60 @@ class AuthHandler:
             #         return True
         return True
 
+    def is_revoked(self, local_session):
+        data = local_session.get("data", None)
+        if self.revocation_index is None or not isinstance(data, dict):
+            return False
+        return self.revocation_index.is_revoked(data.get("sid"), data.get("sub"), data.get("iat"))
+
+    def verify_logout_token(self, logout_token):
+        signing_key = self.jwks_cache.get_signing_key_from_jwt(logout_token)
+        claims = decode_signed(
+            logout_token,
+            signing_key,
+            audience=self.keycloak_openid.client_id,
+            issuer=self.well_known_metadata["issuer"],
+            options={"require": ["iat"]},
+        )
+        return validate_logout_token(claims)
+
+    def backchannel_logout(self, logout_token):
+        """Verify a logout token sent by Keycloak and revoke the session (sid) or user (sub) it names."""
+        claims = self.verify_logout_token(logout_token)
+        if claims.get("sid"):
+            # Keycloak also sends the sub of a single session logout, the other sessions of the user stay valid.
+            self.revocation_index.revoke(sid=claims["sid"])
+        else:
+            self.revocation_index.revoke(sub=claims["sub"])
+        self.metrics.inc("backchannel_logouts_total")
+        return claims
+
+    def refresh_session(self, local_session):
+        token = local_session.get("token", None)
+        if self.refresher is None or not isinstance(token, dict) or "refresh_token" not in token:
+            return False
+        if not self.refresher.needs_refresh(token):
+            return False
+        # Only wait for the refresh once the token has actually expired (or if there is no background pool).
+        wait = self.refresher.is_expired(token) or not self.refresher.background
+        try:
+            with self.metrics.time("token_refresh"):
+                token = self.refresher.refresh(token, wait=wait)
+            if token is None:
+                return False
+            data = self.decode_id_token(token["id_token"])
+        except (keycloak.KeycloakError, jwt.PyJWTError) as e:
+            if is_rejected(e):
+                # The refresh token is no good any more (SSO session over or idle), neither is the session.
+                self.metrics.inc("refresh_rejected_total")
+                local_session.clear()
+                raise RefreshRejected() from e
+            current_app.logger.warning("Unable to refresh keycloak token.", exc_info=True)
+            return False
+        local_session["token"] = self.project("token", token)
+        local_session["data"] = self.project("data", data)
+        return True
+
     def is_state_valid(self, local_session, request):
         session_state = local_session.get("state", None)
         request_state = request.args.get("state")
@@ -79,52 +279,109 @@ class AuthHandler:
                 return False
         return True
 
+    def make_state(self, nonce, return_path=None):
+        """Signed, timestamped state holding the nonce of the browser and the path to return to after login."""
+        return self.state_serializer.dumps([nonce, return_path])
+
+    def load_state(self, state, nonce):
+        """
+        Return the payload of a signed state, or None if it is missing, forged, older than state_max_age or issued to
+        another browser than the one holding ``nonce`` (a state taken from a login url is no good to anyone else).
+        """
+        if not state or not nonce:
+            return None
+        try:
+            state_nonce, return_path = self.state_serializer.loads(state, max_age=self.state_max_age)
+        except (BadData, ValueError, TypeError):
+            return None
+        if not isinstance(state_nonce, str) or not hmac.compare_digest(state_nonce, nonce):
+            return None
+        return dict(nonce=state_nonce, return_path=return_path)
+
     def is_logged_in(self, local_session):
         return "token" in local_session
 
     def auth_url(self, state, callback_uri):
-        if self.state_control:
-            auth_url = self.keycloak_openid.auth_url(redirect_uri=callback_uri, scope="openid", state=state)
-        else:
-            auth_url = self.keycloak_openid.auth_url(redirect_uri=callback_uri, scope="openid", state="")
-        return auth_url
+        # Same url as KeycloakOpenID.auth_url, which would fetch the discovery document on every call.
+        return keycloak.urls_patterns.URL_AUTH.format(**{
+            "authorization-endpoint": self.well_known_metadata["authorization_endpoint"],
+            "client-id": self.keycloak_openid.client_id,
+            "redirect-uri": callback_uri,
+            "scope": "openid",
+            "state": state if self.state_control else "",
+        })
+
+    def login_key(self, kwargs, login_binding=None):
+        """
+        Key of the code exchange in the login admission (shared by the realms, hence the issuer), None for the grants
+        which must not be shared: anything but an authorization code, or a code of another browser (``login_binding``).
+        """
+        if kwargs.get("grant_type") != "authorization_code" or not kwargs.get("code") or not login_binding:
+            return None
+        return f"{self.well_known_metadata['issuer']}|{kwargs['code']}|{login_binding}"
 
-    def login(self, local_session, response, **kwargs):
+    def exchange_code(self, **kwargs):
+        """Session content (token, id_token claims and userinfo unless lazy_userinfo) of an authorization code."""
+        # Get access token from Keycloak.
         try:
-            # Get access token from Keycloak.
-            try:
-                token = self.keycloak_openid.token(**kwargs)
-            except KeycloakPostError as e:
-                raise e
-            # JWT Decode
-            jwks_client = PyJWKClient(self.well_known_metadata["jwks_uri"], ssl_context=self.ssl_context)
-            signing_key = jwks_client.get_signing_key_from_jwt(token["id_token"])
-            #
-            data = jwt.decode(
-                token["id_token"],
-                key=signing_key.key,
-                algorithms=self.well_known_metadata["id_token_signing_alg_values_supported"],
-                audience=self.keycloak_openid.client_id,
-            )
-            # Get extra info.
-            user = self.keycloak_openid.userinfo(token['access_token'])
-            # introspect = self.keycloak_openid.introspect(token['access_token'])
+            with self.metrics.time("token_exchange"):
+                token = stamp_token(self.keycloak_openid.token(**kwargs))
+        except keycloak.KeycloakPostError as e:
+            raise e
+        # Get extra info, while the id_token is being verified.
+        user = None if self.lazy_userinfo else self._login_executor.submit(self.userinfo, token['access_token'])
+        # JWT Decode
+        claims = dict(token=token, data=self.decode_id_token(token["id_token"]))
+        # introspect = self.keycloak_openid.introspect(token['access_token'])
+        if user is not None:
+            claims["user"] = user.result()
+        return claims
+
+    def login(self, local_session, response, login_binding=None, **kwargs):
+        try:
+            claims = self.login_admission.exchange(self.login_key(kwargs, login_binding),
+                                                   partial(self.exchange_code, **kwargs))
             # Bind info to the session.
-            response = self.set_session(local_session, response, token=token, data=data, user=user)
-        except KeycloakAuthenticationError as e:
+            if isinstance(self.session_interface, ServerSideSessionInterface):
+                self.session_interface.regenerate(local_session)
+            response = self.set_session(local_session, response, **claims)
+        except keycloak.KeycloakAuthenticationError as e:
             return e
 
         return response
 
+    def userinfo(self, access_token):
+        with self.metrics.time("userinfo"):
+            if self.transport is None:
+                return self.keycloak_openid.userinfo(access_token)
+            # Per-request header, python-keycloak sets it on the connection shared by all threads.
+            return self.transport.get_json(self.well_known_metadata["userinfo_endpoint"],
+                                           headers={"Authorization": "Bearer " + access_token})
+
+    def get_user(self, local_session):
+        """Return the userinfo of the session, fetching it on first access if login skipped it (lazy_userinfo)."""
+        user = local_session.get("user", None)
+        token = local_session.get("token", None)
+        if user is None and isinstance(token, dict):
+            user = local_session["user"] = self.project("user", self.userinfo(token["access_token"]))
+        return user
+
+    def project(self, key, value):
+        if self.claim_projection is None:
+            return value
+        return self.claim_projection.project(key, value)
+
     def set_session(self, local_session, response, **kwargs):
         for kw in kwargs:
-            local_session[kw] = kwargs[kw]
-        self.session_interface.save_session(self.config_object, local_session, response)
+            local_session[kw] = self.project(kw, kwargs[kw])
+        with self.metrics.time("session_save"):
+            self.session_interface.save_session(self.config_object, local_session, response)
         return response
 
     def clean_session(self, local_session, response):
         local_session.clear()
-        self.session_interface.save_session(self.config_object, local_session, response)
+        with self.metrics.time("session_save"):
+            self.session_interface.save_session(self.config_object, local_session, response)
         return response
 
     def logout(self, response=None):
@@ -132,13 +389,17 @@ class AuthHandler:
             self.keycloak_openid.logout(session["token"]["refresh_token"])
         except KeyError:
             pass
+        except keycloak.KeycloakError:
+            # The local session ends anyway, Keycloak's expires on its own.
+            current_app.logger.warning("Unable to end the keycloak session.", exc_info=True)
         session.clear()
         return response
 
 
 class AuthMiddleWare:
     def __init__(self, app, auth_handler, redirect_uri=None, uri_whitelist=None,
-                 prefix_callback_path=None, abort_on_unauthorized=None, before_login=None):
+                 prefix_callback_path=None, abort_on_unauthorized=None, before_login=None, route_policy=None,
+                 bearer_paths=None):
         self.app = app
         self.auth_handler = auth_handler
         self._redirect_uri = redirect_uri
@@ -149,6 +410,11 @@ class AuthMiddleWare:
         self.prefix = prefix_callback_path.rstrip('/')
         self.callback_path = self.prefix + "/keycloak/callback"
         self.abort_on_unauthorized = abort_on_unauthorized
+        # Patterns are compiled once, every request is then classified before the session is touched.
+        self.classifier = RouteClassifier(uri_whitelist, abort_on_unauthorized, self.callback_path,
+                                          bearer_paths=bearer_paths)
+        # Compiled route -> required roles index, None if no route is restricted.
+        self.route_policy = route_policy if route_policy else None
 
     def get_auth_uri(self, state, environ):
         return self.auth_handler.auth_url(state, self.get_callback_uri(environ))
@@ -167,66 +433,215 @@ class AuthMiddleWare:
             host = environ.get("HTTP_X_FORWARDED_SERVER", environ.get("HTTP_HOST"))
             return f"{scheme}://{host}"
 
+    def get_return_uri(self, environ, return_path):
+        # Only local paths are followed, the redirect uri keeps the scheme and host.
+        if not return_path or not return_path.startswith("/") or return_path.startswith("//") or "\\" in return_path:
+            return self.get_redirect_uri(environ)
+        path, _, query = return_path.partition("?")
+        return urllib.parse.urlparse(self.get_redirect_uri(environ))._replace(path=path, query=query).geturl()
+
+    def new_state(self, request):
+        if self.auth_handler.state_serializer is None:
+            return uuid4().hex
+        return_path = request.path
+        # Dash is sent to the login path, returning there after login would make no sense.
+        if return_path == self.prefix + "/login":
+            return_path = None
+        elif request.query_string:
+            return_path += "?" + request.query_string.decode("latin-1")
+        # Every state of the browser holds its nonce, the cookie set along with the redirect to the login page.
+        nonce = request.environ[STATE_NONCE_KEY] = request.cookies.get(STATE_NONCE_COOKIE) or uuid4().hex
+        return self.auth_handler.make_state(nonce, return_path)
+
+    def set_state_nonce(self, response, environ):
+        """Set (or prolong) the nonce cookie binding the signed states of the login to this browser."""
+        nonce = environ.get(STATE_NONCE_KEY)
+        if nonce is None:
+            return response
+        session_interface = self.auth_handler.session_interface
+        config_object = self.auth_handler.config_object
+        # Lax, it has to come along with the redirect from Keycloak to the callback.
+        response.set_cookie(STATE_NONCE_COOKIE, nonce, max_age=self.auth_handler.state_max_age, httponly=True,
+                            domain=session_interface.get_cookie_domain(config_object),
+                            path=session_interface.get_cookie_path(config_object),
+                            secure=session_interface.get_cookie_secure(config_object), samesite="Lax")
+        return response
+
+    def callback_redirect(self, environ, request):
+        """Where to go after the callback, None if the signed state doesn't hold (or there is no state at all)."""
+        if self.auth_handler.state_serializer is None:
+            return redirect(self.get_redirect_uri(environ))
+        state = self.auth_handler.load_state(request.args.get("state"), request.cookies.get(STATE_NONCE_COOKIE))
+        if state is None:
+            return None
+        return redirect(self.get_return_uri(environ, state["return_path"]))
+
     def redirect_to_login_page(self, state, environ, path):
-        if '/_dash-update-component' in path:
+        metrics = self.auth_handler.metrics
+        # Dash updates get the JSON navigation whatever their route, abort_on_unauthorized patterns included.
+        if DASH_UPDATE_PATH in path:
+            metrics.inc("redirects_total", dict(kind="dash"))
             return Response(json.dumps({"multi": True, "response": {"url": {"pathname": self.prefix + "/login"}}}))
-        return redirect(self.get_auth_uri(state, environ))
+        metrics.inc("redirects_total", dict(kind="login"))
+        with metrics.time("redirect"):
+            return self.set_state_nonce(redirect(self.get_auth_uri(state, environ)), environ)
 
-    def __call__(self, environ, start_response):
-        response = None
-        request = Request(environ)
-        glob_session = self.auth_handler.session_interface.open_session(self.auth_handler.config_object, request)
-        glob_session.permanent = True if self.auth_handler.session_lifetime is not None else False
-        state = uuid4().hex
-        # If the uri has been whitelisted, just proceed.
-        if check_match_in_list(self.uri_whitelist, request.path):
-            return self.app(environ, start_response)
-        # Check token validity, especially token expiring
-        if not self.auth_handler.is_token_valid(glob_session):
+    def keycloak_unavailable(self):
+        """Fail a login at once while Keycloak can't be reached, instead of retrying it on every request."""
+        self.auth_handler.metrics.inc("keycloak_unavailable_total")
+        breaker = self.auth_handler.breaker
+        retry_after = breaker.retry_after() if breaker is not None else 0
+        return Response("Keycloak is unavailable, please try again later.", 503,
+                        {"Retry-After": str(max(retry_after, 1)), "Cache-Control": "no-store"})
+
+    def login_binding(self, request):
+        """What ties a callback to its browser (state and session cookie), only the same one shares an exchange."""
+        session_interface = self.auth_handler.session_interface
+        cookie = request.cookies.get(session_interface.get_cookie_name(self.auth_handler.config_object))
+        return f"{request.args.get('state', '')}|{cookie or ''}"
+
+    def login_rejected(self, error):
+        """Retry page of a callback turned away by the login admission, its code is exchanged on the next try."""
+        self.auth_handler.metrics.inc("login_rejected_total", dict(reason=error.reason))
+        return retry_page(error.retry_after)
+
+    def unauthorized(self, request, environ, route):
+        """
+        Response to a request without a session: 401 on abort routes, the JSON navigation for Dash updates, the login
+        redirect otherwise. Along with the state to remember in the session, None unless there is one to remember.
+        """
+        if route == ABORT:
+            return Response("Unauthorized", 401), None
+        if route == DASH_UPDATE:
+            # Dash only gets told to navigate to the login page, the state is generated there.
+            return self.redirect_to_login_page(None, environ, request.path), None
+        # Remember the state in the session, unless it is signed.
+        state = self.new_state(request)
+        response = self.redirect_to_login_page(state, environ, request.path)
+        if self.auth_handler.state_control and self.auth_handler.state_serializer is None:
+            return response, state
+        return response, None
+
+    def bearer_flow(self, request, environ):
+        """
+        Authenticate an API request by its bearer access token alone: no session, no redirect. Return None when it
+        may proceed (its claims are then in the environ), the 401/403/503 response otherwise.
+        """
+        metrics = self.auth_handler.metrics
+        access_token = bearer_token(request)
+        if access_token is None:
+            metrics.inc("bearer_rejected_total", dict(reason="missing"))
+            return bearer_challenge()
+        try:
+            claims = yield io_call(self.auth_handler.decode_access_token, access_token)
+        except jwt.PyJWTError as e:
+            metrics.inc("bearer_rejected_total", dict(reason="invalid"))
+            return bearer_challenge("invalid_token", str(e))
+        except keycloak.KeycloakError as e:
+            if not is_unavailable(e):
+                raise
+            return self.keycloak_unavailable()
+        # Same checks as for a session, on a session made of the token alone.
+        local_session = dict(token=dict(access_token=access_token), data=claims)
+        if self.auth_handler.is_revoked(local_session):
+            metrics.inc("bearer_rejected_total", dict(reason="revoked"))
+            return bearer_challenge("invalid_token", "The session of the token has been ended")
+        if self.route_policy is not None and not self.route_policy.is_allowed(local_session, request.path):
+            metrics.inc("forbidden_total")
+            return Response("Forbidden", 403)
+        environ[BEARER_CLAIMS_KEY] = claims
+        return None
+
+    def flow(self, request, environ):
+        """
+        Decide what becomes of a request: return the response to send, or None to pass it on to the app.
+
+        The calls which may wait on Keycloak or on the session store are not made here but yielded, as
+        ``(callable, args, kwargs)``, to the caller, which sends their result back (or throws their error in):
+        ``__call__`` makes them in the worker thread, the ASGI middleware awaits them.
+        """
+        auth_handler = self.auth_handler
+        metrics = auth_handler.metrics
+        with metrics.time("route_classification"):
+            route = self.classifier.classify(request.path)
+        metrics.inc("requests_total", dict(route=route))
+        # If the uri has been whitelisted, just proceed (without opening the session).
+        if route == WHITELISTED:
+            return None
+        if route == BEARER:
+            return (yield from self.bearer_flow(request, environ))
+        with metrics.time("session_open"):
+            glob_session = yield io_call(auth_handler.open_session, request)
+        # Check token validity, especially token expiring, and whether Keycloak has ended the session since.
+        valid = yield io_call(auth_handler.is_token_valid, glob_session)
+        if not valid or auth_handler.is_revoked(glob_session):
             # response = redirect(self.get_auth_uri(state, environ))
-            response = self.redirect_to_login_page(state, environ, request.path)
-            response = self.auth_handler.clean_session(glob_session, response)
-            return response(environ, start_response)
+            response = self.redirect_to_login_page(self.new_state(request), environ, request.path)
+            return (yield io_call(auth_handler.clean_session, glob_session, response))
         # Check session state validity
-        if self.auth_handler.state_control and not self.auth_handler.is_state_valid(glob_session, request):
+        if auth_handler.state_control and not auth_handler.is_state_valid(glob_session, request):
             response = Response("Invalid state", 400)
-            response = self.auth_handler.clean_session(glob_session, response)
-            return response(environ, start_response)
-        # If we are logged in, just proceed.
-        if self.auth_handler.is_logged_in(glob_session):
-            return self.app(environ, start_response)
+            return (yield io_call(auth_handler.clean_session, glob_session, response))
+        # If we are logged in, just proceed (if the roles of the user allow the route).
+        if auth_handler.is_logged_in(glob_session):
+            if self.route_policy is not None and not self.route_policy.is_allowed(glob_session, request.path):
+                metrics.inc("forbidden_total")
+                return Response("Forbidden", 403)
+            if route == CALLBACK and auth_handler.state_serializer is not None:
+                # Another tab has completed its login meanwhile, this one just goes back where it came from.
+                return self.callback_redirect(environ, request) or redirect(self.get_redirect_uri(environ))
+            return None
         # Before login hook.
         if self.before_login:
-            response = self.before_login(request, redirect(self.get_redirect_uri(environ)), self.auth_handler)
-            return response(environ, start_response)
+            return (yield io_call(self.before_login, request, redirect(self.get_redirect_uri(environ)), auth_handler))
+        response = None
         # On callback, request access token.
-        if request.path == self.callback_path:
+        if route == CALLBACK:
+            response = self.callback_redirect(environ, request)
+            if response is None:
+                return Response("Invalid state", 400)
             kwargs = dict(
                 # grant_type=["authorization_code"],
                 grant_type="authorization_code",
                 code=request.args.get("code", "unknown"),
                 redirect_uri=self.get_callback_uri(environ))
-            response = self.auth_handler.login(glob_session, redirect(self.get_redirect_uri(environ)), **kwargs)
-            if isinstance(response, KeycloakError):
+            try:
+                with metrics.time("login"):
+                    response = yield io_call(auth_handler.login, glob_session, response, self.login_binding(request),
+                                             **kwargs)
+            except LoginRejected as e:
+                return self.login_rejected(e)
+            except keycloak.KeycloakError as e:
+                if not is_unavailable(e):
+                    raise
+                return self.keycloak_unavailable()
+            if isinstance(response, keycloak.KeycloakError):
                 # if response is error, will redirect to the login page
                 # response = redirect(self.get_auth_uri(state, environ))
-                response = self.redirect_to_login_page(state, environ, request.path)
-                response = self.auth_handler.clean_session(glob_session, response)
-                return response(environ, start_response)
+                response = self.redirect_to_login_page(self.new_state(request), environ, request.path)
+                return (yield io_call(auth_handler.clean_session, glob_session, response))
         # If unauthorized, redirect to login page.
         if self.callback_path not in request.path:
-            if check_match_in_list(self.abort_on_unauthorized, request.path):
-                response = Response("Unauthorized", 401)
-            else:
-                # response = redirect(self.get_auth_uri(state, environ))
-                response = self.redirect_to_login_page(state, environ, request.path)
-                if self.auth_handler.state_control:
-                    response = self.auth_handler.set_session(glob_session, response, state=state)
-        # Save the session.
-        if response:
-            return response(environ, start_response)
-        # Request is authorized, just proceed.
-        return self.app(environ, start_response)
+            response, state = self.unauthorized(request, environ, route)
+            if state is not None:
+                response = yield io_call(auth_handler.set_session, glob_session, response, state=state)
+        # Request is authorized (no response), just proceed.
+        return response or None
+
+    def __call__(self, environ, start_response):
+        flow = self.flow(Request(environ), environ)
+        try:
+            func, args, kwargs = next(flow)
+            while True:
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as e:
+                    func, args, kwargs = flow.throw(e)
+                else:
+                    func, args, kwargs = flow.send(result)
+        except StopIteration as stop:
+            response = stop.value
+        return (response or self.app)(environ, start_response)
 
 
 class FlaskKeycloak:
@@ -234,8 +649,18 @@ class FlaskKeycloak:
                  heartbeat_path=None,
                  login_path=None, prefix_callback_path=None,
                  abort_on_unauthorized=None, before_login=None, ssl_context=None, state_control=True,
-                 session_lifetime=None):
+                 session_lifetime=None, jwks_cache_ttl=300, token_cache_size=1024, session_store=None,
+                 refresh_margin=None, background_refresh=False, keycloak_timeout=(3.05, 10), keycloak_pool_size=20,
+                 lazy_userinfo=False, discovery_cache_path=None, discovery_cache_ttl=3600, metrics_path=None,
+                 metrics_hook=None, route_roles=None, authorization_settings_path=None, shared_cache_path=None,
+                 backchannel_logout_path=None, revocation_ttl=36000, signed_state=False, state_max_age=600,
+                 session_claims=None, compact_session=False, realms=None, realm_from="host", default_realm=None,
+                 max_realms=64, session_watchdog=False, circuit_breaker_threshold=None, circuit_breaker_reset=30,
+                 circuit_breaker_probes=1, bearer_paths=None, bearer_audience=None, max_concurrent_logins=None,
+                 login_queue_size=64, login_queue_timeout=10):
         server = app if isinstance(app, Flask) else app.server
+        # Deferred at import, but needed by the first request anyway.
+        load(jwt, keycloak)
         logout_path = '/logout' if logout_path is None else logout_path
         uri_whitelist = [] if uri_whitelist is None else uri_whitelist
         # uri_whitelist = uri_whitelist + [logout_path]
@@ -243,45 +668,200 @@ class FlaskKeycloak:
             uri_whitelist = uri_whitelist + [heartbeat_path]
         if login_path is not None:
             uri_whitelist = uri_whitelist + [login_path]
+        if metrics_path is not None:
+            uri_whitelist = uri_whitelist + [metrics_path]
+        if backchannel_logout_path is not None:
+            uri_whitelist = uri_whitelist + [backchannel_logout_path]
         # Bind secret key.
         if keycloak_openid._client_secret_key is not None:
             server.config['SECRET_KEY'] = keycloak_openid._client_secret_key
             if session_lifetime is not None:
                 server.config['PERMANENT_SESSION_LIFETIME'] = session_lifetime
                 # server.permanent_session_lifetime = session_lifetime
+        discovery_cache = None
+        if discovery_cache_path is not None:
+            discovery_cache = DiscoveryCache(discovery_cache_path, discovery_cache_ttl)
+        shared_cache = None
+        if shared_cache_path is not None:
+            shared_cache = SharedCache(shared_cache_path)
+        revocation_index = None
+        if backchannel_logout_path is not None:
+            revocation_index = RevocationIndex(revocation_ttl, shared_cache)
+        session_serializer = CompactSessionSerializer() if compact_session else None
+        # Keep the session content server-side, the cookie then only carries the session id.
+        if session_store is not None:
+            server.session_interface = ServerSideSessionInterface(session_store, serializer=session_serializer)
+        elif compact_session:
+            server.session_interface = CompactCookieSessionInterface(session_serializer)
         # Add dcc.Location to Dash layout (if target app is the Dash app)
+        watchdog = None
         if type(app).__name__ == 'Dash':
             try:
                 from dash import dcc
             except ImportError:
                 raise RuntimeError('Perhaps you did not install Dash package?')
+            components = [dcc.Location(id='url', refresh=True)]
+            if session_watchdog:
+                prefix = (prefix_callback_path or "").rstrip('/')
+                watchdog = SessionWatchdog(prefix + "/login", prefix + "/keycloak/session")
+                components += watchdog.install(app)
             try:
-                app.layout.children.append(dcc.Location(id='url', refresh=True))
+                app.layout.children.extend(components)
             except AttributeError:
-                app.layout.children = [app.layout.children, dcc.Location(id='url', refresh=True)]
+                app.layout.children = [app.layout.children] + components
         # Add middleware.
-        auth_handler = AuthHandler(server.wsgi_app, server.config, server.session_interface, keycloak_openid,
-                                   ssl_context,
-                                   state_control, session_lifetime)
-        auth_middleware = AuthMiddleWare(server.wsgi_app, auth_handler, redirect_uri, uri_whitelist,
-                                         prefix_callback_path, abort_on_unauthorized, before_login)
+        wsgi_app = server.wsgi_app
+        metrics = Metrics(hook=metrics_hook)
+        # A single pool of connections to Keycloak (and a single circuit breaker), whatever the count of realms.
+        breaker = None
+        if circuit_breaker_threshold is not None:
+            breaker = CircuitBreaker(circuit_breaker_threshold, circuit_breaker_reset, circuit_breaker_probes)
+            metrics.gauges.update(
+                keycloak_circuit_state=lambda: {CLOSED: 0, HALF_OPEN: 1}.get(breaker.state, 2),
+                keycloak_circuit_rejected=lambda: breaker.rejected)
+        transport = KeycloakTransport(keycloak_timeout, pool_maxsize=keycloak_pool_size, breaker=breaker)
+        # The limit of concurrent logins applies to the Keycloak server, so to every realm together.
+        login_admission = LoginAdmission(max_concurrent_logins, login_queue_size, login_queue_timeout)
+        metrics.gauges.update(login_exchanges_active=lambda: login_admission.active,
+                              login_queue_waiting=lambda: login_admission.waiting,
+                              login_coalesced=lambda: login_admission.coalesced)
+        route_policy = RoutePolicyIndex.from_route_roles(route_roles)
+        if authorization_settings_path is not None:
+            route_policy = route_policy + RoutePolicyIndex.from_authorization_settings(authorization_settings_path)
+
+        def create_middleware(realm_openid, realm_discovery_cache, realm_callback_prefix):
+            # By keyword, the handler and middleware take many options of the same kinds.
+            realm_handler = AuthHandler(wsgi_app, server.config, server.session_interface, realm_openid,
+                                        ssl_context=ssl_context, state_control=state_control,
+                                        session_lifetime=session_lifetime, jwks_cache_ttl=jwks_cache_ttl,
+                                        token_cache_size=token_cache_size, refresh_margin=refresh_margin,
+                                        background_refresh=background_refresh, transport=transport,
+                                        lazy_userinfo=lazy_userinfo, discovery_cache=realm_discovery_cache,
+                                        metrics=metrics, shared_cache=shared_cache,
+                                        revocation_index=revocation_index, signed_state=signed_state,
+                                        state_max_age=state_max_age, session_claims=session_claims,
+                                        bearer_audience=bearer_audience, login_admission=login_admission)
+            return AuthMiddleWare(wsgi_app, realm_handler, redirect_uri=redirect_uri, uri_whitelist=uri_whitelist,
+                                  prefix_callback_path=realm_callback_prefix,
+                                  abort_on_unauthorized=abort_on_unauthorized, before_login=before_login,
+                                  route_policy=route_policy, bearer_paths=bearer_paths)
+
+        def create_realm_middleware(realm):
+            options = dict(server_url=keycloak_openid.connection.base_url, realm_name=realm,
+                           client_id=keycloak_openid.client_id, client_secret_key=keycloak_openid.client_secret_key,
+                           verify=keycloak_openid.connection.verify)
+            if isinstance(realms, dict) and realms[realm]:
+                options.update(realms[realm])
+            realm_discovery_cache = None
+            if discovery_cache_path is not None:
+                realm_discovery_cache = DiscoveryCache(f"{os.fspath(discovery_cache_path)}.{realm}",
+                                                       discovery_cache_ttl)
+            # With path prefixed realms, each realm has its own callback under its prefix.
+            realm_callback_prefix = (prefix_callback_path or "").rstrip("/")
+            if realm_from == PATH or not isinstance(realm_from, str) and PATH in realm_from:
+                realm_callback_prefix = f"/{realm}{realm_callback_prefix}"
+            return create_middleware(keycloak.KeycloakOpenID(**options), realm_discovery_cache,
+                                     realm_callback_prefix)
+
+        realm_registry = None
+        if realms is None:
+            auth_middleware = create_middleware(keycloak_openid, discovery_cache, prefix_callback_path)
+            auth_handler = auth_middleware.auth_handler
+            server.wsgi_app = auth_middleware
+        else:
+            # Realms are created on their first request, there is no single handler.
+            auth_middleware = auth_handler = None
+            realm_registry = RealmRegistry(create_realm_middleware, realms, max_realms)
+            resolver = RealmResolver(realm_from, realm_registry, server.session_interface,
+                                     Objectify(config=server.config, **server.config), default_realm)
+            server.wsgi_app = MultiRealmMiddleWare(wsgi_app, realm_registry, resolver, uri_whitelist)
+            metrics.gauges.update(
+                realms_loaded=lambda: len(realm_registry),
+                token_cache_hits=lambda: sum(m.auth_handler.token_cache.hits for m in realm_registry.middlewares()),
+                token_cache_misses=lambda: sum(m.auth_handler.token_cache.misses
+                                               for m in realm_registry.middlewares()),
+                token_cache_size=lambda: sum(len(m.auth_handler.token_cache) for m in realm_registry.middlewares()))
+
+        def current_middleware():
+            # None for a whitelisted path matching no realm.
+            return request.environ.get(AUTH_MIDDLEWARE_KEY, auth_middleware)
+
+        def bearer_claims():
+            # Claims of a request authenticated by a bearer access token (which has no session), else None.
+            claims = request.environ.get(BEARER_CLAIMS_KEY)
+            middleware = current_middleware()
+            if claims is None and bearer_paths and middleware is not None and \
+                    middleware.classifier.classify(request.path) == BEARER and bearer_token(request) is not None:
+                # Behind the ASGI middleware, the token verified there is found again in the cache.
+                try:
+                    claims = middleware.auth_handler.bearer_cache.get(bearer_token(request))
+                except jwt.ExpiredSignatureError:
+                    claims = None
+            return claims
 
         def _save_external_url():
-            g.external_url = auth_middleware.get_redirect_uri(request.environ)
+            middleware = current_middleware()
+            if middleware is not None:
+                g.external_url = middleware.get_redirect_uri(request.environ)
+            g.bearer_claims = bearer_claims()
+            # Nothing is read from the session until a claim is accessed.
+            g.claims = Claims(session if g.bearer_claims is None else dict(data=g.bearer_claims))
 
         server.before_request(_save_external_url)
-        server.wsgi_app = auth_middleware
+        if refresh_margin is not None:
+            def _refresh_token():
+                middleware = current_middleware()
+                if middleware is not None and g.bearer_claims is None:
+                    try:
+                        middleware.auth_handler.refresh_session(session)
+                    except RefreshRejected:
+                        # The session has ended at Keycloak, whitelisted routes go on without it.
+                        route = middleware.classifier.classify(request.path)
+                        if route == WHITELISTED:
+                            return None
+                        response, state = middleware.unauthorized(request, request.environ, route)
+                        if state is not None:
+                            session["state"] = state
+                        return response
+
+            server.before_request(_refresh_token)
+        if watchdog is not None:
+            def _publish_session_expiry(response):
+                middleware = current_middleware()
+                if middleware is None or g.get("bearer_claims") is not None:
+                    return response
+                # Only pages (and the session route the watchdog polls) carry the cookie: reading the session for
+                # assets, Dash callbacks or whitelisted routes would add a Set-Cookie and Vary: Cookie to them.
+                is_page = response.mimetype == "text/html" and \
+                    middleware.classifier.classify(request.path) != WHITELISTED
+                if not is_page and request.path != watchdog.session_path:
+                    return response
+                return watchdog.publish(server, middleware.auth_handler, session, request, response)
+
+            server.after_request(_publish_session_expiry)
+        if session_serializer is not None:
+            metrics.gauges.update(session_bytes_last=lambda: session_serializer.bytes_last,
+                                  session_bytes_mean=lambda: session_serializer.stats()["bytes_mean"])
+        self.server = server
+        self.auth_handler = auth_handler
+        self.auth_middleware = auth_middleware
+        self.realms = realm_registry
+        self.metrics = metrics
 
         # Add logout mechanism.
         if logout_path:
             @server.route(logout_path, methods=["GET", 'POST'])
             def route_logout():
-                return auth_handler.logout(redirect(auth_middleware.get_redirect_uri(request.environ)))
+                middleware = current_middleware()
+                return middleware.auth_handler.logout(redirect(middleware.get_redirect_uri(request.environ)))
         if login_path:
             @server.route(login_path, methods=["GET", 'POST'])
             def route_login():
-                if session.get('user') is not None:
-                    return redirect(auth_middleware.get_redirect_uri(request.environ))
+                middleware = current_middleware()
+                if middleware is None:
+                    return "Unknown realm", 404
+                if middleware.auth_handler.is_logged_in(session):
+                    return redirect(middleware.get_redirect_uri(request.environ))
                 if request.method == 'GET':
                     return ('<form method="post">'
                             '<input type="text" name="username" id="un" title="username" placeholder="username"/>'
@@ -296,16 +876,65 @@ class FlaskKeycloak:
                     credentials = request.json
                 else:
                     return "No username and/or password was specified in request", 400
-                response = auth_handler.login(session, redirect(auth_middleware.get_redirect_uri(request.environ)),
-                                              **credentials)
-                if isinstance(response, KeycloakError):
+                response = middleware.auth_handler.login(
+                    session, redirect(middleware.get_redirect_uri(request.environ)), **credentials)
+                if isinstance(response, keycloak.KeycloakError):
                     session.clear()
                     return response.error_message, response.response_code
                 return response
+        if watchdog is not None:
+            @server.route(watchdog.session_path, methods=['GET'])
+            def route_session():
+                # Authenticated and refreshed like any other route, the new expiry cookie is set on the way out.
+                return Response(status=204, headers={"Cache-Control": "no-store"})
         if heartbeat_path:
             @server.route(heartbeat_path, methods=['GET'])
             def route_heartbeat_path():
                 return "Chuck Norris can kill two stones with one bird."
+        if metrics_path:
+            @server.route(metrics_path, methods=['GET'])
+            def route_metrics():
+                return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+        if backchannel_logout_path:
+            @server.route(backchannel_logout_path, methods=['POST'])
+            def route_backchannel_logout():
+                headers = {"Cache-Control": "no-store"}
+                try:
+                    logout_token = request.form["logout_token"]
+                    middleware = current_middleware()
+                    if realm_registry is not None:
+                        # Keycloak posts to the same url for every realm, the token tells which one it comes from.
+                        middleware = realm_registry.get(token_realm(logout_token))
+                    middleware.auth_handler.backchannel_logout(logout_token)
+                except (KeyError, ValueError, TypeError, jwt.PyJWTError) as e:
+                    # Whatever the token got wrong, Keycloak is told it sent an invalid request rather than a 500.
+                    error = dict(error="invalid_request", error_description=str(e))
+                    return Response(json.dumps(error), 400, headers, mimetype="application/json")
+                return Response(status=200, headers=headers)
+
+    def asgi(self, asgi_app=None, client=None):
+        """
+        Switch the app to the ASGI variant of the middleware, for serving behind an ASGI server.
+
+        The WSGI middleware is removed from the Flask server and the returned AsgiAuthMiddleWare runs the same flow
+        with non-blocking Keycloak calls.
+
+        :param asgi_app: ASGI app to protect, by default the Flask server wrapped with asgiref's WsgiToAsgi
+        :param client: httpx.AsyncClient used for Keycloak calls
+        :return: AsgiAuthMiddleWare instance
+        """
+        from .asgi import AsgiAuthMiddleWare, AsyncAuthHandler
+
+        if self.realms is not None:
+            raise RuntimeError("The ASGI middleware doesn't support multiple realms.")
+        self.server.wsgi_app = self.auth_middleware.app
+        if asgi_app is None:
+            try:
+                from asgiref.wsgi import WsgiToAsgi
+            except ImportError:
+                raise RuntimeError('Perhaps you did not install asgiref package?')
+            asgi_app = WsgiToAsgi(self.server)
+        return AsgiAuthMiddleWare(asgi_app, self.auth_middleware, AsyncAuthHandler(self.auth_handler, client))
 
     @staticmethod
     def build(app: Union[Dash, Flask], redirect_uri: str = None, config_path: Union[str, os.PathLike] = None,
@@ -314,7 +943,22 @@ class FlaskKeycloak:
               authorization_settings_path: str = None, uri_whitelist: List[str] = None, login_path: str = None,
               prefix_callback_path: str = '', abort_on_unauthorized: List[str] = None, debug_user=None,
               debug_roles: str = None, ssl_context: ssl.SSLContext = None, state_control: bool = True,
-              session_lifetime: Union[int, timedelta] = None):
+              session_lifetime: Union[int, timedelta] = None, jwks_cache_ttl: int = 300,
+              token_cache_size: int = 1024, session_store=None, refresh_margin: int = None,
+              background_refresh: bool = False, keycloak_timeout: Union[float, tuple] = (3.05, 10),
+              keycloak_pool_size: int = 20, lazy_userinfo: bool = False,
+              discovery_cache_path: Union[str, os.PathLike] = None, discovery_cache_ttl: int = 3600,
+              metrics_path: str = None, metrics_hook: Callable[[str, float], None] = None,
+              route_roles: Dict[str, Union[str, List[str]]] = None,
+              shared_cache_path: Union[str, os.PathLike] = None, backchannel_logout_path: str = None,
+              revocation_ttl: int = 36000, signed_state: bool = False, state_max_age: int = 600,
+              session_claims: List[str] = None, compact_session: bool = False,
+              realms: Union[List[str], Dict[str, dict]] = None,
+              realm_from: Union[str, Callable, List[Union[str, Callable]]] = "host", default_realm: str = None,
+              max_realms: int = 64, session_watchdog: bool = False, circuit_breaker_threshold: int = None,
+              circuit_breaker_reset: float = 30, circuit_breaker_probes: int = 1, bearer_paths: List[str] = None,
+              bearer_audience: Union[str, List[str]] = None, max_concurrent_logins: int = None,
+              login_queue_size: int = 64, login_queue_timeout: float = 10):
         """
         Build FlaskKeycloak class instance
 
@@ -324,7 +968,9 @@ class FlaskKeycloak:
         :param config_data: keycloak parameters for KeycloakOpenID
         :param logout_path: logout path
         :param heartbeat_path: heartbeat_path
-        :param authorization_settings_path: keycloak authorization settings
+        :param authorization_settings_path: keycloak authorization settings. The resource permissions (resource uris
+            and the role policies applied to them) are enforced on every request, a 403 is returned otherwise. Raises
+            ValueError if a permission applies another type of policy.
         :param uri_whitelist: uri which will proceed upon authorization
         :param login_path: if given, this route will proceed upon authorization and credentials can be given as json via post request
         :param prefix_callback_path: prefix callback path
@@ -335,19 +981,78 @@ class FlaskKeycloak:
         :param state_control: if True, will control state parameter in keycloak redirect uri and in session's cookie
         :param session_lifetime: if isn't None, session will include lifespan.
             Should be a datetime.timedelta object or count of seconds (int).
+        :param jwks_cache_ttl: how long (in seconds) fetched signing keys are reused before the JWKS is fetched again
+        :param token_cache_size: max count of verified id_tokens remembered until their expiry.
+            Hit/miss counts are available via ``auth_handler.token_cache.stats()``.
+        :param session_store: if given, the session is kept server-side in this store (MemorySessionStore,
+            SQLiteSessionStore or RedisSessionStore) and the cookie only carries an opaque session id
+        :param refresh_margin: if isn't None, tokens are refreshed via the refresh grant this many seconds before expiry
+        :param background_refresh: if True, refreshes of not yet expired tokens run in a background thread pool
+            and are picked up by the following request, so requests never wait on Keycloak
+        :param keycloak_timeout: timeout of every Keycloak call, seconds or a (connect, read) tuple
+        :param keycloak_pool_size: max count of kept-alive connections to Keycloak
+        :param lazy_userinfo: if True, userinfo isn't fetched on login (the id_token claims are in session["data"]),
+            but on first access via ``auth_handler.get_user(session)``
+        :param discovery_cache_path: if given, the discovery document and JWKS are cached in this file and workers
+            start from it without calling Keycloak (a stale file is revalidated in the background).
+            See ``FlaskKeycloak.warm_discovery_cache`` to fill it once before forking workers.
+        :param discovery_cache_ttl: seconds after which the cached discovery document is revalidated
+        :param metrics_path: if given, per-phase auth counters and latency histograms are served on this path
+            in the Prometheus text format (the path is whitelisted, like heartbeat_path)
+        :param metrics_hook: optional callable(phase, seconds) called on every latency observation
+        :param route_roles: {path pattern: roles}, a user needs any of the roles of the first pattern matching the
+            path, otherwise a 403 is returned. Realm roles are given by name, client roles as "client-id/role".
+        :param shared_cache_path: if given, verified id_tokens and the JWKS are shared through this memory-mapped file
+            by every worker of the host, so a token verified by one worker is trusted by the others until it expires.
+            Keep it in a directory only the app user can write to.
+        :param backchannel_logout_path: if given, Keycloak logout tokens are accepted on this path (set
+            "Backchannel logout URL" of the client to it). Sessions ended in Keycloak are then rejected on their next
+            request. With shared_cache_path, a logout received by one worker applies to all of them.
+        :param revocation_ttl: seconds a revoked sid/sub is remembered, should be at least Keycloak's SSO Session Max
+        :param signed_state: if True (and state_control), the state is a value signed with the app secret holding a
+            nonce and the path to return to, verified at the callback instead of being stored in the session.
+            Redirects to the login page then don't write the session, and several tabs can log in at once. The
+            nonce is the browser's, kept in a "keycloak_state_nonce" cookie (HttpOnly, SameSite=Lax, for
+            state_max_age), so a state taken from a login url can't be used by another browser (login CSRF).
+        :param state_max_age: seconds a signed state stays valid, i.e. the time a user has to log in
+        :param session_claims: if given, only these claims of session["data"] and session["user"] are kept (plus
+            sub, sid, iat and exp), and only the token fields used after login. Claims are readable as
+            ``flask.g.claims.preferred_username`` / ``flask.g.claims["claim"]`` in any case.
+        :param compact_session: if True, the session is serialized with CompactSessionSerializer (raw JWT bytes,
+            deduplicated claims, zlib). Session sizes are reported as the session_bytes_* metrics.
+        :param realms: if given, serve several realms of the Keycloak server of the config (multi-tenant mode):
+            a list of realm names, or {realm name: KeycloakOpenID arguments overriding the config, e.g. client_id}.
+            Each realm gets its own client, discovery document and key/token caches, created on its first request.
+            The config's realm_name is then only used for the app secret key.
+        :param realm_from: how the realm of a request is picked, "host" (first label of the host name), "path"
+            (first path segment, the callback of each realm is then under it; other paths such as Dash's
+            /_dash-update-component, logout_path or login_path go to the realm of the session, or default_realm if
+            there is no session yet), "iss" (issuer of the session's token), a callable(request) returning the realm
+            name, or a list of these tried in order
+        :param default_realm: realm used when none is found for a request, otherwise a 404 is returned
+        :param max_realms: max count of realms kept at once, the least recently used one is dropped beyond that
+        :param session_watchdog: if True (Dash apps), the page is told when the session ends (a cookie readable by
+            the page) and a clientside callback holds back Dash callbacks once it has, going to the login page
+            instead. With refresh_margin, the tokens are refreshed in the background shortly before they expire.
+        :param circuit_breaker_threshold: if given, calls to Keycloak stop after this many consecutive failures
+            (connection errors, timeouts, 5xx): logins then get a 503 at once, while logged in users go on with the
+            cached keys and tokens. State in the keycloak_circuit_state metric (0 closed, 1 half-open, 2 open).
+        :param circuit_breaker_reset: seconds the circuit stays open before probe calls are let through
+        :param circuit_breaker_probes: count of calls let through while half-open, a success closes the circuit
+        :param bearer_paths: uri patterns of API routes authenticated by an "Authorization: Bearer <access token>"
+            header instead of the session: the token is verified locally (signature, expiry, audience, issuer, and
+            the cached result reused until it expires), no session is read or written and a 401 is returned instead
+            of a redirect. The claims are in ``flask.g.claims``. route_roles apply to the roles of the token.
+        :param bearer_audience: audience required in bearer access tokens, by default the client_id (Keycloak only
+            puts it there with an audience mapper on the calling client)
+        :param max_concurrent_logins: if given, at most this many authorization codes are exchanged with Keycloak at
+            once, the other callbacks wait in a queue. Concurrent callbacks of the same code always share one exchange.
+        :param login_queue_size: max count of callbacks waiting for an exchange, the others get a 503 retry page
+        :param login_queue_timeout: seconds a callback waits for an exchange before getting the retry page
         :return: FlaskKeycloak class instance
         """
         try:
-            # The oidc json is either read from a file with 'config_path' or is directly passed as 'config_data'
-            if not config_data:
-                # Read config, assumed to be in Keycloak OIDC JSON format.
-                config_path = "keycloak.json" if config_path is None else config_path
-                with open(config_path, 'r') as f:
-                    config_data = json.load(f)
-            else:
-                if isinstance(config_data, str):
-                    config_data = json.load(config_data)
-            keycloak_openid = KeycloakOpenID(**config_data)
+            keycloak_openid = keycloak.KeycloakOpenID(**_read_config(config_path, config_data))
             if authorization_settings_path is not None:
                 keycloak_openid.load_authorization_config(authorization_settings_path)
         except FileNotFoundError as ex:
@@ -356,13 +1061,50 @@ class FlaskKeycloak:
             if before_login is None:
                 raise ex
             # Create dummy object, we are bypassing keycloak anyway.
-            keycloak_openid = KeycloakOpenID("url", "name", "client_id", "client_secret_key")
+            keycloak_openid = keycloak.KeycloakOpenID("url", "name", "client_id", "client_secret_key")
         return FlaskKeycloak(app, keycloak_openid, redirect_uri, logout_path=logout_path,
                              heartbeat_path=heartbeat_path, uri_whitelist=uri_whitelist, login_path=login_path,
                              prefix_callback_path=prefix_callback_path,
                              abort_on_unauthorized=abort_on_unauthorized,
                              before_login=_setup_debug_session(debug_user, debug_roles), ssl_context=ssl_context,
-                             state_control=state_control, session_lifetime=session_lifetime)
+                             state_control=state_control, session_lifetime=session_lifetime,
+                             jwks_cache_ttl=jwks_cache_ttl, token_cache_size=token_cache_size,
+                             session_store=session_store, refresh_margin=refresh_margin,
+                             background_refresh=background_refresh, keycloak_timeout=keycloak_timeout,
+                             keycloak_pool_size=keycloak_pool_size, lazy_userinfo=lazy_userinfo,
+                             discovery_cache_path=discovery_cache_path, discovery_cache_ttl=discovery_cache_ttl,
+                             metrics_path=metrics_path, metrics_hook=metrics_hook, route_roles=route_roles,
+                             authorization_settings_path=authorization_settings_path,
+                             shared_cache_path=shared_cache_path, backchannel_logout_path=backchannel_logout_path,
+                             revocation_ttl=revocation_ttl, signed_state=signed_state,
+                             state_max_age=state_max_age, session_claims=session_claims,
+                             compact_session=compact_session, realms=realms, realm_from=realm_from,
+                             default_realm=default_realm, max_realms=max_realms,
+                             session_watchdog=session_watchdog,
+                             circuit_breaker_threshold=circuit_breaker_threshold,
+                             circuit_breaker_reset=circuit_breaker_reset,
+                             circuit_breaker_probes=circuit_breaker_probes, bearer_paths=bearer_paths,
+                             bearer_audience=bearer_audience, max_concurrent_logins=max_concurrent_logins,
+                             login_queue_size=login_queue_size, login_queue_timeout=login_queue_timeout)
+
+    @staticmethod
+    def warm_discovery_cache(discovery_cache_path: Union[str, os.PathLike], config_path: Union[str, os.PathLike] = None,
+                             config_data: Union[str, dict] = None, discovery_cache_ttl: int = 3600,
+                             keycloak_timeout: Union[float, tuple] = (3.05, 10)):
+        """
+        Fill the discovery cache file once, e.g. in the prefork master (gunicorn's ``on_starting`` hook),
+        so that the workers built with the same ``discovery_cache_path`` boot without calling Keycloak.
+
+        :param discovery_cache_path: path of the discovery cache file
+        :param config_path: path to the keycloak.json file
+        :param config_data: keycloak parameters for KeycloakOpenID
+        :param discovery_cache_ttl: the file is only refetched if it is older than this many seconds
+        :param keycloak_timeout: timeout of the Keycloak calls, seconds or a (connect, read) tuple
+        :return: the cached entry (fetch time, discovery document and JWKS)
+        """
+        keycloak_openid = KeycloakTransport(keycloak_timeout).attach(
+            keycloak.KeycloakOpenID(**_read_config(config_path, config_data)))
+        return DiscoveryCache(discovery_cache_path, discovery_cache_ttl).warm(keycloak_openid)
 
     @staticmethod
     def try_build(app, **kwargs):
@@ -375,15 +1117,28 @@ class FlaskKeycloak:
         except IsADirectoryError:
             app.logger.exception("Keycloak configuration was directory, proceeding without authentication.")
             success = False
-        except KeycloakConnectionError:
+        except keycloak.KeycloakConnectionError:
             app.logger.exception("Unable to connect to keycloak, proceeding without authentication.")
             success = False
-        except KeycloakGetError:
+        except keycloak.KeycloakGetError:
             app.logger.exception("Encountered keycloak get error, proceeding without authentication.")
             success = False
         return success
 
 
+def _read_config(config_path, config_data):
+    # The oidc json is either read from a file with 'config_path' or is directly passed as 'config_data'
+    if not config_data:
+        # Read config, assumed to be in Keycloak OIDC JSON format.
+        config_path = "keycloak.json" if config_path is None else config_path
+        with open(config_path, 'r') as f:
+            config_data = json.load(f)
+    else:
+        if isinstance(config_data, str):
+            config_data = json.load(config_data)
+    return config_data
+
+
 def _setup_debug_session(debug_user, debug_roles, debug_token="DEBUG_TOKEN"):
     def _before_login(request, response, auth_handler):
         return auth_handler.set_session(request, response,
@@ -0,0 +1,87 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DiscoveryCache:
+    """
+    On-disk cache of a realm's discovery document and JWKS, so workers can boot without calling Keycloak.
+
+    A fresh file is used as is. A stale one is still used at startup while it is revalidated in a background thread.
+    Only a missing (or unreadable) file makes startup wait on Keycloak. Writes are atomic, so concurrently booting
+    workers never read a partial file. Call ``warm`` once (e.g. in gunicorn's ``on_starting`` hook) to fill it before
+    the workers are forked.
+    """
+
+    def __init__(self, path, ttl=3600):
+        self.path = os.fspath(path)
+        self.ttl = ttl
+        self._revalidating = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or not {"fetched_at", "well_known", "jwks"} <= entry.keys():
+            return None
+        return entry
+
+    def store(self, well_known, jwks):
+        entry = dict(fetched_at=time.time(), well_known=well_known, jwks=jwks)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".discovery-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(entry, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return entry
+
+    def is_fresh(self, entry):
+        return time.time() - entry["fetched_at"] < self.ttl
+
+    def fetch(self, keycloak_openid):
+        return self.store(keycloak_openid.well_known(), keycloak_openid.certs())
+
+    def warm(self, keycloak_openid):
+        """Fetch and store the documents unless the file is still fresh."""
+        entry = self.load()
+        if entry is None or not self.is_fresh(entry):
+            entry = self.fetch(keycloak_openid)
+        return entry
+
+    def get(self, keycloak_openid):
+        """Return the cached entry (possibly stale, see ``is_fresh``), fetching it only when there is none."""
+        entry = self.load()
+        if entry is None:
+            entry = self.fetch(keycloak_openid)
+        return entry
+
+    def revalidate(self, keycloak_openid, on_update=None):
+        """Fetch the documents in a background thread and call ``on_update`` with the new entry."""
+        if not self._revalidating.acquire(blocking=False):
+            return
+
+        def _revalidate():
+            try:
+                entry = self.fetch(keycloak_openid)
+                if on_update is not None:
+                    on_update(entry)
+            except Exception:
+                logger.warning("Unable to revalidate the keycloak discovery cache.", exc_info=True)
+            finally:
+                self._revalidating.release()
+
+        threading.Thread(target=_revalidate, name="keycloak-discovery", daemon=True).start()
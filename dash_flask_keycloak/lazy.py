@@ -0,0 +1,54 @@
+import importlib
+import sys
+
+
+class LazyModule:
+    """
+    Stand-in for the module ``name``, imported (the regular way) on its first attribute access rather than now.
+
+    Nothing is put in ``sys.modules`` before the real import, which other code of the process then shares as usual.
+    Submodules which the package doesn't import itself are imported as attributes are looked up.
+    """
+
+    __slots__ = ("_name", "_module")
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        module = self._module
+        if module is None:
+            # The import lock makes concurrent first accesses wait for a single import.
+            module = self._module = importlib.import_module(self._name)
+        return module
+
+    def __getattr__(self, attribute):
+        module = self._load()
+        try:
+            return getattr(module, attribute)
+        except AttributeError:
+            if attribute.startswith("__"):
+                raise
+            return importlib.import_module(f"{self._name}.{attribute}")
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r}>"
+
+
+def lazy_import(name):
+    """
+    Return the top-level module ``name`` if already imported, else a LazyModule importing it on first use.
+
+    Keeps PyJWT and python-keycloak (with its HTTP stack) out of the import of the package, they are loaded by
+    ``FlaskKeycloak`` once it is built.
+    """
+    module = sys.modules.get(name)
+    return LazyModule(name) if module is None else module
+
+
+def load(*modules):
+    """Finish loading lazily imported modules, before requests are served by several threads."""
+    for module in modules:
+        if isinstance(module, LazyModule):
+            module._load()
@@ -0,0 +1,103 @@
+import threading
+import time
+from bisect import bisect_left
+
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # One slot per bucket plus the +Inf one, counts are made cumulative on rendering.
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Timer:
+    __slots__ = ("metrics", "phase", "started")
+
+    def __init__(self, metrics, phase):
+        self.metrics = metrics
+        self.phase = phase
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.observe(self.phase, time.perf_counter() - self.started)
+
+
+class Metrics:
+    """
+    Counters and per-phase latency histograms of the auth layer, rendered in the Prometheus text format.
+
+    :param hook: optional ``hook(phase, seconds)`` called on every observation, for custom exporters
+    """
+
+    def __init__(self, prefix="keycloak_auth", buckets=DEFAULT_BUCKETS, hook=None):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.hook = hook
+        self.histograms = {}
+        self.counters = {}
+        # Extra gauges, name -> callable returning the current value (e.g. cache sizes).
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def time(self, phase):
+        return _Timer(self, phase)
+
+    def timed(self, phase, func):
+        def _timed(*args, **kwargs):
+            with self.time(phase):
+                return func(*args, **kwargs)
+
+        return _timed
+
+    def observe(self, phase, seconds):
+        with self._lock:
+            histogram = self.histograms.get(phase)
+            if histogram is None:
+                histogram = self.histograms[phase] = Histogram(self.buckets)
+            histogram.observe(seconds)
+        if self.hook is not None:
+            self.hook(phase, seconds)
+
+    def inc(self, name, labels=None, value=1):
+        key = (name, tuple(sorted(labels.items())) if labels else ())
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def render_prometheus(self):
+        lines = []
+        with self._lock:
+            histograms = {phase: (list(h.counts), h.sum, h.count) for phase, h in self.histograms.items()}
+            counters = dict(self.counters)
+        name = f"{self.prefix}_phase_seconds"
+        lines.append(f"# HELP {name} Latency of the auth layer phases.")
+        lines.append(f"# TYPE {name} histogram")
+        for phase, (counts, total, count) in sorted(histograms.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{phase="{phase}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{phase="{phase}"}} {total}')
+            lines.append(f'{name}_count{{phase="{phase}"}} {count}')
+        for counter in sorted({counter for counter, _ in counters}):
+            lines.append(f"# TYPE {self.prefix}_{counter} counter")
+            for (name, labels), value in sorted(counters.items()):
+                if name == counter:
+                    label_text = ",".join(f'{key}="{label}"' for key, label in labels)
+                    lines.append(f"{self.prefix}_{name}{{{label_text}}} {value}" if label_text
+                                 else f"{self.prefix}_{name} {value}")
+        for gauge, value in sorted(self.gauges.items()):
+            lines.append(f"# TYPE {self.prefix}_{gauge} gauge")
+            lines.append(f"{self.prefix}_{gauge} {value()}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,176 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from flask import Response
+from werkzeug.wrappers import Request
+
+from .bearer import bearer_token
+from .cache import LRUCache, drop_jwks_cache
+from .lazy import lazy_import
+from .routing import PatternSet
+
+jwt = lazy_import("jwt")
+
+# Key of the realm's AuthMiddleWare in the WSGI environ, for the routes registered by FlaskKeycloak.
+AUTH_MIDDLEWARE_KEY = "dash_flask_keycloak.auth_middleware"
+
+HOST = "host"
+PATH = "path"
+ISS = "iss"
+
+
+def issuer_realm(issuer):
+    """Realm name of a Keycloak issuer (``https://kc/realms/<realm>``), or None."""
+    if not isinstance(issuer, str) or "/realms/" not in issuer:
+        return None
+    return issuer.rsplit("/realms/", 1)[1].strip("/") or None
+
+
+def token_realm(token):
+    """Realm of the (unverified) issuer of a JWT, the realm's handler verifies the token afterwards anyway."""
+    try:
+        return issuer_realm(jwt.decode(token, options={"verify_signature": False}).get("iss"))
+    except jwt.PyJWTError:
+        return None
+
+
+class RealmRegistry:
+    """
+    Per-realm AuthMiddleWare (client, discovery document, JWKS and token caches), created on first use.
+
+    Only the configured ``realms`` are served. At most ``maxsize`` realms are kept, the least recently used one is
+    dropped beyond that (and recreated, i.e. discovery and keys fetched again, on its next request). Concurrent first
+    requests of a realm share a single creation.
+    """
+
+    def __init__(self, factory, realms, maxsize=64):
+        self.factory = factory
+        self.realms = frozenset(realms)
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, realm):
+        return realm in self.realms
+
+    def get(self, realm):
+        if realm not in self.realms:
+            raise KeyError(realm)
+        with self._lock:
+            future = self._entries.get(realm)
+            owner = future is None
+            if owner:
+                future = self._entries[realm] = Future()
+            else:
+                self._entries.move_to_end(realm)
+        if owner:
+            try:
+                future.set_result(self.factory(realm))
+            except BaseException as e:
+                with self._lock:
+                    self._entries.pop(realm, None)
+                future.set_exception(e)
+                raise
+            self._evict()
+        return future.result()
+
+    def _evict(self):
+        evicted = []
+        with self._lock:
+            while len(self._entries) > self.maxsize:
+                evicted.append(self._entries.popitem(last=False)[1])
+        for future in evicted:
+            if future.done() and future.exception() is None:
+                # Requests still holding the middleware finish with it, the keys are not kept for later ones.
+                drop_jwks_cache(future.result().auth_handler.jwks_cache)
+
+    def middlewares(self):
+        with self._lock:
+            futures = list(self._entries.values())
+        return [future.result() for future in futures if future.done() and future.exception() is None]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RealmResolver:
+    """
+    Pick the realm of a request, trying the strategies in order:
+
+    * ``"host"``: the first label of the host name (``tenant-a.example.com`` -> ``tenant-a``)
+    * ``"path"``: the first path segment (``/tenant-a/page`` -> ``tenant-a``). Paths outside of the realm prefixes
+      (Dash updates, logout and login paths...) go to the realm of the session's id_token, as with ``"iss"``
+    * ``"iss"``: the issuer of the id_token in the session, remembered per session cookie, or of the bearer token
+    * a callable ``(request) -> realm name or None``
+
+    Names which are not configured realms are skipped, ``default_realm`` (if any) is used when nothing matches.
+    """
+
+    def __init__(self, strategies, realms, session_interface=None, config_object=None, default_realm=None,
+                 cache_size=4096):
+        self.strategies = [strategies] if isinstance(strategies, str) or callable(strategies) else list(strategies)
+        self.realms = realms
+        self.session_interface = session_interface
+        self.config_object = config_object
+        self.default_realm = default_realm
+        self._session_realms = LRUCache(cache_size)
+
+    def resolve(self, request):
+        for strategy in self.strategies:
+            if strategy == HOST:
+                realm = request.host.split(":", 1)[0].split(".", 1)[0]
+            elif strategy == PATH:
+                realm = request.path.lstrip("/").split("/", 1)[0]
+            elif strategy == ISS:
+                realm = self.session_realm(request) or self.bearer_realm(request)
+            else:
+                realm = strategy(request)
+            if realm in self.realms:
+                return realm
+        if PATH in self.strategies and ISS not in self.strategies:
+            realm = self.session_realm(request)
+            if realm in self.realms:
+                return realm
+        return self.default_realm
+
+    @staticmethod
+    def bearer_realm(request):
+        access_token = bearer_token(request)
+        return None if access_token is None else token_realm(access_token)
+
+    def session_realm(self, request):
+        cookie = request.cookies.get(self.session_interface.get_cookie_name(self.config_object))
+        if not cookie:
+            return None
+        realm = self._session_realms.get(cookie, False)
+        if realm is False:
+            local_session = self.session_interface.open_session(self.config_object, request) or {}
+            token = local_session.get("token")
+            realm = token_realm(token["id_token"]) if isinstance(token, dict) and "id_token" in token else None
+            self._session_realms.put(cookie, realm)
+        return realm
+
+
+class MultiRealmMiddleWare:
+    """
+    Dispatch every request to the AuthMiddleWare of its realm. Whitelisted paths (heartbeat, metrics, back-channel
+    logout...) are served even when no realm matches.
+    """
+
+    def __init__(self, app, registry, resolver, uri_whitelist=None):
+        self.app = app
+        self.registry = registry
+        self.resolver = resolver
+        self.whitelist = PatternSet(uri_whitelist)
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+        realm = self.resolver.resolve(request)
+        if realm is None:
+            if self.whitelist.search(request.path):
+                return self.app(environ, start_response)
+            return Response("Unknown realm", 404)(environ, start_response)
+        middleware = self.registry.get(realm)
+        environ[AUTH_MIDDLEWARE_KEY] = middleware
+        return middleware(environ, start_response)
@@ -0,0 +1,129 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from .cache import token_digest
+from .lazy import lazy_import
+
+jwt = lazy_import("jwt")
+keycloak = lazy_import("keycloak")
+
+
+class RefreshRejected(Exception):
+    """Raised by AuthHandler.refresh_session once Keycloak has turned the refresh token down, the session is cleared."""
+
+
+def is_rejected(error):
+    """Whether Keycloak turned the refresh token down (4xx, e.g. invalid_grant once the SSO session is over)."""
+    return isinstance(error, keycloak.KeycloakError) and 400 <= (error.response_code or 0) < 500
+
+
+def stamp_token(token, now=None):
+    """Turn the relative ``expires_in`` values of a token response into absolute timestamps."""
+    now = time.time() if now is None else now
+    if "expires_in" in token:
+        token["expires_at"] = int(now + token["expires_in"])
+    if token.get("refresh_expires_in"):
+        token["refresh_expires_at"] = int(now + token["refresh_expires_in"])
+    return token
+
+
+def token_expires_at(token):
+    expires_at = token.get("expires_at")
+    if expires_at is None:
+        # Tokens stored before stamping was introduced, fall back to the claims of the tokens themselves.
+        expires = [jwt.decode(token[name], options={"verify_signature": False}).get("exp")
+                   for name in ("access_token", "id_token") if token.get(name)]
+        expires = [exp for exp in expires if exp is not None]
+        expires_at = min(expires) if expires else None
+    return expires_at
+
+
+class TokenRefresher:
+    """
+    Refresh tokens through the Keycloak refresh grant shortly before they expire.
+
+    Refreshes are single-flight per refresh token: concurrent requests of the same session (e.g. parallel Dash
+    callbacks) share one call to Keycloak. A finished refresh stays available for ``result_ttl`` seconds, so requests
+    still carrying the old token pick up the new one instead of reusing a rotated refresh token. So does a rejected
+    one, every request of the session is told. A refresh which failed otherwise (Keycloak unreachable, 5xx) is only
+    tried again after ``retry_interval`` seconds, meanwhile the requests of its refresh token go on with the old one.
+    With ``background=True`` refreshes run in a thread pool and requests whose token is still valid never wait on them.
+    """
+
+    def __init__(self, keycloak_openid, margin=30, background=False, max_workers=4, result_ttl=60, timeout=30,
+                 retry_interval=10):
+        self.keycloak_openid = keycloak_openid
+        self.margin = margin
+        self.background = background
+        self.result_ttl = result_ttl
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="keycloak-refresh") if background else None
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def needs_refresh(self, token, now=None):
+        expires_at = token_expires_at(token)
+        now = time.time() if now is None else now
+        return expires_at is not None and expires_at - self.margin <= now
+
+    def is_expired(self, token, now=None):
+        expires_at = token_expires_at(token)
+        now = time.time() if now is None else now
+        return expires_at is not None and expires_at <= now
+
+    def _kept_for(self, future):
+        """Seconds a finished refresh answers the requests of its refresh token."""
+        error = future.exception()
+        return self.retry_interval if error is not None and not is_rejected(error) else self.result_ttl
+
+    def _flight(self, refresh_token):
+        key = token_digest(refresh_token)
+        now = time.monotonic()
+        with self._lock:
+            for stale_key in [k for k, (future, finished) in self._flights.items()
+                              if future.done() and now - finished > self._kept_for(future)]:
+                del self._flights[stale_key]
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight[0], False
+            future = Future()
+            self._flights[key] = (future, now)
+            return future, True
+
+    def _run(self, future, refresh_token):
+        try:
+            future.set_result(stamp_token(self.keycloak_openid.refresh_token(refresh_token)))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            # Kept from the end of the call on, a slow failure would otherwise be tried again at once.
+            key = token_digest(refresh_token)
+            with self._lock:
+                if key in self._flights and self._flights[key][0] is future:
+                    self._flights[key] = (future, time.monotonic())
+
+    def refresh(self, token, wait=True):
+        """
+        Return the refreshed token.
+
+        With ``wait=False`` the refresh is only started (or picked up if already finished) and None is returned while
+        it is still running (or if waiting for it exceeded ``timeout``). None is also returned while a failed refresh
+        waits for its retry: its error is raised to the request which made the call only, unless Keycloak turned the
+        token down, which every request of the token is told.
+        """
+        future, owner = self._flight(token["refresh_token"])
+        if owner:
+            if self._executor is not None:
+                self._executor.submit(self._run, future, token["refresh_token"])
+            else:
+                self._run(future, token["refresh_token"])
+        if not wait and not future.done():
+            return None
+        if not owner and future.done() and future.exception() is not None and not is_rejected(future.exception()):
+            return None
+        try:
+            return future.result(self.timeout)
+        except FutureTimeoutError:
+            return None
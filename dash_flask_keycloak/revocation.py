@@ -0,0 +1,86 @@
+import threading
+import time
+
+from .lazy import lazy_import
+
+jwt = lazy_import("jwt")
+
+BACKCHANNEL_LOGOUT_EVENT = "http://schemas.openid.net/event/backchannel-logout"
+
+
+def validate_logout_token(claims):
+    """Check the claims of an already verified logout token (OIDC Back-Channel Logout 1.0, section 2.6)."""
+    events = claims.get("events")
+    if not isinstance(events, dict) or BACKCHANNEL_LOGOUT_EVENT not in events:
+        raise jwt.InvalidTokenError("The logout token does not contain the back-channel logout event")
+    if "nonce" in claims:
+        raise jwt.InvalidTokenError("A logout token must not contain a nonce")
+    if not claims.get("sid") and not claims.get("sub"):
+        raise jwt.InvalidTokenError("The logout token contains neither sid nor sub")
+    return claims
+
+
+class RevocationIndex:
+    """
+    Expiring set of the Keycloak sessions (``sid``) and users (``sub``) ended through back-channel logout.
+
+    A session is revoked if its ``sid`` is, or if its ``sub`` was revoked after the session's token was issued (a
+    user logging in again afterwards gets a fresh token). Lookups are a dict access, entries are dropped ``ttl``
+    seconds after the revocation, which should cover the longest SSO session (SSO Session Max in Keycloak).
+
+    :param shared: optional SharedCache, a logout received by one worker then applies to every worker of the host
+    """
+
+    def __init__(self, ttl=36000, shared=None, purge_interval=60):
+        self.ttl = ttl
+        self.shared = shared
+        self.purge_interval = purge_interval
+        # "sid:<value>" / "sub:<value>" -> time of the revocation.
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._next_purge = time.time() + purge_interval
+
+    def revoke(self, sid=None, sub=None, revoked_at=None):
+        revoked_at = time.time() if revoked_at is None else revoked_at
+        keys = [f"{kind}:{value}" for kind, value in (("sid", sid), ("sub", sub)) if value]
+        with self._lock:
+            for key in keys:
+                self._entries[key] = max(revoked_at, self._entries.get(key, 0))
+        if self.shared is not None:
+            for key in keys:
+                self.shared.set("revoked:" + key, repr(revoked_at).encode(), revoked_at + self.ttl)
+        self._purge()
+
+    def _revoked_at(self, key):
+        revoked_at = self._entries.get(key)
+        if revoked_at is None and self.shared is not None:
+            payload = self.shared.get("revoked:" + key)
+            if payload is not None:
+                try:
+                    revoked_at = float(payload)
+                except ValueError:
+                    return None
+        return revoked_at
+
+    def is_revoked(self, sid=None, sub=None, issued_at=None):
+        if not self._entries and self.shared is None:
+            return False
+        if sid and self._revoked_at(f"sid:{sid}") is not None:
+            return True
+        if sub:
+            revoked_at = self._revoked_at(f"sub:{sub}")
+            if revoked_at is not None and (issued_at is None or issued_at <= revoked_at):
+                return True
+        return False
+
+    def _purge(self):
+        now = time.time()
+        if now < self._next_purge:
+            return
+        with self._lock:
+            self._next_purge = now + self.purge_interval
+            self._entries = {key: revoked_at for key, revoked_at in self._entries.items()
+                             if now - revoked_at < self.ttl}
+
+    def __len__(self):
+        return len(self._entries)
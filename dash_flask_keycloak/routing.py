@@ -0,0 +1,80 @@
+import re
+
+from .cache import LRUCache
+
+WHITELISTED = "whitelisted"
+CALLBACK = "callback"
+ABORT = "abort"
+DASH_UPDATE = "dash_update"
+PROTECTED = "protected"
+BEARER = "bearer"
+
+DASH_UPDATE_PATH = "/_dash-update-component"
+
+# Backreferences are numbered across the whole expression, so such patterns cannot be merged into one alternation.
+_BACKREFERENCE = re.compile(r"\\[1-9]|\(\?P=")
+
+
+class PatternSet:
+    """A list of regex patterns matched (with ``re.search``) through as few compiled expressions as possible."""
+
+    def __init__(self, patterns=None):
+        patterns = list(patterns or [])
+        self.patterns = patterns
+        self._compiled = []
+        if not patterns:
+            return
+        if any(_BACKREFERENCE.search(pattern) for pattern in patterns):
+            self._compiled = [re.compile(pattern) for pattern in patterns]
+            return
+        try:
+            self._compiled = [re.compile("|".join(f"(?:{pattern})" for pattern in patterns))]
+        except re.error:
+            # E.g. the same named group in two patterns, fall back to one expression per pattern.
+            self._compiled = [re.compile(pattern) for pattern in patterns]
+
+    def search(self, path):
+        for compiled in self._compiled:
+            if compiled.search(path):
+                return True
+        return False
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+
+class RouteClassifier:
+    """
+    Sort request paths into whitelisted, bearer (API), callback, abort, Dash update or protected routes.
+
+    The patterns are compiled once and the result for recently seen paths is kept in an LRU, so most requests are
+    classified by a single dict lookup.
+    """
+
+    def __init__(self, uri_whitelist=None, abort_on_unauthorized=None, callback_path=None, cache_size=1024,
+                 bearer_paths=None):
+        self.whitelist = PatternSet(uri_whitelist)
+        self.bearer_paths = PatternSet(bearer_paths)
+        self.abort_on_unauthorized = PatternSet(abort_on_unauthorized)
+        self.callback_path = callback_path
+        self._cache = LRUCache(cache_size)
+
+    def classify(self, path):
+        route = self._cache.get(path)
+        if route is None:
+            route = self._classify(path)
+            self._cache.put(path, route)
+        return route
+
+    def _classify(self, path):
+        if self.whitelist.search(path):
+            return WHITELISTED
+        if self.bearer_paths.search(path):
+            return BEARER
+        if path == self.callback_path:
+            return CALLBACK
+        if self.abort_on_unauthorized.search(path):
+            return ABORT
+        if DASH_UPDATE_PATH in path:
+            return DASH_UPDATE
+        return PROTECTED
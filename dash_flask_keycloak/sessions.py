@@ -0,0 +1,200 @@
+import secrets
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from .cache import LRUCache
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.accessed = False
+
+
+class MemorySessionStore:
+    """In-process LRU store. Sessions are lost on restart and are not shared between workers."""
+
+    def __init__(self, maxsize=10000):
+        self._entries = LRUCache(maxsize)
+
+    def load(self, sid):
+        entry = self._entries.get(sid)
+        if entry is None:
+            return None
+        payload, expires_at = entry
+        if expires_at <= time.time():
+            self._entries.pop(sid)
+            return None
+        return payload
+
+    def save(self, sid, payload, ttl):
+        self._entries.put(sid, (payload, time.time() + ttl))
+
+    def touch(self, sid, ttl):
+        payload = self.load(sid)
+        if payload is not None:
+            self.save(sid, payload, ttl)
+
+    def delete(self, sid):
+        self._entries.pop(sid)
+
+
+class SQLiteSessionStore:
+    """Store backed by a SQLite database file, shared by every worker on the host."""
+
+    def __init__(self, path, table="keycloak_sessions", purge_interval=300):
+        self.path = path
+        self.table = table
+        self.purge_interval = purge_interval
+        self._local = threading.local()
+        self._last_purge = time.time()
+        with self._connection() as connection:
+            connection.execute(f"CREATE TABLE IF NOT EXISTS {self.table} "
+                               f"(sid TEXT PRIMARY KEY, payload BLOB NOT NULL, expires_at REAL NOT NULL)")
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def _purge(self, connection):
+        now = time.time()
+        if now - self._last_purge > self.purge_interval:
+            self._last_purge = now
+            connection.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (now,))
+
+    def load(self, sid):
+        row = self._connection().execute(f"SELECT payload FROM {self.table} WHERE sid = ? AND expires_at > ?",
+                                         (sid, time.time())).fetchone()
+        return None if row is None else row[0]
+
+    def save(self, sid, payload, ttl):
+        with self._connection() as connection:
+            connection.execute(f"INSERT OR REPLACE INTO {self.table} (sid, payload, expires_at) VALUES (?, ?, ?)",
+                               (sid, payload, time.time() + ttl))
+            self._purge(connection)
+
+    def touch(self, sid, ttl):
+        with self._connection() as connection:
+            connection.execute(f"UPDATE {self.table} SET expires_at = ? WHERE sid = ?", (time.time() + ttl, sid))
+
+    def delete(self, sid):
+        with self._connection() as connection:
+            connection.execute(f"DELETE FROM {self.table} WHERE sid = ?", (sid,))
+
+
+class RedisSessionStore:
+    """
+    Store backed by a Redis-compatible client.
+
+    Only ``get``, ``setex``, ``expire`` and ``delete`` are used, so ``redis.Redis`` or any local stand-in with the same
+    methods will do.
+    """
+
+    def __init__(self, client, key_prefix="keycloak_session:"):
+        self.client = client
+        self.key_prefix = key_prefix
+
+    def load(self, sid):
+        return self.client.get(self.key_prefix + sid)
+
+    def save(self, sid, payload, ttl):
+        self.client.setex(self.key_prefix + sid, int(ttl), payload)
+
+    def touch(self, sid, ttl):
+        self.client.expire(self.key_prefix + sid, int(ttl))
+
+    def delete(self, sid):
+        self.client.delete(self.key_prefix + sid)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Keep the session content in a server-side store, the cookie only carries an opaque session id.
+
+    Works both with the Flask app and with the config object used by AuthHandler, since only ``app.config`` and
+    ``app.permanent_session_lifetime`` are read.
+    """
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, sid_bytes=32, serializer=None):
+        self.store = store
+        self.sid_bytes = sid_bytes
+        if serializer is not None:
+            self.serializer = serializer
+
+    def generate_sid(self):
+        return secrets.token_urlsafe(self.sid_bytes)
+
+    def regenerate(self, session):
+        """Move the session to a fresh id, e.g. on login, so a previously issued id can't be fixated."""
+        if not session.new:
+            self.store.delete(session.sid)
+        session.sid = self.generate_sid()
+        session.new = True
+        session.modified = True
+
+    @staticmethod
+    def get_lifetime(app):
+        lifetime = getattr(app, "permanent_session_lifetime", None) or app.config["PERMANENT_SESSION_LIFETIME"]
+        return lifetime if isinstance(lifetime, timedelta) else timedelta(seconds=lifetime)
+
+    def get_expiration_time(self, app, session):
+        if session.permanent:
+            return datetime.now(timezone.utc) + self.get_lifetime(app)
+        return None
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            payload = self.store.load(sid)
+            if payload is not None:
+                return ServerSideSession(self.serializer.loads(payload), sid=sid)
+        return ServerSideSession(sid=self.generate_sid(), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        if not session:
+            if session.modified:
+                if not session.new:
+                    self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure, samesite=samesite,
+                                       httponly=httponly)
+                response.vary.add("Cookie")
+            return
+
+        ttl = self.get_lifetime(app).total_seconds()
+        if session.modified:
+            self.store.save(session.sid, self.serializer.dumps(dict(session)), ttl)
+        elif not self.should_set_cookie(app, session):
+            return
+        else:
+            self.store.touch(session.sid, ttl)
+
+        response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session), httponly=httponly,
+                            domain=domain, path=path, secure=secure, samesite=samesite)
+        response.vary.add("Cookie")
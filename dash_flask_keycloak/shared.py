@@ -0,0 +1,125 @@
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+_MAGIC = b"DFKSHM01"
+_FILE_HEADER = struct.Struct("<8sII")
+# seq (odd while a writer is busy), key digest, expiry (epoch seconds), payload length, payload crc32
+_SLOT_HEADER = struct.Struct("<I32sdII")
+_SEQ = struct.Struct("<I")
+_EMPTY_DIGEST = bytes(32)
+
+
+class SharedCache:
+    """
+    Fixed-size hash table in a memory-mapped file, shared by every worker process of a host.
+
+    Reads are lock-free: each slot carries a sequence number that writers make odd while they write (a seqlock), and
+    readers retry when it changes under them or the payload checksum doesn't match. Writers are serialized with
+    ``flock`` on the file (and a thread lock within the process). Entries expire at the time given on ``set``; when
+    all probed slots are taken the one expiring first is evicted.
+
+    The file is created with 0600 permissions: anyone able to write it can plant cache entries, so keep it in a
+    directory only the app user can write to.
+    """
+
+    def __init__(self, path, slots=2048, slot_size=8192, probes=8):
+        try:
+            import fcntl
+        except ImportError:
+            raise RuntimeError('SharedCache requires a POSIX system (fcntl).')
+        self._fcntl = fcntl
+        self.path = os.fspath(path)
+        self._lock = threading.Lock()
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                header = os.pread(fd, _FILE_HEADER.size, 0)
+                if len(header) == _FILE_HEADER.size and header[:8] == _MAGIC:
+                    # Reuse the geometry of an existing file, all workers must agree on it.
+                    _, slots, slot_size = _FILE_HEADER.unpack(header)
+                else:
+                    os.ftruncate(fd, _FILE_HEADER.size + slots * slot_size)
+                    os.pwrite(fd, _FILE_HEADER.pack(_MAGIC, slots, slot_size), 0)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        self.slots = slots
+        self.slot_size = slot_size
+        self.probes = min(probes, slots)
+        self.max_payload = slot_size - _SLOT_HEADER.size
+        self._map = mmap.mmap(fd, _FILE_HEADER.size + slots * slot_size)
+
+    @staticmethod
+    def digest(key):
+        return hashlib.sha256(key.encode() if isinstance(key, str) else key).digest()
+
+    def _offsets(self, digest):
+        start = int.from_bytes(digest[:8], "little") % self.slots
+        for i in range(self.probes):
+            yield _FILE_HEADER.size + ((start + i) % self.slots) * self.slot_size
+
+    def _read_slot(self, offset, retries=4):
+        for _ in range(retries):
+            seq, digest, expires_at, length, crc = _SLOT_HEADER.unpack_from(self._map, offset)
+            if seq & 1:
+                continue
+            payload = self._map[offset + _SLOT_HEADER.size:offset + _SLOT_HEADER.size + min(length, self.max_payload)]
+            if _SEQ.unpack_from(self._map, offset)[0] != seq:
+                continue
+            if digest != _EMPTY_DIGEST and zlib.crc32(payload) != crc:
+                continue
+            return digest, expires_at, payload
+        return None
+
+    def get(self, key):
+        digest = self.digest(key)
+        now = time.time()
+        for offset in self._offsets(digest):
+            slot = self._read_slot(offset)
+            if slot is None:
+                continue
+            slot_digest, expires_at, payload = slot
+            if slot_digest == digest:
+                return payload if expires_at > now else None
+            if slot_digest == _EMPTY_DIGEST:
+                return None
+        return None
+
+    def set(self, key, value, expires_at):
+        """Store ``value`` (bytes) until ``expires_at``, return False if it doesn't fit in a slot."""
+        if len(value) > self.max_payload:
+            return False
+        digest = self.digest(key)
+        now = time.time()
+        with self._lock:
+            self._fcntl.flock(self._fd, self._fcntl.LOCK_EX)
+            try:
+                target = None
+                for offset in self._offsets(digest):
+                    _, slot_digest, slot_expires_at, _, _ = _SLOT_HEADER.unpack_from(self._map, offset)
+                    if slot_digest == digest or slot_digest == _EMPTY_DIGEST or slot_expires_at <= now:
+                        target = offset
+                        break
+                    if target is None or slot_expires_at < _SLOT_HEADER.unpack_from(self._map, target)[2]:
+                        target = offset
+                writing = ((_SEQ.unpack_from(self._map, target)[0] + 1) | 1) & 0xFFFFFFFF
+                _SEQ.pack_into(self._map, target, writing)
+                self._map[target + _SLOT_HEADER.size:target + _SLOT_HEADER.size + len(value)] = value
+                _SLOT_HEADER.pack_into(self._map, target, writing, digest, expires_at, len(value), zlib.crc32(value))
+                _SEQ.pack_into(self._map, target, (writing + 1) & 0xFFFFFFFF)
+            finally:
+                self._fcntl.flock(self._fd, self._fcntl.LOCK_UN)
+        return True
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
@@ -0,0 +1,69 @@
+from functools import partial
+
+from .breaker import CircuitOpenError
+from .lazy import lazy_import
+
+keycloak = lazy_import("keycloak")
+requests = lazy_import("requests")
+urllib3 = lazy_import("urllib3")
+
+
+def is_unavailable(error):
+    """Whether a Keycloak error means Keycloak couldn't answer (unreachable, timeout, open circuit or 5xx)."""
+    if isinstance(error, keycloak.KeycloakConnectionError):
+        return True
+    return isinstance(error, keycloak.KeycloakError) and (error.response_code or 0) >= 500
+
+
+class KeycloakTransport:
+    """
+    Pooled keep-alive HTTP transport shared by every Keycloak call (python-keycloak's own calls, JWKS and userinfo).
+
+    :param timeout: seconds, or a ``(connect, read)`` tuple, applied to every request
+    :param pool_connections: count of connection pools (one per host) to keep
+    :param pool_maxsize: max count of kept-alive connections per host
+    :param verify: certificate validation, by default taken from the KeycloakOpenID connection on ``attach``
+    :param breaker: optional CircuitBreaker every request goes through, python-keycloak's calls included
+    """
+
+    def __init__(self, timeout=(3.05, 10), pool_connections=4, pool_maxsize=20, verify=None, max_retries=1,
+                 breaker=None):
+        self.timeout = timeout
+        self.verify = verify
+        self.breaker = breaker
+        self.session = requests.Session()
+        # Don't let requests add auth headers (same as python-keycloak's connection manager).
+        self.session.auth = lambda r: r
+        # Retry connections Keycloak refused or closed before the request was sent, whatever the method, but read
+        # errors only for idempotent methods: a token or refresh grant sent twice fails the second time.
+        retries = urllib3.util.Retry(total=max_retries, connect=max_retries, read=max_retries, status=0,
+                                     allowed_methods=urllib3.util.Retry.DEFAULT_ALLOWED_METHODS)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                                max_retries=retries)
+        if breaker is not None:
+            # At the adapter, a call counts once (retries included) whoever makes it, python-keycloak included.
+            adapter.send = partial(breaker.call, adapter.send)
+        for protocol in ("https://", "http://"):
+            self.session.mount(protocol, adapter)
+
+    def attach(self, keycloak_openid):
+        """Route the calls of ``keycloak_openid`` through this transport."""
+        connection = keycloak_openid.connection
+        if self.verify is None:
+            self.verify = connection.verify
+        self.session.proxies.update(connection._s.proxies)
+        connection._s = self.session
+        connection.timeout = self.timeout
+        return keycloak_openid
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        kwargs.setdefault("verify", True if self.verify is None else self.verify)
+        try:
+            return self.session.request(method, url, **kwargs)
+        except (requests.RequestException, CircuitOpenError) as e:
+            raise keycloak.KeycloakConnectionError("Can't connect to server (%s)" % e)
+
+    def get_json(self, url, headers=None):
+        return keycloak.exceptions.raise_error_from_response(self.request("GET", url, headers=headers),
+                                                             keycloak.KeycloakGetError)
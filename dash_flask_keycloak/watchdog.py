@@ -0,0 +1,127 @@
+import json
+import time
+
+from .refresh import token_expires_at
+
+# Runs in the browser on every tick of the watchdog interval. The first run wraps window.fetch, so the Dash callbacks
+# of an ended session are held back instead of all being sent to the server and answered with a login redirect.
+_WATCHDOG_JS = """
+function (n_intervals) {
+    var config = __CONFIG__;
+    var watchdog = window.dashFlaskKeycloakWatchdog;
+    if (!watchdog) {
+        var nativeFetch = window.fetch.bind(window);
+        watchdog = window.dashFlaskKeycloakWatchdog = {cookie: null, refreshAt: NaN, expiresAt: NaN, retryAt: 0,
+                                                       expired: false, refreshing: null};
+        watchdog.now = function () {
+            var match = document.cookie.match(new RegExp("(?:^|; )" + config.cookie + "=([^;]*)"));
+            var cookie = match ? match[1] : "";
+            if (cookie !== watchdog.cookie) {
+                // "<server time>_<refresh due>_<session end>", taken to the local clock when the cookie changes.
+                var times = cookie.split("_").map(parseFloat);
+                var skew = Date.now() / 1000 - times[0];
+                watchdog.cookie = cookie;
+                watchdog.refreshAt = times[1] + skew;
+                watchdog.expiresAt = times[2] + skew;
+            }
+            return Date.now() / 1000;
+        };
+        watchdog.expire = function () {
+            if (!watchdog.expired) {
+                watchdog.expired = true;
+                window.location.assign(config.login);
+            }
+            return new Promise(function () {});
+        };
+        watchdog.refresh = function (now) {
+            if (!watchdog.refreshing && now >= watchdog.retryAt) {
+                watchdog.retryAt = now + config.retry;
+                watchdog.refreshing = nativeFetch(config.session, {credentials: "same-origin", redirect: "manual",
+                                                                   cache: "no-store"})
+                    .then(function (response) {
+                        if (response.type === "opaqueredirect" || response.status === 401) {
+                            watchdog.expire();
+                        }
+                    }, function () {})
+                    .then(function () { watchdog.refreshing = null; });
+            }
+        };
+        window.fetch = function (input, init) {
+            if (String(input && input.url || input).indexOf("_dash-update-component") !== -1 &&
+                    (watchdog.expired || watchdog.now() >= watchdog.expiresAt)) {
+                return watchdog.expire();
+            }
+            return nativeFetch(input, init);
+        };
+    }
+    var now = watchdog.now();
+    if (now >= watchdog.expiresAt) {
+        watchdog.expire();
+    } else if (now >= watchdog.refreshAt) {
+        watchdog.refresh(now);
+    }
+    return window.dash_clientside.no_update;
+}
+"""
+
+
+class SessionWatchdog:
+    """
+    Let the Dash front end know when the session ends, so it stops firing callbacks that can only fail.
+
+    Every authenticated page carries a cookie readable by the page (``cookie_name``, not HttpOnly, holding only
+    times) with the time the tokens are due for a refresh and the time the session cookie expires. A clientside
+    callback checks it every ``check_interval`` seconds: tokens due for a refresh are refreshed by a request to
+    ``session_path`` (outside of any callback burst) and once the session has ended, the page goes to the login page
+    while pending and new callbacks are held back.
+    """
+
+    def __init__(self, login_path, session_path, cookie_name="keycloak_session_expiry", check_interval=5,
+                 retry_interval=30):
+        self.login_path = login_path
+        self.session_path = session_path
+        self.cookie_name = cookie_name
+        self.check_interval = check_interval
+        self.retry_interval = retry_interval
+
+    def install(self, app):
+        """Register the clientside callback on the Dash app, return the components to add to its layout."""
+        try:
+            from dash import dcc, Input, Output
+        except ImportError:
+            raise RuntimeError('Perhaps you did not install Dash package?')
+        config = dict(cookie=self.cookie_name, login=self.login_path, session=self.session_path,
+                      retry=self.retry_interval)
+        app.clientside_callback(_WATCHDOG_JS.replace("__CONFIG__", json.dumps(config)),
+                                Output("keycloak-watchdog", "data"),
+                                Input("keycloak-watchdog-interval", "n_intervals"))
+        return [dcc.Store(id="keycloak-watchdog"),
+                dcc.Interval(id="keycloak-watchdog-interval", interval=self.check_interval * 1000)]
+
+    @staticmethod
+    def cookie_value(auth_handler, local_session, expires_at, now=None):
+        """``<now>_<refresh due>_<session end>`` of a logged in session (unknown times left empty), else None."""
+        if not auth_handler.is_logged_in(local_session):
+            return None
+        now = time.time() if now is None else now
+        token = local_session["token"]
+        refresh_at = None
+        if auth_handler.refresher is not None and isinstance(token, dict) and "refresh_token" in token:
+            token_expiry = token_expires_at(token)
+            if token_expiry is not None:
+                refresh_at = token_expiry - auth_handler.refresher.margin
+        times = [now, refresh_at, None if expires_at is None else expires_at.timestamp()]
+        return "_".join("" if value is None else str(int(value)) for value in times)
+
+    def publish(self, app, auth_handler, local_session, request, response):
+        session_interface = app.session_interface
+        expires_at = session_interface.get_expiration_time(app, local_session)
+        value = self.cookie_value(auth_handler, local_session, expires_at)
+        options = dict(domain=session_interface.get_cookie_domain(app), path=session_interface.get_cookie_path(app),
+                       secure=session_interface.get_cookie_secure(app),
+                       samesite=session_interface.get_cookie_samesite(app))
+        if value is not None:
+            response.set_cookie(self.cookie_name, value, expires=expires_at, httponly=False, **options)
+        elif self.cookie_name in request.cookies:
+            response.delete_cookie(self.cookie_name, httponly=False, **options)
+        return response
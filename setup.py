@@ -18,10 +18,11 @@ setup(
     classifiers=[
         "Programming Language :: Python :: 3",
     ],
-    packages=find_packages(),
+    packages=find_packages(exclude=["tests", "tests.*"]),
     # packages=["flask_keycloak", "flask_keycloak.examples"],
     python_requires='>=3.8',
     # include_package_data=True,
     install_requires=["flask>=3.0.0", "PyJWT[crypto]>=2.0.0", "python-keycloak>=3.0.0"],
+    extras_require={"asgi": ["httpx", "asgiref"]},
     keywords='python, dash, flask, keycloak, pyjwt',
 )
@@ -0,0 +1,57 @@
+import logging
+import urllib.parse
+
+import pytest
+from flask import Flask, g
+
+from benchmarks.fake_keycloak import FakeKeycloak
+from dash_flask_keycloak import FlaskKeycloak
+
+logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+
+@pytest.fixture(scope="session")
+def keycloak_server():
+    with FakeKeycloak() as fake:
+        yield fake
+
+
+@pytest.fixture
+def keycloak(keycloak_server):
+    keycloak_server.latency = 0.0
+    keycloak_server.token_lifetime = 300
+    keycloak_server.failures.clear()
+    keycloak_server.calls.clear()
+    return keycloak_server
+
+
+@pytest.fixture
+def build(keycloak):
+    """Build a protected Flask app against the fake Keycloak, ``/`` and ``/page`` answer the user name."""
+
+    def _build(**kwargs):
+        app = Flask(__name__)
+
+        @app.route("/")
+        @app.route("/page")
+        def page():
+            return g.claims.get("preferred_username") or "anonymous"
+
+        @app.route("/_dash-update-component", methods=["POST"])
+        def dash_update():
+            return "{}"
+
+        return app, FlaskKeycloak.build(app, config_data=keycloak.config, **kwargs)
+
+    return _build
+
+
+def state_of(response):
+    """The state of a redirect to the Keycloak login page."""
+    return urllib.parse.parse_qs(urllib.parse.urlparse(response.headers["Location"]).query)["state"][0]
+
+
+def login(client, path="/", code="code"):
+    """Log the test client in through the callback, return the callback response."""
+    state = state_of(client.get(path))
+    return client.get(f"/keycloak/callback?code={code}&state={state}")
@@ -0,0 +1,190 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from dash_flask_keycloak.admission import QUEUE_FULL, TIMEOUT, LoginAdmission, LoginRejected
+
+from .conftest import state_of
+
+
+def run_threads(target, *args_list):
+    threads = [threading.Thread(target=target, args=args) for args in args_list]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def slow_exchange(calls, result, delay=0.2):
+    def exchange():
+        calls.append(result)
+        time.sleep(delay)
+        return result
+
+    return exchange
+
+
+def test_same_key_is_exchanged_once():
+    admission = LoginAdmission()
+    calls, results = [], []
+    run_threads(lambda: results.append(admission.exchange("code", slow_exchange(calls, "token"))), *[()] * 4)
+    assert calls == ["token"]
+    assert results == ["token"] * 4
+    assert admission.coalesced == 3
+
+
+def test_other_keys_are_exchanged_apart():
+    admission = LoginAdmission()
+    calls, results = [], []
+    run_threads(lambda key: results.append(admission.exchange(key, slow_exchange(calls, key))), ("a",), ("b",))
+    assert sorted(calls) == sorted(results) == ["a", "b"]
+    assert admission.coalesced == 0
+
+
+def test_calls_without_key_are_never_shared():
+    admission = LoginAdmission()
+    calls, results = [], []
+    run_threads(lambda user: results.append(admission.exchange(None, slow_exchange(calls, user))),
+                ("alice",), ("bob",))
+    assert sorted(results) == ["alice", "bob"]
+    assert admission.coalesced == 0
+
+
+def test_errors_reach_every_caller_and_are_not_remembered():
+    admission = LoginAdmission()
+    errors = []
+
+    def failing():
+        time.sleep(0.1)
+        raise ValueError("invalid_grant")
+
+    def call():
+        try:
+            admission.exchange("code", failing)
+        except ValueError as e:
+            errors.append(e)
+
+    run_threads(call, (), ())
+    assert len(errors) == 2
+    assert admission.exchange("code", lambda: "retried") == "retried"
+
+
+def test_full_queue_is_rejected_at_once():
+    admission = LoginAdmission(max_concurrent=1, max_queue=1, wait_timeout=5)
+    outcomes = []
+
+    def call(key):
+        try:
+            outcomes.append(admission.exchange(key, slow_exchange([], key, 0.3)))
+        except LoginRejected as e:
+            outcomes.append(e.reason)
+
+    run_threads(call, *[(f"code-{i}",) for i in range(4)])
+    assert sorted(outcomes, key=str).count(QUEUE_FULL) == 2
+    assert admission.rejected == 2
+    assert admission.active == admission.waiting == 0
+
+
+def test_queued_login_times_out():
+    admission = LoginAdmission(max_concurrent=1, max_queue=5, wait_timeout=0.1)
+    outcomes = []
+
+    def call(key):
+        try:
+            outcomes.append(admission.exchange(key, slow_exchange([], key, 0.5)))
+        except LoginRejected as e:
+            outcomes.append(e.reason)
+
+    run_threads(call, ("a",), ("b",))
+    assert sorted(outcomes) == ["a", TIMEOUT]
+
+
+def test_async_same_key_is_exchanged_once():
+    admission = LoginAdmission(max_concurrent=2)
+    calls = []
+
+    async def exchange():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return "token"
+
+    async def main():
+        return await asyncio.gather(*[admission.exchange_async("code", exchange) for _ in range(3)],
+                                    admission.exchange_async(None, exchange))
+
+    assert asyncio.run(main()) == ["token"] * 4
+    assert len(calls) == 2
+    assert admission.coalesced == 2
+
+
+def test_concurrent_password_logins_keep_their_own_tokens(build, keycloak):
+    keycloak.latency = 0.2
+    app, _ = build(login_path="/login")
+    users = {}
+
+    def password_login(username):
+        client = app.test_client()
+        client.post("/login", data=dict(username=username, password="secret"))
+        users[username] = client.get("/page").get_data(as_text=True)
+
+    run_threads(password_login, ("alice",), ("bob",))
+    assert users == dict(alice="alice", bob="bob")
+    assert keycloak.calls["token"] == 2
+
+
+def test_duplicate_callbacks_of_a_browser_share_one_exchange(build, keycloak):
+    keycloak.latency = 0.2
+    app, flask_keycloak = build()
+    browser = app.test_client()
+    state = state_of(browser.get("/"))
+    statuses = []
+
+    def callback():
+        statuses.append(app.test_client().get(f"/keycloak/callback?code=same&state={state}").status_code)
+
+    run_threads(callback, *[()] * 3)
+    assert statuses == [302] * 3
+    assert keycloak.calls["token"] == 1
+    assert flask_keycloak.auth_handler.login_admission.coalesced == 2
+
+
+def test_same_code_from_other_browsers_is_not_shared(build, keycloak):
+    keycloak.latency = 0.2
+    app, flask_keycloak = build()
+
+    def callback():
+        browser = app.test_client()
+        state = state_of(browser.get("/"))
+        browser.get(f"/keycloak/callback?code=same&state={state}")
+
+    run_threads(callback, (), ())
+    assert keycloak.calls["token"] == 2
+    assert flask_keycloak.auth_handler.login_admission.coalesced == 0
+
+
+def test_rejected_callback_gets_the_retry_page(build):
+    app, flask_keycloak = build(max_concurrent_logins=1, login_queue_size=0)
+    admission = flask_keycloak.auth_handler.login_admission
+    browser = app.test_client()
+    state = state_of(browser.get("/"))
+    admission._slots.acquire()
+    try:
+        response = browser.get(f"/keycloak/callback?code=busy&state={state}")
+    finally:
+        admission._slots.release()
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "2"
+    assert b'http-equiv="refresh"' in response.data
+    # The code wasn't used, the reload logs in.
+    assert browser.get(f"/keycloak/callback?code=busy&state={state}").status_code == 302
+
+
+@pytest.mark.parametrize("max_concurrent", [None, 2])
+def test_slots_are_released(max_concurrent):
+    admission = LoginAdmission(max_concurrent=max_concurrent)
+    with pytest.raises(RuntimeError):
+        admission.exchange(None, lambda: (_ for _ in ()).throw(RuntimeError()))
+    assert admission.exchange("code", lambda: 1) == 1
+    assert admission.active == 0
@@ -0,0 +1,28 @@
+import asyncio
+
+import pytest
+
+from .conftest import login, state_of
+
+
+def test_asgi_runs_the_same_flow(build, keycloak):
+    httpx = pytest.importorskip("httpx")
+    pytest.importorskip("asgiref")
+    wsgi_app, _ = build()
+    wsgi_client = wsgi_app.test_client()
+    login(wsgi_client, "/page")
+    _, flask_keycloak = build()
+    asgi = flask_keycloak.asgi()
+
+    async def main():
+        transport = httpx.ASGITransport(app=asgi)
+        async with httpx.AsyncClient(transport=transport, base_url="http://localhost") as client:
+            response = await client.get("/page")
+            assert response.status_code == 302
+            assert client.cookies.get("session") is not None
+            response = await client.get(f"/keycloak/callback?code=code&state={state_of(response)}")
+            assert response.headers["location"] == "http://localhost"
+            return (await client.get("/page")).text
+
+    assert asyncio.run(main()) == wsgi_client.get("/page").get_data(as_text=True) == "bench-user"
+    assert keycloak.calls["token"] == 2
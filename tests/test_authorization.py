@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+from dash_flask_keycloak.authorization import AFFIRMATIVE, RoutePolicyIndex
+
+from .conftest import login
+
+
+def role_policy(name, *roles, required=(), logic="POSITIVE"):
+    roles = [dict(id=role, required=False) for role in roles] + [dict(id=role, required=True) for role in required]
+    return dict(name=name, type="role", logic=logic, decisionStrategy="UNANIMOUS", config=dict(roles=json.dumps(roles)))
+
+
+def permission(name, resources, policies, decision_strategy="UNANIMOUS"):
+    return dict(name=name, type="resource", logic="POSITIVE", decisionStrategy=decision_strategy,
+                config=dict(resources=json.dumps(resources), applyPolicies=json.dumps(policies)))
+
+
+def settings(*policies):
+    return dict(resources=[dict(name="admin", uris=["/admin/*"]), dict(name="reports", uris=["/reports"])],
+                policies=list(policies))
+
+
+def index_of(*policies):
+    return RoutePolicyIndex(RoutePolicyIndex.parse_authorization_settings(settings(*policies)))
+
+
+def session_of(*roles, client_roles=()):
+    return dict(data=dict(realm_access=dict(roles=list(roles)), resource_access=dict(app=dict(roles=client_roles))))
+
+
+def test_role_policies():
+    index = index_of(role_policy("admins", "admin", "root"), role_policy("viewers", "app/viewer"),
+                     permission("admin", ["admin"], ["admins"]), permission("reports", ["reports"], ["viewers"]))
+    assert index.is_allowed(session_of("root"), "/admin/users")
+    assert not index.is_allowed(session_of("user"), "/admin/users")
+    assert index.is_allowed(session_of("user", client_roles=["viewer"]), "/reports")
+    assert not index.is_allowed(session_of("user"), "/reports")
+    # No permission protects these paths.
+    assert index.is_allowed(session_of(), "/reports/2024")
+    assert index.is_allowed(session_of(), "/")
+
+
+def test_required_roles():
+    index = index_of(role_policy("admins", "admin", required=["mfa"]), permission("admin", ["admin"], ["admins"]))
+    assert not index.is_allowed(session_of("admin"), "/admin/")
+    assert index.is_allowed(session_of("admin", "mfa"), "/admin/")
+
+
+@pytest.mark.parametrize("decision_strategy, allowed", [("UNANIMOUS", False), (AFFIRMATIVE, True)])
+def test_decision_strategy(decision_strategy, allowed):
+    index = index_of(role_policy("admins", "admin"), role_policy("auditors", "auditor"),
+                     permission("admin", ["admin"], ["admins", "auditors"], decision_strategy))
+    assert index.is_allowed(session_of("auditor"), "/admin/logs") is allowed
+    assert index.is_allowed(session_of("admin", "auditor"), "/admin/logs")
+
+
+@pytest.mark.parametrize("policy", [
+    dict(name="ops", type="group", config=dict(groups='[{"path": "/ops"}]')),
+    dict(name="ops", type="user", config=dict(users='["alice"]')),
+    dict(name="ops", type="client", config=dict(clients='["app"]')),
+    dict(name="ops", type="time", config=dict(hour="8", hourEnd="18")),
+    dict(name="ops", type="aggregate", config=dict(applyPolicies='["admins"]')),
+    role_policy("ops", "admin", logic="NEGATIVE"),
+])
+def test_unsupported_policies_are_refused(policy):
+    with pytest.raises(ValueError, match='applies the .* policy "ops"'):
+        index_of(role_policy("admins", "admin"), policy, permission("admin", ["admin"], ["admins", "ops"]))
+
+
+def test_unknown_policy_is_refused():
+    with pytest.raises(ValueError, match='applies the unknown policy "ops"'):
+        index_of(permission("admin", ["admin"], ["ops"]))
+
+
+def test_settings_are_enforced(build, tmp_path):
+    path = tmp_path / "authorization.json"
+    path.write_text(json.dumps(settings(role_policy("admins", "admin"), permission("admin", ["admin"], ["admins"]))))
+    app, _ = build(authorization_settings_path=str(path))
+
+    @app.route("/admin/users")
+    def users():
+        return "users"
+
+    client = app.test_client()
+    login(client)
+    assert client.get("/page").status_code == 200
+    assert client.get("/admin/users").status_code == 403
+
+
+def test_unsupported_settings_fail_the_build(build, tmp_path):
+    path = tmp_path / "authorization.json"
+    group_policy = dict(name="ops", type="group", logic="POSITIVE")
+    path.write_text(json.dumps(settings(group_policy, permission("admin", ["admin"], ["ops"]))))
+    with pytest.raises(ValueError, match="only role policies"):
+        build(authorization_settings_path=str(path))
@@ -0,0 +1,109 @@
+import time
+
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+import jwt
+
+
+@pytest.fixture
+def api(build):
+    app, flask_keycloak = build(bearer_paths=["^/api/"], route_roles={"^/api/admin": "admin"})
+
+    @app.route("/api/me")
+    @app.route("/api/admin")
+    def me():
+        from flask import g
+        return dict(user=g.claims.preferred_username)
+
+    return app.test_client(), flask_keycloak
+
+
+def access_token(keycloak, **claims):
+    now = int(time.time())
+    base = dict(iss=keycloak.issuer, aud=keycloak.client_id, sub="svc", iat=now, exp=now + 60, typ="Bearer",
+                preferred_username="svc", realm_access=dict(roles=["user"]))
+    return keycloak.sign({key: value for key, value in dict(base, **claims).items() if value is not None})
+
+
+def get(client, token, path="/api/me"):
+    return client.get(path, headers={"Authorization": f"Bearer {token}"})
+
+
+def test_valid_token(api, keycloak):
+    client, flask_keycloak = api
+    token = access_token(keycloak)
+    response = get(client, token)
+    assert response.status_code == 200
+    assert response.json == dict(user="svc")
+    assert "Set-Cookie" not in response.headers
+    assert get(client, token).status_code == 200
+    assert flask_keycloak.auth_handler.bearer_cache.hits == 1
+
+
+def test_missing_token(api):
+    client, _ = api
+    response = client.get("/api/me")
+    assert response.status_code == 401
+    assert response.headers["WWW-Authenticate"] == "Bearer"
+    assert client.get("/api/me", headers={"Authorization": "Basic abc"}).status_code == 401
+
+
+@pytest.mark.parametrize("claims, error", [
+    (dict(aud="account"), "Audience doesn't match"),
+    (dict(typ="ID"), 'Not an access token ("ID" token)'),
+    (dict(typ="Refresh"), 'Not an access token ("Refresh" token)'),
+    (dict(iss="http://evil.example/realms/bench"), "Invalid issuer"),
+    (dict(exp=int(time.time()) - 60), "Signature has expired"),
+    (dict(exp=None), 'Token is missing the "exp" claim'),
+])
+def test_invalid_token(api, keycloak, claims, error):
+    client, _ = api
+    response = get(client, access_token(keycloak, **claims))
+    assert response.status_code == 401
+    assert response.headers["WWW-Authenticate"] == 'Bearer error="invalid_token"'
+    assert response.json == dict(error="invalid_token", error_description=error)
+
+
+def test_id_token_of_a_login_is_rejected(api, keycloak):
+    client, _ = api
+    response = get(client, keycloak.issue_tokens()["id_token"])
+    assert response.status_code == 401
+
+
+def test_token_signed_with_another_key(api, keycloak):
+    client, _ = api
+    other_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    token = jwt.encode(jwt.decode(access_token(keycloak), options={"verify_signature": False}), other_key,
+                       algorithm="RS256", headers={"kid": keycloak.kid})
+    assert get(client, token).status_code == 401
+    assert get(client, "garbage").status_code == 401
+
+
+def test_token_of_another_algorithm_than_its_key(api, keycloak):
+    client, _ = api
+    claims = jwt.decode(access_token(keycloak), options={"verify_signature": False})
+    # HS256 is advertised by the realm, but the key named by the token is an RSA key.
+    token = jwt.encode(claims, "secret", algorithm="HS256", headers={"kid": keycloak.kid})
+    response = get(client, token)
+    assert response.status_code == 401
+    assert response.json["error"] == "invalid_token"
+
+
+def test_bearer_audience(build, keycloak):
+    app, _ = build(bearer_paths=["^/api/"], bearer_audience="account")
+
+    @app.route("/api/me")
+    def me():
+        return "ok"
+
+    client = app.test_client()
+    assert get(client, keycloak.issue_tokens()["access_token"]).status_code == 200
+    assert get(client, access_token(keycloak)).status_code == 401
+
+
+def test_route_roles_apply_to_the_token(api, keycloak):
+    client, _ = api
+    assert get(client, access_token(keycloak), "/api/admin").status_code == 403
+    token = access_token(keycloak, realm_access=dict(roles=["admin"]))
+    assert get(client, token, "/api/admin").status_code == 200
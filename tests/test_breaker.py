@@ -0,0 +1,190 @@
+import asyncio
+import time
+
+import pytest
+
+from dash_flask_keycloak.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+from .conftest import state_of
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, "monotonic", clock)
+    return clock
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def fail(breaker, count):
+    for _ in range(count):
+        assert breaker.allow()
+        breaker.record_failure()
+
+
+def test_opens_at_the_threshold(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    fail(breaker, 2)
+    assert breaker.state == CLOSED
+    fail(breaker, 1)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.rejected == 1
+    assert breaker.retry_after() == 31
+    clock.now += 20
+    assert breaker.retry_after() == 11
+
+
+def test_success_resets_the_count_of_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3)
+    fail(breaker, 2)
+    breaker.record_success()
+    fail(breaker, 2)
+    assert breaker.state == CLOSED
+
+
+def test_half_open_lets_the_probes_through(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, half_open_probes=2)
+    fail(breaker, 1)
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert breaker.retry_after() == 0
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_successful_probe_closes(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    fail(breaker, 2)
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_failed_probe_opens_again(clock):
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=30)
+    fail(breaker, 5)
+    clock.now += 30
+    fail(breaker, 1)
+    assert breaker.state == OPEN
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+
+
+def test_lost_probe_is_given_up_on(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    fail(breaker, 1)
+    clock.now += 30
+    # The probe never reports back.
+    assert breaker.allow()
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+
+
+def test_released_probe_gives_its_slot_back(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    fail(breaker, 1)
+    clock.now += 30
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_server_errors_count_as_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=2)
+    breaker.record(503)
+    breaker.record(404)
+    breaker.record(500)
+    assert breaker.state == CLOSED
+    breaker.record(502)
+    assert breaker.state == OPEN
+
+
+def test_call(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    assert breaker.call(Response, 200).status_code == 200
+
+    def unreachable():
+        raise ConnectionError()
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            breaker.call(unreachable)
+    with pytest.raises(CircuitOpenError, match="retrying in 31s"):
+        breaker.call(Response, 200)
+    clock.now += 30
+    assert breaker.call(Response, 200).status_code == 200
+    assert breaker.state == CLOSED
+
+
+def test_interrupted_call_releases_its_probe(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    fail(breaker, 1)
+    clock.now += 30
+
+    def interrupted():
+        raise KeyboardInterrupt()
+
+    with pytest.raises(KeyboardInterrupt):
+        breaker.call(interrupted)
+    assert breaker.state == HALF_OPEN
+    assert breaker.call(Response, 200).status_code == 200
+    assert breaker.state == CLOSED
+
+
+def test_cancelled_asgi_request_releases_its_probe(build, keycloak):
+    pytest.importorskip("httpx")
+    pytest.importorskip("asgiref")
+    _, flask_keycloak = build(circuit_breaker_threshold=1, circuit_breaker_reset=30)
+    breaker = flask_keycloak.auth_handler.breaker
+    handler = flask_keycloak.asgi().async_auth_handler
+    breaker.record_failure()
+    breaker._opened_at -= 30
+    keycloak.latency = 1.0
+
+    async def main():
+        task = asyncio.ensure_future(handler.request("GET", keycloak.config["server_url"]))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+
+
+def test_open_circuit_answers_503_without_calling_keycloak(build, keycloak):
+    app, flask_keycloak = build(circuit_breaker_threshold=1, circuit_breaker_reset=30)
+    breaker = flask_keycloak.auth_handler.breaker
+    breaker.record_failure()
+    client = app.test_client()
+    state = state_of(client.get("/"))
+    response = client.get(f"/keycloak/callback?code=code&state={state}")
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) > 0
+    assert keycloak.calls["token"] == 0
@@ -0,0 +1,65 @@
+import jwt
+import pytest
+from flask.json.tag import TaggedJSONSerializer
+
+from dash_flask_keycloak.codec import CompactSessionSerializer, split_jwt
+
+from .conftest import login
+
+
+@pytest.fixture
+def session(keycloak):
+    token = keycloak.issue_tokens("alice")
+    data = jwt.decode(token["id_token"], options={"verify_signature": False})
+    user = dict(keycloak.userinfo("alice"), groups=["admins"])
+    return dict(token=token, data=data, user=user, state="abc", _permanent=True)
+
+
+def test_round_trip(session):
+    serializer = CompactSessionSerializer()
+    serialized = serializer.dumps(session)
+    assert serializer.loads(serialized) == session
+    assert len(serialized) < len(TaggedJSONSerializer().dumps(session))
+
+
+def test_claims_not_taken_from_the_id_token_are_kept(session):
+    session["data"] = dict(session["data"], preferred_username="someone-else", extra=[1, 2])
+    serializer = CompactSessionSerializer()
+    assert serializer.loads(serializer.dumps(session)) == session
+
+
+@pytest.mark.parametrize("token", ["not.a.jwt", "a.b", "eyJhbGciOi=.e30.sig", 42, None])
+def test_values_that_are_not_canonical_jwts_are_kept_as_is(session, token):
+    session["token"] = dict(session["token"], id_token=token, access_token="opaque")
+    serializer = CompactSessionSerializer()
+    assert serializer.loads(serializer.dumps(session)) == session
+
+
+def test_split_jwt_rejects_non_canonical_encodings(session):
+    access_token = session["token"]["access_token"]
+    assert split_jwt(access_token) is not None
+    assert split_jwt(access_token + "=") is None
+    assert split_jwt(access_token.replace(".", "..", 1)) is None
+
+
+def test_sessions_of_the_default_serializer_are_read(session):
+    legacy = TaggedJSONSerializer().dumps(session)
+    serializer = CompactSessionSerializer()
+    assert serializer.loads(legacy) == session
+    assert serializer.loads(legacy.encode()) == session
+
+
+def test_only_stored_sessions_are_counted(session):
+    serializer = CompactSessionSerializer()
+    serializer.dumps({})
+    assert serializer.stats()["saves"] == 0
+    serialized = serializer.dumps(session)
+    assert serializer.stats() == dict(saves=1, bytes_last=len(serialized), bytes_mean=float(len(serialized)))
+
+
+def test_compact_cookie_session(build):
+    app, _ = build(compact_session=True)
+    client = app.test_client()
+    response = login(client)
+    assert response.status_code == 302
+    assert client.get("/page").get_data(as_text=True) == "bench-user"
@@ -0,0 +1,112 @@
+import json
+import threading
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+
+from dash_flask_keycloak.cache import JWKSCache, drop_jwks_cache, get_jwks_cache
+
+
+def jwk(kid):
+    key = json.loads(RSAAlgorithm.to_jwk(rsa.generate_private_key(public_exponent=65537, key_size=2048).public_key()))
+    return dict(key, kid=kid, use="sig", alg="RS256")
+
+
+KEYS = dict(old=jwk("old"), new=jwk("new"))
+
+
+class Fetch:
+    """JWKS endpoint serving the ``kids`` of KEYS, slowly enough for concurrent misses to overlap."""
+
+    def __init__(self, *kids, delay=0.1):
+        self.kids = list(kids)
+        self.delay = delay
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        if not self.kids:
+            raise ConnectionError("Keycloak is down")
+        return {"keys": [KEYS[kid] for kid in self.kids]}
+
+
+def test_concurrent_misses_share_one_fetch():
+    fetch = Fetch("old")
+    cache = JWKSCache("uri", fetch=fetch)
+    keys = []
+    threads = [threading.Thread(target=lambda: keys.append(cache.get_signing_key("old"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert fetch.calls == 1
+    assert {key.key_id for key in keys} == {"old"}
+    assert cache.get_signing_key("old") is keys[0]
+    assert fetch.calls == 1
+
+
+def test_rotated_key_is_fetched_once_per_refetch_interval():
+    fetch = Fetch("old", delay=0)
+    cache = JWKSCache("uri", fetch=fetch, refetch_interval=0.2)
+    cache.get_signing_key("old")
+    fetch.kids = ["old", "new"]
+    # Fetched just now, a token of an unknown key doesn't refetch.
+    with pytest.raises(jwt.PyJWKClientError):
+        cache.get_signing_key("new")
+    assert fetch.calls == 1
+    time.sleep(0.2)
+    assert cache.get_signing_key("new").key_id == "new"
+    assert fetch.calls == 2
+    with pytest.raises(jwt.PyJWKClientError):
+        cache.get_signing_key("forged")
+    assert fetch.calls == 2
+
+
+def test_expired_key_set_is_fetched_again():
+    fetch = Fetch("old", delay=0)
+    cache = JWKSCache("uri", fetch=fetch, ttl=0.1)
+    cache.get_signing_key("old")
+    time.sleep(0.1)
+    fetch.kids = ["new"]
+    assert cache.get_signing_key("new").key_id == "new"
+    with pytest.raises(jwt.PyJWKClientError):
+        cache.get_signing_key("old")
+
+
+def test_known_keys_are_used_while_keycloak_is_down():
+    fetch = Fetch("old", delay=0)
+    cache = JWKSCache("uri", fetch=fetch, ttl=0.1, refetch_interval=10, max_stale=60)
+    cache.get_signing_key("old")
+    time.sleep(0.1)
+    fetch.kids = []
+    assert cache.get_signing_key("old").key_id == "old"
+    assert cache.get_signing_key("old").key_id == "old"
+    # The failed fetch is only retried after the refetch interval.
+    assert fetch.calls == 2
+
+
+def test_no_key_without_keycloak():
+    cache = JWKSCache("uri", fetch=Fetch(delay=0))
+    with pytest.raises(ConnectionError):
+        cache.get_signing_key("old")
+
+
+def test_caches_are_shared_by_handlers_of_the_same_options():
+    scope = object()
+    cache = get_jwks_cache("uri", ttl=60, fetch=Fetch("old"), scope=scope)
+    assert get_jwks_cache("uri", ttl=60, fetch=Fetch("new"), scope=scope) is cache
+    assert get_jwks_cache("uri", ttl=5, scope=scope) is not cache
+    assert get_jwks_cache("uri", ttl=60, scope=object()) is not cache
+    drop_jwks_cache(cache)
+    assert get_jwks_cache("uri", ttl=60, scope=scope) is not cache
+
+
+def test_other_builds_get_their_own_cache(build):
+    _, first = build()
+    _, second = build(jwks_cache_ttl=5)
+    assert first.auth_handler.jwks_cache is not second.auth_handler.jwks_cache
+    assert (first.auth_handler.jwks_cache.ttl, second.auth_handler.jwks_cache.ttl) == (300, 5)
@@ -0,0 +1,41 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+from dash_flask_keycloak.lazy import LazyModule, lazy_import, load
+
+DEFERRED = ("jwt", "keycloak", "requests")
+
+
+def run(statement):
+    probe = (f"import json, sys\n{statement}\n"
+             f"print(json.dumps(sorted(name for name in sys.modules if name.split('.')[0] in {DEFERRED!r})))")
+    output = subprocess.run([sys.executable, "-c", probe], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+@pytest.mark.parametrize("statement", ["import dash_flask_keycloak",
+                                       "from dash_flask_keycloak import FlaskKeycloak"])
+def test_import_loads_no_deferred_module(statement):
+    assert run(statement) == []
+
+
+def test_deferred_modules_are_the_regular_ones():
+    statement = ("from dash_flask_keycloak import core\n"
+                 "from keycloak.exceptions import KeycloakError\n"
+                 "assert core.keycloak.KeycloakError is KeycloakError\n"
+                 "import jwt\n"
+                 "assert core.jwt.DecodeError is jwt.DecodeError")
+    assert "keycloak.exceptions" in run(statement)
+
+
+def test_lazy_module():
+    module = LazyModule("json")
+    assert module.dumps([1]) == "[1]"
+    assert module.decoder.JSONDecodeError is json.JSONDecodeError
+    with pytest.raises(AttributeError):
+        module.__missing__
+    assert lazy_import("json") is json
+    load(module, json)
@@ -0,0 +1,32 @@
+import json
+
+from .conftest import state_of
+
+
+def test_login_flow(build, keycloak):
+    app, _ = build()
+    client = app.test_client()
+    response = client.get("/page?tab=1")
+    assert response.status_code == 302
+    assert response.location.startswith(f"{keycloak.issuer}/protocol/openid-connect/auth")
+    response = client.get(f"/keycloak/callback?code=code&state={state_of(response)}")
+    assert response.location == "http://localhost"
+    assert client.get("/page").get_data(as_text=True) == "bench-user"
+    assert client.get("/logout").status_code == 302
+    assert client.get("/page").status_code == 302
+
+
+def test_callback_with_another_state_is_rejected(build):
+    app, _ = build()
+    client = app.test_client()
+    client.get("/")
+    assert client.get("/keycloak/callback?code=code&state=other").status_code == 400
+
+
+def test_dash_updates_get_the_json_navigation(build):
+    app, _ = build(abort_on_unauthorized=["^/api/"])
+    client = app.test_client()
+    response = client.post("/_dash-update-component")
+    assert response.status_code == 200
+    assert json.loads(response.data) == {"multi": True, "response": {"url": {"pathname": "/login"}}}
+    assert client.get("/api/data").status_code == 401
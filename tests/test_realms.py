@@ -0,0 +1,18 @@
+from .conftest import state_of
+
+
+def test_path_realm_falls_back_to_the_session_realm(build):
+    app, _ = build(realms=["bench"], realm_from="path")
+
+    @app.route("/bench/")
+    def home():
+        return "home"
+
+    client = app.test_client()
+    assert client.post("/_dash-update-component").status_code == 404
+    state = state_of(client.get("/bench/"))
+    assert client.get(f"/bench/keycloak/callback?code=code&state={state}").status_code == 302
+    # Dash updates and logout are not under the realm prefix.
+    assert client.post("/_dash-update-component").status_code == 200
+    assert client.get("/logout").status_code == 302
+    assert client.get("/bench/").status_code == 302
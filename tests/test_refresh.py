@@ -0,0 +1,151 @@
+import json
+import threading
+import time
+
+import pytest
+from keycloak.exceptions import KeycloakConnectionError, KeycloakPostError
+
+from dash_flask_keycloak.refresh import TokenRefresher, is_rejected
+
+from .conftest import login
+
+
+class FakeOpenID:
+    """Refresh grant answering with ``outcome``: a token, or an exception to raise."""
+
+    def __init__(self, outcome, delay=0.1):
+        self.outcome = outcome
+        self.delay = delay
+        self.calls = 0
+
+    def refresh_token(self, refresh_token):
+        self.calls += 1
+        time.sleep(self.delay)
+        if isinstance(self.outcome, Exception):
+            raise self.outcome
+        return dict(self.outcome, refresh_token=refresh_token + "'")
+
+
+TOKEN = dict(refresh_token="refresh", expires_at=0)
+
+
+def refresh_concurrently(refresher, count=4):
+    results = []
+
+    def refresh():
+        try:
+            results.append(refresher.refresh(TOKEN))
+        except Exception as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=refresh) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_refreshes_of_a_token_share_one_call():
+    openid = FakeOpenID(dict(access_token="new", expires_in=300))
+    refresher = TokenRefresher(openid)
+    results = refresh_concurrently(refresher)
+    assert openid.calls == 1
+    assert [result["refresh_token"] for result in results] == ["refresh'"] * 4
+    # Requests still carrying the old token pick up the new one.
+    assert refresher.refresh(TOKEN)["access_token"] == "new"
+    assert openid.calls == 1
+
+
+def test_rejected_refresh_is_raised_to_every_request():
+    openid = FakeOpenID(KeycloakPostError("invalid_grant", response_code=400))
+    refresher = TokenRefresher(openid)
+    results = refresh_concurrently(refresher)
+    assert all(isinstance(result, KeycloakPostError) for result in results)
+    with pytest.raises(KeycloakPostError):
+        refresher.refresh(TOKEN)
+    assert openid.calls == 1
+
+
+def test_failed_refresh_is_retried_after_the_retry_interval():
+    openid = FakeOpenID(KeycloakConnectionError("Keycloak is down"), delay=0)
+    refresher = TokenRefresher(openid, retry_interval=0.2)
+    with pytest.raises(KeycloakConnectionError):
+        refresher.refresh(TOKEN)
+    # Meanwhile, the requests of the token go on with it.
+    assert [refresher.refresh(TOKEN) for _ in range(10)] == [None] * 10
+    assert openid.calls == 1
+    time.sleep(0.2)
+    openid.outcome = dict(access_token="new", expires_in=300)
+    assert refresher.refresh(TOKEN)["access_token"] == "new"
+    assert openid.calls == 2
+
+
+def test_background_refresh_doesnt_wait():
+    openid = FakeOpenID(dict(access_token="new", expires_in=300), delay=0.2)
+    refresher = TokenRefresher(openid, background=True)
+    assert refresher.refresh(TOKEN, wait=False) is None
+    time.sleep(0.3)
+    assert refresher.refresh(TOKEN, wait=False)["access_token"] == "new"
+    assert openid.calls == 1
+
+
+@pytest.mark.parametrize("error, rejected", [
+    (KeycloakPostError("invalid_grant", response_code=400), True),
+    (KeycloakPostError("unauthorized_client", response_code=401), True),
+    (KeycloakPostError("server_error", response_code=503), False),
+    (KeycloakConnectionError("Keycloak is down"), False),
+])
+def test_is_rejected(error, rejected):
+    assert is_rejected(error) is rejected
+
+
+@pytest.fixture
+def expiring(build, keycloak):
+    """A logged in client whose token has expired."""
+
+    def _expiring(**kwargs):
+        keycloak.token_lifetime = 1
+        app, flask_keycloak = build(refresh_margin=0, **kwargs)
+        client = app.test_client()
+        login(client)
+        keycloak.calls.clear()
+        time.sleep(1.1)
+        return client, flask_keycloak
+
+    return _expiring
+
+
+def test_expired_token_is_refreshed(expiring, keycloak):
+    keycloak.token_lifetime = 300
+    client, _ = expiring()
+    keycloak.token_lifetime = 300
+    for _ in range(5):
+        assert client.get("/page").status_code == 200
+    assert keycloak.calls["token"] == 1
+
+
+@pytest.mark.parametrize("background", [False, True])
+def test_rejected_refresh_ends_the_session(expiring, keycloak, background):
+    client, flask_keycloak = expiring(background_refresh=background)
+    keycloak.failures["token"] = 400
+    response = client.get("/page")
+    assert response.status_code == 302
+    assert response.location.startswith(keycloak.issuer)
+    assert [client.get("/page").status_code for _ in range(9)] == [302] * 9
+    assert keycloak.calls["token"] == 1
+    assert flask_keycloak.metrics.counters[("refresh_rejected_total", ())] == 1
+
+
+def test_rejected_refresh_of_a_dash_update(expiring, keycloak):
+    client, _ = expiring()
+    keycloak.failures["token"] = 400
+    response = client.post("/_dash-update-component")
+    assert json.loads(response.data) == {"multi": True, "response": {"url": {"pathname": "/login"}}}
+
+
+def test_refresh_backs_off_while_keycloak_fails(expiring, keycloak):
+    client, _ = expiring()
+    keycloak.failures["token"] = 503
+    assert [client.get("/page").status_code for _ in range(10)] == [200] * 10
+    assert keycloak.calls["token"] == 1
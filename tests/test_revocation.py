@@ -0,0 +1,138 @@
+import time
+
+import jwt
+import pytest
+
+from dash_flask_keycloak.revocation import BACKCHANNEL_LOGOUT_EVENT, RevocationIndex, validate_logout_token
+from dash_flask_keycloak.shared import SharedCache
+
+from .conftest import login
+
+
+def test_revoked_sid():
+    index = RevocationIndex()
+    assert not index.is_revoked("sid-1", "alice", time.time())
+    index.revoke(sid="sid-1")
+    assert index.is_revoked("sid-1", "alice", time.time() + 60)
+    assert not index.is_revoked("sid-2", "alice", time.time())
+
+
+def test_revoked_sub_only_ends_tokens_issued_before():
+    index = RevocationIndex()
+    index.revoke(sub="alice", revoked_at=1000)
+    assert index.is_revoked("sid-1", "alice", 999)
+    assert index.is_revoked("sid-1", "alice", 1000)
+    assert index.is_revoked(None, "alice", None)
+    # Logged in again after the revocation.
+    assert not index.is_revoked("sid-2", "alice", 1001)
+    assert not index.is_revoked("sid-1", "bob", 999)
+
+
+def test_later_revocation_of_a_sub_wins():
+    index = RevocationIndex()
+    index.revoke(sub="alice", revoked_at=2000)
+    index.revoke(sub="alice", revoked_at=1000)
+    assert index.is_revoked(None, "alice", 1500)
+
+
+def test_expired_entries_are_purged():
+    index = RevocationIndex(ttl=10, purge_interval=0)
+    index.revoke(sid="old", revoked_at=time.time() - 20)
+    index.revoke(sid="new")
+    assert len(index) == 1
+    assert not index.is_revoked("old")
+
+
+def test_shared_between_workers(tmp_path):
+    path = tmp_path / "shared"
+    worker, other_worker = RevocationIndex(shared=SharedCache(path)), RevocationIndex(shared=SharedCache(path))
+    worker.revoke(sid="sid-1")
+    revoked_at = time.time()
+    worker.revoke(sub="alice", revoked_at=revoked_at)
+    assert other_worker.is_revoked("sid-1")
+    assert other_worker.is_revoked(None, "alice", revoked_at - 1)
+    assert not other_worker.is_revoked(None, "alice", revoked_at + 1)
+
+
+@pytest.mark.parametrize("claims, error", [
+    (dict(sid="sid-1"), "back-channel logout event"),
+    (dict(sid="sid-1", events={"other": {}}), "back-channel logout event"),
+    (dict(sid="sid-1", events={BACKCHANNEL_LOGOUT_EVENT: {}}, nonce="n"), "nonce"),
+    (dict(events={BACKCHANNEL_LOGOUT_EVENT: {}}), "neither sid nor sub"),
+])
+def test_invalid_logout_tokens(claims, error):
+    with pytest.raises(jwt.InvalidTokenError, match=error):
+        validate_logout_token(claims)
+
+
+def logout_token(keycloak, **claims):
+    base = dict(iss=keycloak.issuer, aud=keycloak.client_id, iat=int(time.time()),
+                events={BACKCHANNEL_LOGOUT_EVENT: {}})
+    return keycloak.sign({key: value for key, value in dict(base, **claims).items() if value is not None})
+
+
+def session_data(app, client):
+    serializer = app.session_interface.get_signing_serializer(app)
+    return serializer.loads(client.get_cookie("session").value)["data"]
+
+
+@pytest.fixture
+def protected(build):
+    app, _ = build(backchannel_logout_path="/keycloak/backchannel")
+    return app
+
+
+def test_backchannel_logout_by_sid(protected, keycloak):
+    client, other_client = protected.test_client(), protected.test_client()
+    login(client)
+    login(other_client)
+    sid = session_data(protected, client)["sid"]
+    response = protected.test_client().post("/keycloak/backchannel",
+                                             data=dict(logout_token=logout_token(keycloak, sid=sid, sub="bench-user")))
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "no-store"
+    assert client.get("/page").status_code == 302
+    # Only the session named by the token ends.
+    assert other_client.get("/page").status_code == 200
+
+
+def test_backchannel_logout_by_sub(protected, keycloak):
+    client = protected.test_client()
+    login(client)
+    time.sleep(1)
+    token = logout_token(keycloak, sub="bench-user")
+    assert protected.test_client().post("/keycloak/backchannel", data=dict(logout_token=token)).status_code == 200
+    assert client.get("/page").status_code == 302
+    time.sleep(1)
+    # A login after the revocation isn't affected.
+    login(client)
+    assert client.get("/page").status_code == 200
+
+
+@pytest.mark.parametrize("claims", [
+    dict(aud="account", sid="sid-1"),
+    dict(iss="http://evil.example/realms/bench", sid="sid-1"),
+    dict(sid="sid-1", events={}),
+    dict(sid="sid-1", iat=None),
+])
+def test_backchannel_logout_rejects_invalid_tokens(protected, keycloak, claims):
+    response = protected.test_client().post("/keycloak/backchannel",
+                                            data=dict(logout_token=logout_token(keycloak, **claims)))
+    assert response.status_code == 400
+    assert response.json["error"] == "invalid_request"
+    assert protected.test_client().post("/keycloak/backchannel").status_code == 400
+
+
+@pytest.mark.parametrize("token", ["garbage", "a.b.c"])
+def test_backchannel_logout_rejects_malformed_tokens(protected, token):
+    response = protected.test_client().post("/keycloak/backchannel", data=dict(logout_token=token))
+    assert response.status_code == 400
+    assert response.json["error"] == "invalid_request"
+
+
+def test_backchannel_logout_rejects_tokens_of_another_algorithm(protected, keycloak):
+    claims = jwt.decode(logout_token(keycloak, sid="sid-1"), options={"verify_signature": False})
+    token = jwt.encode(claims, "secret", algorithm="HS256", headers={"kid": keycloak.kid})
+    response = protected.test_client().post("/keycloak/backchannel", data=dict(logout_token=token))
+    assert response.status_code == 400
+    assert response.json["error"] == "invalid_request"
@@ -0,0 +1,112 @@
+import time
+
+import pytest
+
+from dash_flask_keycloak import MemorySessionStore, RedisSessionStore, SQLiteSessionStore
+
+from .conftest import login, state_of
+
+
+class FakeRedis:
+    """The few methods of redis.Redis used by RedisSessionStore."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        entry = self.data.get(key)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[0]
+
+    def setex(self, key, ttl, value):
+        self.data[key] = (value, time.time() + ttl)
+
+    def expire(self, key, ttl):
+        if key in self.data:
+            self.data[key] = (self.data[key][0], time.time() + ttl)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemorySessionStore()
+    if request.param == "sqlite":
+        return SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    return RedisSessionStore(FakeRedis())
+
+
+def test_store(store):
+    assert store.load("sid") is None
+    store.save("sid", b"payload", 60)
+    assert store.load("sid") == b"payload"
+    store.save("sid", b"other", 60)
+    assert store.load("sid") == b"other"
+    store.delete("sid")
+    assert store.load("sid") is None
+    store.delete("sid")
+
+
+def test_sessions_expire(store):
+    store.save("sid", b"payload", 1)
+    store.touch("sid", 3)
+    time.sleep(1.1)
+    assert store.load("sid") == b"payload"
+    store.touch("sid", 0)
+    assert store.load("sid") is None
+
+
+def test_memory_store_is_bounded():
+    store = MemorySessionStore(maxsize=2)
+    for sid in ("a", "b", "c"):
+        store.save(sid, sid.encode(), 60)
+    assert store.load("a") is None
+    assert store.load("c") == b"c"
+
+
+def test_cookie_only_carries_the_session_id(build, store):
+    app, _ = build(session_store=store)
+    client = app.test_client()
+    login(client)
+    sid = client.get_cookie("session").value
+    assert len(sid) < 64
+    assert store.load(sid) is not None
+    assert client.get("/page").get_data(as_text=True) == "bench-user"
+
+
+def test_login_moves_the_session_to_a_new_id(build, store):
+    app, _ = build(session_store=store)
+    client = app.test_client()
+    state = state_of(client.get("/"))
+    anonymous_sid = client.get_cookie("session").value
+    assert store.load(anonymous_sid) is not None
+    client.get(f"/keycloak/callback?code=code&state={state}")
+    sid = client.get_cookie("session").value
+    assert sid != anonymous_sid
+    assert store.load(anonymous_sid) is None
+
+
+def test_fixated_session_id_is_not_logged_in(build, store):
+    app, _ = build(session_store=store)
+    attacker = app.test_client()
+    state_of(attacker.get("/"))
+    fixated = attacker.get_cookie("session").value
+    victim = app.test_client()
+    victim.set_cookie("session", fixated)
+    login(victim)
+    assert victim.get_cookie("session").value != fixated
+    attacker.set_cookie("session", fixated)
+    assert attacker.get("/page").status_code == 302
+
+
+def test_logout_deletes_the_session(build, store):
+    app, _ = build(session_store=store)
+    client = app.test_client()
+    login(client)
+    sid = client.get_cookie("session").value
+    client.get("/logout")
+    assert store.load(sid) is None
+    assert client.get("/page").status_code == 302
@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+from dash_flask_keycloak.shared import _SEQ, SharedCache
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "shared"
+
+
+def test_set_and_get(path):
+    cache = SharedCache(path, slots=16, slot_size=256)
+    assert cache.get("key") is None
+    assert cache.set("key", b"value", time.time() + 60)
+    assert cache.get("key") == b"value"
+    assert cache.set("key", b"other", time.time() + 60)
+    assert cache.get("key") == b"other"
+    assert cache.get("missing") is None
+
+
+def test_entries_expire(path):
+    cache = SharedCache(path, slots=16, slot_size=256)
+    cache.set("key", b"value", time.time() - 1)
+    assert cache.get("key") is None
+
+
+def test_value_larger_than_a_slot_is_not_stored(path):
+    cache = SharedCache(path, slots=16, slot_size=256)
+    assert not cache.set("key", bytes(cache.max_payload + 1), time.time() + 60)
+    assert cache.get("key") is None
+    assert cache.set("key", bytes(cache.max_payload), time.time() + 60)
+
+
+def test_processes_share_the_file(path):
+    worker = SharedCache(path, slots=16, slot_size=256)
+    # The geometry of the existing file wins over the arguments.
+    other_worker = SharedCache(path, slots=1024, slot_size=4096)
+    assert (other_worker.slots, other_worker.slot_size) == (16, 256)
+    worker.set("key", b"value", time.time() + 60)
+    assert other_worker.get("key") == b"value"
+    other_worker.set("key", b"other", time.time() + 60)
+    assert worker.get("key") == b"other"
+
+
+def test_entry_expiring_first_is_evicted(path):
+    # Every key probes every slot.
+    cache = SharedCache(path, slots=4, slot_size=256, probes=4)
+    now = time.time()
+    for i, ttl in enumerate([40, 10, 30, 20]):
+        cache.set(f"key-{i}", b"value", now + ttl)
+    cache.set("new", b"value", now + 60)
+    assert cache.get("new") == b"value"
+    assert cache.get("key-1") is None
+    assert all(cache.get(f"key-{i}") == b"value" for i in (0, 2, 3))
+    # An expired entry is replaced before any live one.
+    cache.set("key-3", b"value", now - 1)
+    cache.set("newer", b"value", now + 5)
+    assert cache.get("key-0") == b"value"
+    assert cache.get("newer") == b"value"
+
+
+def slot_of(cache, key):
+    return next(cache._offsets(cache.digest(key)))
+
+
+def test_slot_being_written_is_not_read(path):
+    cache = SharedCache(path, slots=16, slot_size=256, probes=1)
+    cache.set("key", b"value", time.time() + 60)
+    offset = slot_of(cache, "key")
+    seq = _SEQ.unpack_from(cache._map, offset)[0]
+    _SEQ.pack_into(cache._map, offset, seq + 1)
+    assert cache.get("key") is None
+    _SEQ.pack_into(cache._map, offset, seq + 2)
+    assert cache.get("key") == b"value"
+
+
+def test_torn_payload_is_not_read(path):
+    cache = SharedCache(path, slots=16, slot_size=256, probes=1)
+    cache.set("key", b"value", time.time() + 60)
+    payload = slot_of(cache, "key") + cache.slot_size - cache.max_payload
+    cache._map[payload:payload + 5] = b"VALUE"
+    assert cache.get("key") is None
+
+
+def test_concurrent_reads_see_whole_values(path):
+    writer, reader = SharedCache(path, slots=4, slot_size=8192), SharedCache(path)
+    values = [bytes([i]) * 8000 for i in range(4)]
+    writer.set("key", values[0], time.time() + 60)
+    stop = threading.Event()
+
+    def write():
+        i = 0
+        while not stop.is_set():
+            writer.set("key", values[i % len(values)], time.time() + 60)
+            i += 1
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    try:
+        seen = [reader.get("key") for _ in range(2000)]
+    finally:
+        stop.set()
+        thread.join()
+    assert set(seen) <= set(values) | {None}
+    assert set(seen) & set(values)
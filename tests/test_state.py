@@ -0,0 +1,81 @@
+import time
+
+from itsdangerous import URLSafeTimedSerializer
+
+from dash_flask_keycloak.core import STATE_NONCE_COOKIE
+
+from .conftest import state_of
+
+
+def test_returns_to_the_page_of_the_state(build):
+    app, _ = build(signed_state=True)
+    client = app.test_client()
+    response = client.get("/page?tab=1")
+    assert client.get_cookie(STATE_NONCE_COOKIE) is not None
+    assert client.get_cookie("session") is None
+    response = client.get(f"/keycloak/callback?code=code&state={state_of(response)}")
+    assert response.status_code == 302
+    assert response.location == "http://localhost/page?tab=1"
+
+
+def test_several_tabs_log_in_at_once(build):
+    app, _ = build(signed_state=True)
+    client = app.test_client()
+    first, second = state_of(client.get("/page?tab=1")), state_of(client.get("/page?tab=2"))
+    assert client.get(f"/keycloak/callback?code=a&state={second}").location.endswith("/page?tab=2")
+    # Already logged in, the first tab just goes back to its page.
+    assert client.get(f"/keycloak/callback?code=b&state={first}").location.endswith("/page?tab=1")
+
+
+def test_tampered_state_is_rejected(build):
+    app, _ = build(signed_state=True)
+    client = app.test_client()
+    state = state_of(client.get("/page"))
+    tampered = state[:-2] + ("AA" if not state.endswith("AA") else "BB")
+    assert client.get(f"/keycloak/callback?code=code&state={tampered}").status_code == 400
+    assert client.get("/keycloak/callback?code=code").status_code == 400
+
+
+def test_state_of_another_browser_is_rejected(build):
+    app, _ = build(signed_state=True)
+    attacker, victim = app.test_client(), app.test_client()
+    state = state_of(attacker.get("/page"))
+    # Login CSRF: the victim would otherwise be logged into the attacker's account.
+    assert victim.get(f"/keycloak/callback?code=attacker&state={state}").status_code == 400
+    victim.get("/page")
+    assert victim.get(f"/keycloak/callback?code=attacker&state={state}").status_code == 400
+    assert attacker.get(f"/keycloak/callback?code=attacker&state={state}").status_code == 302
+
+
+def test_expired_state_is_rejected(build, monkeypatch):
+    _, flask_keycloak = build(signed_state=True, state_max_age=60)
+    auth_handler = flask_keycloak.auth_handler
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now - 120)
+    expired = auth_handler.make_state("nonce", "/page")
+    monkeypatch.setattr(time, "time", lambda: now)
+    fresh = auth_handler.make_state("nonce", "/page")
+    assert auth_handler.load_state(expired, "nonce") is None
+    assert auth_handler.load_state(fresh, "nonce") == dict(nonce="nonce", return_path="/page")
+    assert auth_handler.load_state(fresh, "other") is None
+    assert auth_handler.load_state(fresh, None) is None
+
+
+def test_state_of_another_realm_is_rejected(build, keycloak):
+    app, flask_keycloak = build(signed_state=True)
+    other_realm = URLSafeTimedSerializer(app.config["SECRET_KEY"],
+                                         salt=f"dash-flask-keycloak-state|{keycloak.base_url}/realms/other")
+    assert flask_keycloak.auth_handler.load_state(other_realm.dumps(["nonce", "/"]), "nonce") is None
+
+
+def test_external_return_paths_are_ignored(build):
+    app, flask_keycloak = build(signed_state=True)
+    client = app.test_client()
+    client.get("/page")
+    nonce = client.get_cookie(STATE_NONCE_COOKIE).value
+    for return_path in ("//evil.example/x", "https://evil.example/", "/\\evil.example"):
+        state = flask_keycloak.auth_handler.make_state(nonce, return_path)
+        response = client.get(f"/keycloak/callback?code=code&state={state}")
+        assert response.location == "http://localhost", return_path
+        client.get("/logout")
+        client.get("/page")
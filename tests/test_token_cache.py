@@ -0,0 +1,76 @@
+import time
+
+import jwt
+import pytest
+
+from dash_flask_keycloak.cache import TokenCache, check_expiry
+
+from .conftest import login
+
+
+def test_verified_tokens_are_cached_until_their_expiry():
+    cache = TokenCache(maxsize=2)
+    now = int(time.time())
+    cache.put("valid", dict(sub="alice", exp=now + 60))
+    cache.put("expired", dict(sub="bob", exp=now - 1))
+    cache.put("no-expiry", dict(sub="carol"))
+    assert cache.get("valid") == dict(sub="alice", exp=now + 60)
+    with pytest.raises(jwt.ExpiredSignatureError):
+        cache.get("expired")
+    assert cache.get("no-expiry") is None
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_least_recently_used_tokens_are_evicted():
+    cache = TokenCache(maxsize=2)
+    exp = int(time.time()) + 60
+    for token in ("a", "b"):
+        cache.put(token, dict(exp=exp))
+    cache.get("a")
+    cache.put("c", dict(exp=exp))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+
+@pytest.mark.parametrize("claims, error", [
+    (dict(exp=int(time.time()) - 1), jwt.ExpiredSignatureError),
+    (dict(exp="soon"), jwt.DecodeError),
+])
+def test_check_expiry(claims, error):
+    with pytest.raises(error):
+        check_expiry(claims)
+    assert check_expiry(dict(exp=int(time.time()) + 60, sub="alice")) == dict(exp=int(time.time()) + 60, sub="alice")
+
+
+def test_id_token_is_verified_once_per_session(build):
+    app, flask_keycloak = build()
+    client = app.test_client()
+    login(client)
+    for _ in range(20):
+        assert client.get("/page").status_code == 200
+    assert flask_keycloak.auth_handler.metrics.histograms["jwt_verify"].count == 1
+
+
+def test_expired_id_token_is_verified_once(build, keycloak):
+    keycloak.token_lifetime = 1
+    app, flask_keycloak = build()
+    client = app.test_client()
+    login(client)
+    time.sleep(1.1)
+    # Expired id_tokens are still accepted (the session outlives them), their signature isn't checked again.
+    for _ in range(20):
+        assert client.get("/page").status_code == 200
+    auth_handler = flask_keycloak.auth_handler
+    assert auth_handler.metrics.histograms["jwt_verify"].count == 1
+    assert auth_handler.token_cache.hits == 20
+
+
+def test_forged_id_token_is_not_cached(build, keycloak):
+    _, flask_keycloak = build()
+    auth_handler = flask_keycloak.auth_handler
+    claims = jwt.decode(keycloak.issue_tokens()["id_token"], options={"verify_signature": False})
+    forged = jwt.encode(claims, "secret", algorithm="HS256", headers={"kid": keycloak.kid})
+    for _ in range(2):
+        with pytest.raises(jwt.PyJWTError):
+            auth_handler.decode_id_token(forged)
+    assert len(auth_handler.token_cache) == 0
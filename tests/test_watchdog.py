@@ -0,0 +1,87 @@
+from datetime import timedelta
+
+import pytest
+from dash import Dash, html
+
+from dash_flask_keycloak import FlaskKeycloak
+
+from .conftest import login
+
+COOKIE = "keycloak_session_expiry"
+
+
+@pytest.fixture
+def build_dash(keycloak):
+    """Build a protected Dash app with the session watchdog, return its Flask server."""
+
+    def _build(**kwargs):
+        app = Dash(__name__)
+        app.layout = html.Div(["page"])
+        server = app.server
+
+        @server.route("/public/status")
+        def status():
+            return "<p>ok</p>"
+
+        FlaskKeycloak.build(app, config_data=keycloak.config, session_watchdog=True, logout_path="/logout",
+                            uri_whitelist=["^/public/"], **kwargs)
+        return server
+
+    return _build
+
+
+@pytest.fixture
+def dash_app(build_dash):
+    return build_dash(session_lifetime=timedelta(hours=1))
+
+
+def expiry_cookie(response):
+    return [header for header in response.headers.getlist("Set-Cookie") if header.startswith(COOKIE + "=")]
+
+
+def test_pages_publish_the_session_expiry(dash_app):
+    client = dash_app.test_client()
+    login(client)
+    response = client.get("/")
+    assert response.status_code == 200
+    assert expiry_cookie(response)
+    now, refresh_at, expires_at = client.get_cookie(COOKIE).value.split("_")
+    # Without refresh_margin, no refresh is due.
+    assert refresh_at == ""
+    assert int(expires_at) - int(now) == 3600
+
+
+def test_session_route_publishes_the_session_expiry(dash_app):
+    client = dash_app.test_client()
+    login(client)
+    response = client.get("/keycloak/session")
+    assert response.status_code == 204
+    assert expiry_cookie(response)
+
+
+@pytest.mark.parametrize("path", ["/public/status", "/_dash-layout", "/_dash-dependencies"])
+def test_other_responses_are_left_alone(dash_app, path):
+    client = dash_app.test_client()
+    login(client)
+    client.get("/")
+    response = client.get(path)
+    assert response.status_code == 200
+    assert not expiry_cookie(response)
+
+
+def test_whitelisted_routes_do_not_read_the_session(build_dash):
+    # Not permanent, Flask doesn't read the session either.
+    client = build_dash().test_client()
+    login(client)
+    assert expiry_cookie(client.get("/"))
+    response = client.get("/public/status")
+    assert "Cookie" not in response.vary
+    assert "Set-Cookie" not in response.headers
+
+
+def test_logout_removes_the_cookie(dash_app):
+    client = dash_app.test_client()
+    login(client)
+    client.get("/")
+    client.get("/logout")
+    assert client.get_cookie(COOKIE) is None